@@ -0,0 +1,143 @@
+"""
+Box-level patches and versions for per-image annotations.
+
+A label's version is derived from where it is stored: size and checksum of
+the .txt file, or the revision of its last write in the annotation store. Clients send
+the version they loaded as base_version, and a save against a label that has
+changed since is rejected with 409 instead of silently overwriting it.
+
+Box ids are "box_<line index>", as produced by parse_yolo_file, so a patch
+only rewrites the lines it names; every other line is written back as is.
+"""
+import os
+import threading
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+
+try:
+    from backend import subsystems, metrics, shared_state
+except ImportError:
+    import subsystems
+    import metrics
+    import shared_state
+
+MAX_CACHED_SIZES = 4096
+
+_locks = {}
+_locks_lock = threading.Lock()
+_image_sizes = OrderedDict()
+
+
+@contextmanager
+def label_lock(label_file):
+    """Lock serializing read-modify-write cycles on one label (across worker processes too)."""
+    key = os.path.normcase(os.path.abspath(label_file))
+    with _locks_lock:
+        lock = _locks.get(key)
+        if lock is None:
+            lock = _locks[key] = threading.Lock()
+    with lock:
+        if shared_state.multi_worker():
+            with shared_state.process_lock(key):
+                yield
+        else:
+            yield
+
+
+def file_version(label_file):
+    # Content checksum rather than mtime, which is too coarse to tell two quick saves apart
+    try:
+        with open(label_file, 'rb') as f:
+            content = f.read()
+    except FileNotFoundError:
+        return "0"
+    return f"{len(content):x}-{zlib.crc32(content):08x}"
+
+
+def read_lines(label_file):
+    """Raw lines of a label file (without newlines), [] if it does not exist."""
+    if not os.path.exists(label_file):
+        return []
+    try:
+        with open(label_file, 'r', encoding='utf-8') as f:
+            return f.read().splitlines()
+    except UnicodeDecodeError:
+        with open(label_file, 'r', encoding='latin-1') as f:
+            return f.read().splitlines()
+
+
+def write_lines(label_file, lines):
+    content = "".join(line + "\n" for line in lines)
+    with open(label_file, 'w') as f:
+        f.write(content)
+    metrics.BYTES_WRITTEN.inc("labels", amount=len(content))
+
+
+def box_index(box_id):
+    """Line index of a "box_<n>" id, or None for ids the server did not issue."""
+    if not isinstance(box_id, str) or not box_id.startswith("box_"):
+        return None
+    try:
+        return int(box_id[4:])
+    except ValueError:
+        return None
+
+
+def apply_ops(lines, ops):
+    """
+    Apply (op, box_id, line) operations to label lines.
+
+    Updates and deletes address existing lines by id; adds are appended in
+    order. Returns (new_lines, id_map, errors) where id_map maps every id
+    that changed (including the client ids of added boxes) to its new id.
+    """
+    lines = list(lines)
+    removed = set()
+    added = []
+    errors = []
+    for op, box_id, line in ops:
+        if op == "add":
+            added.append((box_id, line))
+            continue
+        idx = box_index(box_id)
+        if idx is None or idx >= len(lines) or idx in removed or not lines[idx].strip():
+            errors.append(f"{op} {box_id}: Unknown box id")
+            continue
+        if op == "update":
+            lines[idx] = line
+        else:
+            removed.add(idx)
+
+    new_lines = []
+    id_map = {}
+    for idx, line in enumerate(lines):
+        if idx in removed:
+            continue
+        if idx != len(new_lines):
+            id_map[f"box_{idx}"] = f"box_{len(new_lines)}"
+        new_lines.append(line)
+    for n, (client_id, line) in enumerate(added):
+        id_map[client_id or f"new_{n}"] = f"box_{len(new_lines)}"
+        new_lines.append(line)
+    return new_lines, id_map, errors
+
+
+def image_size(image_path, caller):
+    """(width, height) of an image, cached by path, size and mtime."""
+    st = os.stat(image_path)
+    key = (image_path, st.st_size, st.st_mtime_ns)
+    size = _image_sizes.get(key)
+    metrics.cache_lookup("image_size", size is not None)
+    if size is not None:
+        _image_sizes.move_to_end(key)
+        return size
+
+    Image = subsystems.image_module()
+    metrics.IMAGE_OPENS.inc(caller)
+    with Image.open(image_path) as img:
+        size = img.size
+    _image_sizes[key] = size
+    while len(_image_sizes) > MAX_CACHED_SIZES:
+        _image_sizes.popitem(last=False)
+    return size
@@ -0,0 +1,399 @@
+"""
+Optional single-file annotation store for large datasets.
+
+Instead of one labels/<stem>.txt per image, all boxes of a dataset live in
+<dataset>/annotations.db (SQLite, WAL mode). Boxes are kept both as numeric
+columns, for fast whole-dataset scans, and as the original YOLO text line,
+so importing from and exporting back to .txt files is lossless.
+
+A dataset only uses the store once it has been imported; until then the
+backend keeps reading and writing the per-image .txt files.
+"""
+import os
+import sqlite3
+import threading
+import time
+
+STORE_FILENAME = "annotations.db"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    id INTEGER PRIMARY KEY,
+    stem TEXT NOT NULL UNIQUE,
+    updated_at REAL NOT NULL,
+    revision INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS boxes (
+    image_id INTEGER NOT NULL REFERENCES images(id) ON DELETE CASCADE,
+    idx INTEGER NOT NULL,
+    class_id INTEGER,
+    x REAL,
+    y REAL,
+    width REAL,
+    height REAL,
+    confidence REAL,
+    line TEXT NOT NULL,
+    PRIMARY KEY (image_id, idx)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS boxes_class ON boxes(class_id, image_id);
+CREATE TABLE IF NOT EXISTS store_revision (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO store_revision (id, value) VALUES (0, 0);
+"""
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def store_path(dataset_path):
+    return os.path.join(dataset_path, STORE_FILENAME)
+
+
+def parse_line(line):
+    """Parse one YOLO line into numeric fields, or None if it is malformed."""
+    parts = line.split()
+    if len(parts) < 5:
+        return None
+    try:
+        class_id = int(parts[0])
+        x, y, w, h = (float(v) for v in parts[1:5])
+    except ValueError:
+        return None
+    conf = 1.0
+    if len(parts) > 5:
+        try:
+            conf = max(0.0, min(1.0, float(parts[5])))
+        except ValueError:
+            conf = 1.0
+    return class_id, x, y, w, h, conf
+
+
+def format_line(box):
+    """Same text format as yolo_handler.save_yolo_file."""
+    confidence = box.get('confidence', 1.0)
+    if confidence < 1.0:
+        return f"{box['class_id']} {box['x']} {box['y']} {box['width']} {box['height']} {confidence}"
+    return f"{box['class_id']} {box['x']} {box['y']} {box['width']} {box['height']}"
+
+
+class AnnotationStore:
+    """SQLite-backed annotation store for one dataset."""
+
+    def __init__(self, dataset_path, create=False):
+        self.dataset_path = dataset_path
+        self.path = store_path(dataset_path)
+        if not create and not os.path.exists(self.path):
+            raise FileNotFoundError(self.path)
+        # One connection shared by the threadpool; sqlite3 calls are serialized by the lock
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.executescript(_SCHEMA)
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(images)")]
+        if "revision" not in columns:
+            # Stores created before versions were revision counters
+            self._conn.execute("ALTER TABLE images ADD COLUMN revision INTEGER NOT NULL DEFAULT 0")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    # Per-image access
+
+    def has_image(self, stem):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM images WHERE stem = ?", (stem,)).fetchone() is not None
+
+    def read(self, stem):
+        """Boxes for one image, in the same format as parse_yolo_file."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT b.idx, b.class_id, b.x, b.y, b.width, b.height, b.confidence "
+                "FROM boxes b JOIN images i ON i.id = b.image_id "
+                "WHERE i.stem = ? AND b.class_id IS NOT NULL ORDER BY b.idx",
+                (stem,),
+            ).fetchall()
+        return [
+            {"id": f"box_{idx}", "class_id": cls, "x": x, "y": y, "width": w, "height": h, "confidence": conf}
+            for idx, cls, x, y, w, h, conf in rows
+        ]
+
+    def read_lines(self, stem):
+        """Stored line text for one image, invalid lines included, in order."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT b.line FROM boxes b JOIN images i ON i.id = b.image_id "
+                "WHERE i.stem = ? ORDER BY b.idx",
+                (stem,),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def version(self, stem):
+        """
+        Version string of one image's boxes ("0" if it has never been saved):
+        the store-wide revision of its last write, which unlike a timestamp
+        differs between two saves made within the same clock tick.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT revision FROM images WHERE stem = ?", (stem,)).fetchone()
+        return f"r{row[0]}" if row else "0"
+
+    def versions(self):
+        """{stem: version} of every stored image."""
+        with self._lock:
+            rows = self._conn.execute("SELECT stem, revision FROM images").fetchall()
+        return {stem: f"r{revision}" for stem, revision in rows}
+
+    def write(self, stem, boxes):
+        """Replace the boxes of one image (same input as save_yolo_file)."""
+        self.write_lines(stem, [format_line(box) for box in boxes])
+
+    def write_lines(self, stem, lines):
+        rows = []
+        for idx, line in enumerate(lines):
+            parsed = parse_line(line)
+            rows.append((idx, *(parsed if parsed else (None,) * 6), line))
+        with self._lock:
+            cur = self._conn.cursor()
+            cur.execute("BEGIN IMMEDIATE")
+            try:
+                image_id = self._upsert_image(cur, stem)
+                cur.execute("DELETE FROM boxes WHERE image_id = ?", (image_id,))
+                cur.executemany(
+                    "INSERT INTO boxes (image_id, idx, class_id, x, y, width, height, confidence, line) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(image_id, *row) for row in rows],
+                )
+                cur.execute("COMMIT")
+            except Exception:
+                cur.execute("ROLLBACK")
+                raise
+
+    def rewrite_images(self, class_ids, transform, dry_run=False):
+        """
+        Replace the lines of every image containing one of class_ids with
+        transform(stem, lines), in one transaction. With dry_run, transform is
+        still called but nothing is written.
+        """
+        placeholders = ",".join("?" * len(class_ids))
+        with self._lock:
+            cur = self._conn.cursor()
+            cur.execute("BEGIN IMMEDIATE")
+            try:
+                images = cur.execute(
+                    f"SELECT i.id, i.stem FROM images i WHERE i.id IN "
+                    f"(SELECT DISTINCT image_id FROM boxes WHERE class_id IN ({placeholders}))",
+                    [int(c) for c in class_ids],
+                ).fetchall()
+                for image_id, stem in images:
+                    lines = [row[0] for row in cur.execute(
+                        "SELECT line FROM boxes WHERE image_id = ? ORDER BY idx", (image_id,)
+                    ).fetchall()]
+                    new_lines = transform(stem, lines)
+                    if dry_run:
+                        continue
+                    cur.execute("DELETE FROM boxes WHERE image_id = ?", (image_id,))
+                    rows = []
+                    for idx, line in enumerate(new_lines):
+                        parsed = parse_line(line)
+                        rows.append((image_id, idx, *(parsed if parsed else (None,) * 6), line))
+                    cur.executemany(
+                        "INSERT INTO boxes (image_id, idx, class_id, x, y, width, height, confidence, line) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        rows,
+                    )
+                    cur.execute("UPDATE images SET updated_at = ?, revision = ? WHERE id = ?",
+                                (time.time(), self._next_revision(cur), image_id))
+                cur.execute("ROLLBACK" if dry_run else "COMMIT")
+            except Exception:
+                cur.execute("ROLLBACK")
+                raise
+        return len(images)
+
+    def delete(self, stem):
+        with self._lock:
+            cur = self._conn.execute("DELETE FROM images WHERE stem = ?", (stem,))
+            return cur.rowcount > 0
+
+    def _next_revision(self, cur):
+        """Next store-wide revision; never handed out twice, even after deletes."""
+        cur.execute("UPDATE store_revision SET value = value + 1")
+        return cur.execute("SELECT value FROM store_revision").fetchone()[0]
+
+    def _upsert_image(self, cur, stem):
+        cur.execute(
+            "INSERT INTO images (stem, updated_at, revision) VALUES (?, ?, ?) "
+            "ON CONFLICT(stem) DO UPDATE SET updated_at = excluded.updated_at, revision = excluded.revision",
+            (stem, time.time(), self._next_revision(cur)),
+        )
+        return cur.execute("SELECT id FROM images WHERE stem = ?", (stem,)).fetchone()[0]
+
+    # Dataset-wide access
+
+    def stems(self):
+        """Stems of every stored image, including images saved without boxes."""
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT stem FROM images ORDER BY stem").fetchall()]
+
+    def annotated_stems(self, class_id=None):
+        """Stems of images with at least one box (optionally of a given class)."""
+        with self._lock:
+            if class_id is None:
+                rows = self._conn.execute(
+                    "SELECT DISTINCT i.stem FROM images i JOIN boxes b ON b.image_id = i.id"
+                ).fetchall()
+            else:
+                rows = self._conn.execute(
+                    "SELECT DISTINCT i.stem FROM boxes b JOIN images i ON i.id = b.image_id WHERE b.class_id = ?",
+                    (int(class_id),),
+                ).fetchall()
+        return [row[0] for row in rows]
+
+    def scan(self, class_id=None):
+        """
+        Whole-dataset vector scan: NumPy arrays of every valid box.
+
+        Returns a dict with image_id, idx (line index), class_id, x, y, width,
+        height and confidence arrays, plus "stems" mapping image_id -> stem.
+        """
+        import numpy as np
+
+        query = ("SELECT image_id, idx, class_id, x, y, width, height, confidence FROM boxes "
+                 "WHERE class_id IS NOT NULL")
+        params = ()
+        if class_id is not None:
+            query += " AND class_id = ?"
+            params = (int(class_id),)
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+            stems = dict(self._conn.execute("SELECT id, stem FROM images").fetchall())
+        data = np.array(rows, dtype=np.float64).reshape(-1, 8)
+        return {
+            "image_id": data[:, 0].astype(np.int64),
+            "idx": data[:, 1].astype(np.int64),
+            "class_id": data[:, 2].astype(np.int64),
+            "x": data[:, 3],
+            "y": data[:, 4],
+            "width": data[:, 5],
+            "height": data[:, 6],
+            "confidence": data[:, 7],
+            "stems": stems,
+        }
+
+    def stats(self):
+        with self._lock:
+            images = self._conn.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+            boxes, invalid = self._conn.execute(
+                "SELECT COUNT(*), COUNT(*) - COUNT(class_id) FROM boxes"
+            ).fetchone()
+        return {"images": images, "boxes": boxes, "invalid_lines": invalid, "size": os.path.getsize(self.path)}
+
+    # YOLO txt import / export
+
+    def import_yolo(self, labels_dir, remove_files=False):
+        """Load every <stem>.txt in labels_dir into the store in one transaction."""
+        imported = 0
+        with self._lock:
+            cur = self._conn.cursor()
+            cur.execute("BEGIN IMMEDIATE")
+            try:
+                for entry in os.scandir(labels_dir):
+                    if not entry.is_file() or not entry.name.endswith(".txt") or entry.name == "classes.txt":
+                        continue
+                    try:
+                        with open(entry.path, 'r', encoding='utf-8') as f:
+                            content = f.read()
+                    except UnicodeDecodeError:
+                        with open(entry.path, 'r', encoding='latin-1') as f:
+                            content = f.read()
+                    stem = entry.name[:-4]
+                    image_id = self._upsert_image(cur, stem)
+                    cur.execute("DELETE FROM boxes WHERE image_id = ?", (image_id,))
+                    rows = []
+                    for line in content.splitlines():
+                        line = line.strip()
+                        if not line:
+                            continue
+                        parsed = parse_line(line)
+                        rows.append((image_id, len(rows), *(parsed if parsed else (None,) * 6), line))
+                    cur.executemany(
+                        "INSERT INTO boxes (image_id, idx, class_id, x, y, width, height, confidence, line) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        rows,
+                    )
+                    imported += 1
+                cur.execute("COMMIT")
+            except Exception:
+                cur.execute("ROLLBACK")
+                raise
+
+        if remove_files:
+            for entry in os.scandir(labels_dir):
+                if entry.is_file() and entry.name.endswith(".txt") and entry.name != "classes.txt" \
+                        and self.has_image(entry.name[:-4]):
+                    os.remove(entry.path)
+        return imported
+
+    def export_yolo(self, labels_dir):
+        """Write one <stem>.txt per stored image, with the original line text."""
+        os.makedirs(labels_dir, exist_ok=True)
+        written = 0
+        with self._lock:
+            stems = self._conn.execute("SELECT id, stem FROM images ORDER BY id").fetchall()
+            cursor = self._conn.execute("SELECT image_id, line FROM boxes ORDER BY image_id, idx")
+            lines_by_image = {}
+            for image_id, line in cursor:
+                lines_by_image.setdefault(image_id, []).append(line)
+        for image_id, stem in stems:
+            lines = lines_by_image.get(image_id, [])
+            with open(os.path.join(labels_dir, stem + ".txt"), 'w', encoding='utf-8') as f:
+                f.write("".join(line + "\n" for line in lines))
+            written += 1
+        return written
+
+
+def get_store(dataset_path):
+    """The dataset's store if it has been imported, else None (cached per dataset)."""
+    if not dataset_path:
+        return None
+    key = os.path.normcase(os.path.abspath(dataset_path))
+    store = _stores.get(key)
+    if store is not None:
+        if os.path.exists(store.path):
+            return store
+        with _stores_lock:
+            _stores.pop(key, None)
+        return None
+    if not os.path.exists(store_path(dataset_path)):
+        return None
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = _stores[key] = AnnotationStore(dataset_path)
+    return store
+
+
+def create_store(dataset_path):
+    key = os.path.normcase(os.path.abspath(dataset_path))
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = _stores[key] = AnnotationStore(dataset_path, create=True)
+    return store
+
+
+def drop_store(dataset_path):
+    """Close and delete the dataset's store so it falls back to .txt files."""
+    key = os.path.normcase(os.path.abspath(dataset_path))
+    with _stores_lock:
+        store = _stores.pop(key, None)
+    if store is not None:
+        store.close()
+    for suffix in ("", "-wal", "-shm"):
+        path = store_path(dataset_path) + suffix
+        if os.path.exists(path):
+            os.remove(path)
@@ -0,0 +1,209 @@
+"""
+Dataset-wide box conflict detection.
+
+Boxes of a chunk of label files are loaded into flat NumPy arrays sorted by
+image, and every pair of boxes inside the same image is compared in
+vectorized form. Chunks are audited in parallel on a process pool, so a
+full pass over millions of boxes does not stay on one core.
+
+Issue types:
+- duplicate: same class, IoU >= duplicate_iou
+- class_conflict: different classes, IoU >= conflict_iou
+- tiny_box: area below min_area (normalized units) or non-positive size
+- out_of_bounds: box extends outside [0, 1] by more than the tolerance
+"""
+import os
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+try:
+    from backend import shared_state
+except ImportError:
+    import shared_state
+
+DEFAULT_PARAMS = {
+    "duplicate_iou": 0.9,
+    "conflict_iou": 0.7,
+    "min_area": 1e-5,
+    "bounds_tolerance": 1e-3,
+}
+
+# Images with more boxes than this are compared with a full IoU matrix
+SMALL_IMAGE_BOXES = 64
+CHUNK_SIZE = 2000
+
+# Recent audit results kept for paging: audit_id -> result dict
+MAX_CACHED_AUDITS = 8
+_results = OrderedDict()
+
+
+def load_label_arrays(label_files):
+    """
+    Parse label files into flat arrays (file index, line index, class, x, y, w, h).
+    Malformed lines are skipped, as in parse_yolo_file.
+    """
+    file_ids, line_ids, rows = [], [], []
+    for file_id, path in enumerate(label_files):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                lines = f.readlines()
+        except UnicodeDecodeError:
+            with open(path, 'r', encoding='latin-1') as f:
+                lines = f.readlines()
+        except OSError:
+            continue
+        for line_id, line in enumerate(lines):
+            parts = line.split()
+            if len(parts) < 5:
+                continue
+            try:
+                rows.append((int(parts[0]), float(parts[1]), float(parts[2]), float(parts[3]), float(parts[4])))
+            except ValueError:
+                continue
+            file_ids.append(file_id)
+            line_ids.append(line_id)
+    data = np.array(rows, dtype=np.float64).reshape(-1, 5)
+    return (np.array(file_ids, dtype=np.int64), np.array(line_ids, dtype=np.int64),
+            data[:, 0].astype(np.int64), data[:, 1], data[:, 2], data[:, 3], data[:, 4])
+
+
+def _pair_iou(x1a, y1a, x2a, y2a, x1b, y1b, x2b, y2b):
+    inter_w = np.clip(np.minimum(x2a, x2b) - np.maximum(x1a, x1b), 0, None)
+    inter_h = np.clip(np.minimum(y2a, y2b) - np.maximum(y1a, y1b), 0, None)
+    inter = inter_w * inter_h
+    union = (x2a - x1a) * (y2a - y1a) + (x2b - x1b) * (y2b - y1b) - inter
+    return np.divide(inter, union, out=np.zeros_like(inter), where=union > 0)
+
+
+def audit_arrays(image_ids, line_ids, classes, x, y, w, h, params=None):
+    """
+    Audit flat box arrays. Returns a list of issue dicts referencing
+    image_ids and line_ids of the offending boxes.
+    """
+    params = {**DEFAULT_PARAMS, **(params or {})}
+    issues = []
+    n = len(image_ids)
+    if n == 0:
+        return issues
+
+    order = np.lexsort((line_ids, image_ids))
+    image_ids, line_ids, classes = image_ids[order], line_ids[order], classes[order]
+    x, y, w, h = x[order], y[order], w[order], h[order]
+    x1, y1, x2, y2 = x - w / 2, y - h / 2, x + w / 2, y + h / 2
+
+    # Single-box checks
+    area = w * h
+    tiny = (w <= 0) | (h <= 0) | (area < params["min_area"])
+    tol = params["bounds_tolerance"]
+    out = (x1 < -tol) | (y1 < -tol) | (x2 > 1 + tol) | (y2 > 1 + tol)
+    for i in np.flatnonzero(tiny):
+        issues.append({"type": "tiny_box", "image_id": int(image_ids[i]), "lines": [int(line_ids[i])],
+                       "class_ids": [int(classes[i])], "area": float(area[i])})
+    for i in np.flatnonzero(out):
+        issues.append({"type": "out_of_bounds", "image_id": int(image_ids[i]), "lines": [int(line_ids[i])],
+                       "class_ids": [int(classes[i])],
+                       "bounds": [float(x1[i]), float(y1[i]), float(x2[i]), float(y2[i])]})
+
+    # Pairwise checks inside each image
+    bounds = np.concatenate(([0], np.flatnonzero(np.diff(image_ids)) + 1, [n]))
+    sizes = np.diff(bounds)
+    in_big_image = np.repeat(sizes > SMALL_IMAGE_BOXES, sizes)
+    pair_a, pair_b = [], []
+
+    # Small images: compare box i with box i + offset for the whole chunk at once
+    for offset in range(1, min(SMALL_IMAGE_BOXES, int(sizes.max())) + 1):
+        same = (image_ids[offset:] == image_ids[:-offset]) & ~in_big_image[:-offset]
+        positions = np.flatnonzero(same)
+        if len(positions) == 0:
+            break
+        pair_a.append(positions)
+        pair_b.append(positions + offset)
+
+    # Dense images: upper triangle of the image's own IoU matrix
+    for start, size in zip(bounds[:-1][sizes > SMALL_IMAGE_BOXES], sizes[sizes > SMALL_IMAGE_BOXES]):
+        left, right = np.triu_indices(int(size), k=1)
+        pair_a.append(left + start)
+        pair_b.append(right + start)
+
+    if pair_a:
+        a = np.concatenate(pair_a)
+        b = np.concatenate(pair_b)
+        iou = _pair_iou(x1[a], y1[a], x2[a], y2[a], x1[b], y1[b], x2[b], y2[b])
+        same_class = classes[a] == classes[b]
+        duplicate = same_class & (iou >= params["duplicate_iou"])
+        conflict = ~same_class & (iou >= params["conflict_iou"])
+        for kind, mask in (("duplicate", duplicate), ("class_conflict", conflict)):
+            for k in np.flatnonzero(mask):
+                i, j = a[k], b[k]
+                issues.append({"type": kind, "image_id": int(image_ids[i]),
+                               "lines": [int(line_ids[i]), int(line_ids[j])],
+                               "class_ids": [int(classes[i]), int(classes[j])], "iou": float(iou[k])})
+    return issues
+
+
+def _audit_chunk(args):
+    label_files, params = args
+    file_ids, line_ids, classes, x, y, w, h = load_label_arrays(label_files)
+    issues = audit_arrays(file_ids, line_ids, classes, x, y, w, h, params)
+    for issue in issues:
+        issue["label_file"] = label_files[issue.pop("image_id")]
+    return issues, len(file_ids)
+
+
+def audit_label_files(label_files, params=None, workers=None, chunk_size=CHUNK_SIZE):
+    """Audit label files in parallel chunks. Returns (issues, total_boxes)."""
+    chunks = [(label_files[i:i + chunk_size], params) for i in range(0, len(label_files), chunk_size)]
+    issues, total_boxes = [], 0
+    workers = workers or os.cpu_count() or 1
+    if len(chunks) <= 1 or workers <= 1:
+        results = map(_audit_chunk, chunks)
+        for chunk_issues, boxes in results:
+            issues.extend(chunk_issues)
+            total_boxes += boxes
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(chunks))) as pool:
+            for chunk_issues, boxes in pool.map(_audit_chunk, chunks):
+                issues.extend(chunk_issues)
+                total_boxes += boxes
+    return issues, total_boxes
+
+
+def audit_store(store, labels_dir, params=None):
+    """Audit a dataset kept in the annotation store with one vectorized pass."""
+    data = store.scan()
+    issues = audit_arrays(data["image_id"], data["idx"], data["class_id"], data["x"], data["y"],
+                          data["width"], data["height"], params)
+    for issue in issues:
+        issue["label_file"] = os.path.join(labels_dir, data["stems"][issue.pop("image_id")] + ".txt")
+    return issues, len(data["image_id"])
+
+
+def summarize(issues):
+    counts = {}
+    for issue in issues:
+        counts[issue["type"]] = counts.get(issue["type"], 0) + 1
+    return counts
+
+
+def remember(result):
+    """Keep an audit result for later pages and return its id."""
+    audit_id = uuid.uuid4().hex
+    _results[audit_id] = result
+    while len(_results) > MAX_CACHED_AUDITS:
+        _results.popitem(last=False)
+    if shared_state.multi_worker():
+        # Later pages may be requested from another worker
+        shared_state.put_value("audits", audit_id, result, MAX_CACHED_AUDITS)
+    return audit_id
+
+
+def recall(audit_id):
+    result = _results.get(audit_id)
+    if result is not None:
+        _results.move_to_end(audit_id)
+    elif shared_state.multi_worker():
+        result = shared_state.get_value("audits", audit_id)
+    return result
@@ -0,0 +1,239 @@
+"""
+Dataset-wide class operations: rename, merge, delete and reorder.
+
+An operation is turned into a class list for classes.txt plus a mapping
+old_id -> new_id (None deletes the box) that only contains the ids that
+change. Label files are scanned on a process pool in chunks; the files that
+contain one of the mapped ids are then rewritten in the server process, each
+under its label lock and atomically (via a temporary file and os.replace),
+with the change recorded in the edit history before the lock is released.
+Datasets kept in the annotation store are remapped in a single transaction
+instead.
+"""
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+try:
+    from backend import annotation_patch
+except ImportError:
+    import annotation_patch
+
+OPERATIONS = ("rename", "merge", "delete", "reorder")
+CHUNK_SIZE = 2000
+
+
+def plan(names, operation, class_ids=None, target_id=None, name=None, order=None):
+    """
+    Return (new_names, mapping) for an operation on the class list.
+    Raises ValueError for invalid arguments.
+    """
+    count = len(names)
+    class_ids = list(class_ids or [])
+    for class_id in class_ids + ([target_id] if target_id is not None else []):
+        if not 0 <= class_id < count:
+            raise ValueError(f"Unknown class id {class_id}")
+
+    if operation == "rename":
+        if len(class_ids) != 1 or not name or not name.strip():
+            raise ValueError("rename needs exactly one class id and a name")
+        new_names = list(names)
+        new_names[class_ids[0]] = name.strip()
+        return new_names, {}
+
+    if operation == "reorder":
+        if order is None or sorted(order) != list(range(count)):
+            raise ValueError("reorder needs a permutation of all class ids")
+        kept = list(order)
+        new_ids = {old_id: new_id for new_id, old_id in enumerate(kept)}
+    elif operation in ("merge", "delete"):
+        if not class_ids:
+            raise ValueError(f"{operation} needs class ids")
+        if operation == "merge" and (target_id is None or target_id in class_ids):
+            raise ValueError("merge needs a target id that is not one of the merged ids")
+        # Removed classes leave the list and the following ids move up
+        removed = set(class_ids)
+        kept = [old_id for old_id in range(count) if old_id not in removed]
+        new_ids = {old_id: new_id for new_id, old_id in enumerate(kept)}
+        for old_id in removed:
+            new_ids[old_id] = new_ids[target_id] if operation == "merge" else None
+    else:
+        raise ValueError(f"Unknown operation '{operation}', expected one of {', '.join(OPERATIONS)}")
+
+    new_names = [names[old_id] for old_id in kept]
+    mapping = {old_id: new_id for old_id, new_id in new_ids.items() if old_id != new_id}
+    return new_names, mapping
+
+
+def remap_lines(lines, mapping):
+    """Apply a class mapping to YOLO lines. Returns (new_lines, remapped, deleted)."""
+    out = []
+    remapped = deleted = 0
+    for line in lines:
+        parts = line.split(None, 1)
+        try:
+            new_id = mapping[int(parts[0])]
+        except (IndexError, ValueError, KeyError):
+            out.append(line)
+            continue
+        if new_id is None:
+            deleted += 1
+            continue
+        remapped += 1
+        out.append(f"{new_id} {parts[1]}" if len(parts) > 1 else str(new_id))
+    return out, remapped, deleted
+
+
+def _tmp_path(path):
+    """Temporary file next to path, unique per process and thread like label_lint's."""
+    return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+
+def _read_text(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read(), 'utf-8'
+    except UnicodeDecodeError:
+        with open(path, 'r', encoding='latin-1') as f:
+            return f.read(), 'latin-1'
+
+
+def _new_totals():
+    return {"files_scanned": 0, "files_changed": 0, "boxes_remapped": 0, "boxes_deleted": 0, "errors": []}
+
+
+def _scan_chunk(args):
+    """Counts of one chunk of label files and the files that use a mapped id."""
+    label_files, mapping = args
+    totals = _new_totals()
+    changed = []
+    for path in label_files:
+        try:
+            content, _ = _read_text(path)
+        except OSError as e:
+            totals["errors"].append(f"{path}: {e}")
+            continue
+        _, remapped, deleted = remap_lines(content.splitlines(), mapping)
+        totals["files_scanned"] += 1
+        if remapped or deleted:
+            changed.append(path)
+            totals["files_changed"] += 1
+            totals["boxes_remapped"] += remapped
+            totals["boxes_deleted"] += deleted
+    return totals, changed
+
+
+def _rewrite_file(path, mapping, on_change=None):
+    """
+    Remap one label file under its label lock, re-reading it so saves made
+    since the scan are kept; on_change(path, old_lines, new_lines) runs before
+    the lock is released. Returns (remapped, deleted).
+    """
+    with annotation_patch.label_lock(path):
+        content, encoding = _read_text(path)
+        old_lines = content.splitlines()
+        new_lines, remapped, deleted = remap_lines(old_lines, mapping)
+        if remapped or deleted:
+            tmp_path = _tmp_path(path)
+            with open(tmp_path, 'w', encoding=encoding) as f:
+                f.write("".join(line + "\n" for line in new_lines))
+            os.replace(tmp_path, path)
+            if on_change:
+                on_change(path, old_lines, new_lines)
+    return remapped, deleted
+
+
+def remap_label_files(label_files, mapping, dry_run=False, workers=None, chunk_size=CHUNK_SIZE, on_change=None):
+    """
+    Remap class ids in label files. Returns summed counts.
+
+    Files are scanned on a process pool; unless dry_run, the files using a
+    mapped id are then rewritten here on a thread pool (see _rewrite_file).
+    """
+    totals = _new_totals()
+    if not mapping:
+        totals["files_scanned"] = len(label_files)
+        return totals
+    chunks = [(label_files[i:i + chunk_size], mapping) for i in range(0, len(label_files), chunk_size)]
+    workers = workers or os.cpu_count() or 1
+
+    if len(chunks) <= 1 or workers <= 1:
+        scanned = list(map(_scan_chunk, chunks))
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(chunks))) as pool:
+            scanned = list(pool.map(_scan_chunk, chunks))
+    changed = []
+    for chunk_totals, chunk_changed in scanned:
+        for key, value in chunk_totals.items():
+            totals[key] += value
+        changed.extend(chunk_changed)
+    if dry_run or not changed:
+        return totals
+
+    # Counts of the rewrite replace the scan's: files may have been saved in between
+    totals.update(files_changed=0, boxes_remapped=0, boxes_deleted=0)
+
+    def rewrite(path):
+        try:
+            return path, _rewrite_file(path, mapping, on_change), None
+        except OSError as e:
+            return path, None, e
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(changed)))) as pool:
+        for path, counts, error in pool.map(rewrite, changed):
+            if error is not None:
+                totals["errors"].append(f"{path}: {error}")
+            elif any(counts):
+                totals["files_changed"] += 1
+                totals["boxes_remapped"] += counts[0]
+                totals["boxes_deleted"] += counts[1]
+    return totals
+
+
+def remap_store(store, mapping, dry_run=False, on_change=None):
+    """
+    Remap class ids of a dataset kept in the annotation store. Unless dry_run,
+    on_change(stem, old_lines, new_lines) is called for every changed image
+    once the transaction is committed.
+    """
+    totals = {"files_scanned": store.stats()["images"], "files_changed": 0,
+              "boxes_remapped": 0, "boxes_deleted": 0, "errors": []}
+    if not mapping:
+        return totals
+    changes = []
+
+    def transform(stem, lines):
+        new_lines, remapped, deleted = remap_lines(lines, mapping)
+        totals["files_changed"] += 1
+        totals["boxes_remapped"] += remapped
+        totals["boxes_deleted"] += deleted
+        changes.append((stem, lines, new_lines))
+        return new_lines
+
+    store.rewrite_images(list(mapping), transform, dry_run=dry_run)
+    if on_change and not dry_run:
+        for stem, old_lines, new_lines in changes:
+            on_change(stem, old_lines, new_lines)
+    return totals
+
+
+def read_class_names(dataset_path):
+    """Class names from classes.txt, indexed like load_classes (blank lines keep their id)."""
+    path = os.path.join(dataset_path, "classes.txt")
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r', encoding='utf-8') as f:
+        names = [line.strip() for line in f.readlines()]
+    while names and not names[-1]:
+        names.pop()
+    return names
+
+
+def write_class_names(dataset_path, names):
+    path = os.path.join(dataset_path, "classes.txt")
+    tmp_path = _tmp_path(path)
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        for name in names:
+            f.write(f"{name}\n")
+    os.replace(tmp_path, path)
+    return path
@@ -0,0 +1,235 @@
+"""
+Headless command line for batch dataset operations.
+
+Runs the same backend functions as the HTTP routes, without starting the
+server, so exports, merges, quality reports and validation can run on build
+machines and in CI:
+
+    python cli.py export /data/ds --format coco --workers 16
+    python cli.py merge /data/a /data/b --output /data/merged --workers 8
+    python cli.py report /data/ds
+    python cli.py validate /data/ds --workers 16
+    python cli.py lint /data/ds --fix
+
+The result is printed to stdout as JSON; progress goes to stderr (--quiet
+turns it off). Exit codes: 0 success, 1 the operation failed, 2 invalid
+arguments, 3 validation found issues (lint: errors).
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+# Add current directory to Python path for direct execution
+_backend_dir = os.path.dirname(os.path.abspath(__file__))
+if _backend_dir not in sys.path:
+    sys.path.insert(0, _backend_dir)
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+EXIT_ISSUES = 3
+
+PROGRESS_INTERVAL = 0.5
+
+
+class Progress:
+    """progress(done, total) callback writing throttled status lines to stderr."""
+
+    def __init__(self, label, enabled=True):
+        self.label = label
+        self.enabled = enabled
+        self.start = time.perf_counter()
+        self._last = 0.0
+        self._tty = sys.stderr.isatty()
+
+    def __call__(self, done, total):
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        if done < total and now - self._last < PROGRESS_INTERVAL:
+            return
+        self._last = now
+        elapsed = now - self.start
+        rate = done / elapsed if elapsed > 0 else 0.0
+        percent = done * 100 / total if total else 100.0
+        line = f"{self.label}: {done}/{total} ({percent:.0f}%, {rate:.0f}/s)"
+        if self._tty:
+            sys.stderr.write("\r" + line + ("\n" if done >= total else ""))
+        else:
+            sys.stderr.write(line + "\n")
+        sys.stderr.flush()
+
+    def note(self, message):
+        if self.enabled:
+            sys.stderr.write(f"{self.label}: {message}\n")
+            sys.stderr.flush()
+
+
+def _backend():
+    """The FastAPI module; imported on demand so --help stays fast."""
+    try:
+        from backend import main
+    except ImportError:
+        import main
+    return main
+
+
+def run_export(args, progress):
+    main = _backend()
+    exporter = main.subsystems.load("exporter")
+    if not os.path.isdir(args.dataset):
+        raise ValueError(f"Dataset not found: {args.dataset}")
+    annotated = {"all": None, "annotated": True, "unannotated": False}[args.select]
+    start = time.perf_counter()
+    if args.format == "coco":
+        output = args.output or os.path.join(args.dataset, "output.json")
+        exporter.export_coco(args.dataset, output, args.class_id, annotated, args.workers, progress)
+        result = {"file": output}
+    elif args.format == "voc":
+        output = args.output or os.path.join(args.dataset, "voc_xmls")
+        count = exporter.export_voc(args.dataset, output, args.class_id, annotated, args.workers, progress)
+        result = {"count": count, "dir": output}
+    elif args.format == "yolo":
+        output = args.output or os.path.normpath(args.dataset) + "_yolo_export"
+        count = exporter.export_yolo(args.dataset, output, args.class_id, annotated, progress)
+        result = {"count": count, "dir": output}
+    else:
+        output = args.output or os.path.normpath(args.dataset) + f"_yolo_{args.image_size}"
+        result = exporter.export_resized(args.dataset, output, args.image_size, not args.no_letterbox,
+                                         args.jpeg_quality, args.class_id, annotated, args.workers, progress)
+        result["dir"] = output
+    return {"status": "success", "format": args.format, **result, "duration": time.perf_counter() - start}
+
+
+def run_merge(args, progress):
+    main = _backend()
+    progress.note(f"merging {len(args.datasets)} datasets into {args.output}")
+    start = time.perf_counter()
+    result = main.merge_datasets_endpoint(main.MergeDatasetsRequest(
+        dataset_paths=args.datasets,
+        output_path=args.output,
+        dedupe_near_duplicates=args.dedupe,
+        dedupe_max_distance=args.dedupe_distance,
+        workers=args.workers,
+    ))
+    return {**result, "duration": time.perf_counter() - start}
+
+
+def run_report(args, progress):
+    main = _backend()
+    progress.note(f"building quality report for {args.dataset}")
+    start = time.perf_counter()
+    result = main.export_report_endpoint(main.ReportRequest(dataset_path=args.dataset))
+    return {**result, "duration": time.perf_counter() - start}
+
+
+def run_validate(args, progress):
+    main = _backend()
+    progress.note(f"auditing boxes of {args.dataset}")
+    result = main.audit_boxes(main.BoxAuditRequest(
+        dataset_path=args.dataset,
+        duplicate_iou=args.duplicate_iou,
+        conflict_iou=args.conflict_iou,
+        min_area=args.min_area,
+        issue_types=args.issue_types,
+        page_size=args.max_issues,
+        workers=args.workers,
+    ))
+    result.pop("page", None)
+    result.pop("page_size", None)
+    result["status"] = "issues" if result["total_issues"] else "success"
+    return result
+
+
+def run_lint(args, progress):
+    main = _backend()
+    progress.note(f"linting labels of {args.dataset}")
+    result = main.lint_labels(main.LintRequest(
+        dataset_path=args.dataset,
+        codes=args.codes,
+        min_severity=args.min_severity,
+        fix=args.fix,
+        fix_codes=args.fix_codes,
+        page_size=args.max_issues,
+        workers=args.workers,
+    ))
+    result.pop("page", None)
+    result.pop("page_size", None)
+    result["status"] = "issues" if result["severities"].get("error") else "success"
+    return result
+
+
+def build_parser():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--quiet", action="store_true", help="No progress output on stderr")
+    common.add_argument("--indent", type=int, default=None, help="Indent the JSON result")
+    parser = argparse.ArgumentParser(description="Lama Worlds Annotation Studio batch operations")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export = commands.add_parser("export", parents=[common], help="Export a dataset to COCO, VOC or YOLO")
+    export.add_argument("dataset")
+    export.add_argument("--format", choices=["coco", "voc", "yolo", "yolo_resized"], default="coco")
+    export.add_argument("--output", help="Output file (coco) or directory")
+    export.add_argument("--class-id", type=int, default=None, help="Only images and boxes of this class")
+    export.add_argument("--select", choices=["all", "annotated", "unannotated"], default="all")
+    export.add_argument("--workers", type=int, default=os.cpu_count(), help="Worker processes (default: CPU count)")
+    export.add_argument("--image-size", type=int, default=640, help="yolo_resized: target size")
+    export.add_argument("--no-letterbox", action="store_true", help="yolo_resized: keep the aspect ratio unpadded")
+    export.add_argument("--jpeg-quality", type=int, default=90, help="yolo_resized: JPEG quality")
+    export.set_defaults(run=run_export, label="export")
+
+    merge = commands.add_parser("merge", parents=[common], help="Merge datasets into a new one")
+    merge.add_argument("datasets", nargs="+")
+    merge.add_argument("--output", required=True)
+    merge.add_argument("--dedupe", action="store_true", help="Skip near-duplicate images")
+    merge.add_argument("--dedupe-distance", type=int, default=3)
+    merge.add_argument("--workers", type=int, default=os.cpu_count(), help="Image copy threads (default: CPU count)")
+    merge.set_defaults(run=run_merge, label="merge")
+
+    report = commands.add_parser("report", parents=[common], help="Write quality_report.json into the dataset")
+    report.add_argument("dataset")
+    report.set_defaults(run=run_report, label="report")
+
+    validate = commands.add_parser("validate", parents=[common], help="Audit boxes; exit code 3 when issues are found")
+    validate.add_argument("dataset")
+    validate.add_argument("--workers", type=int, default=os.cpu_count(), help="Worker processes (default: CPU count)")
+    validate.add_argument("--duplicate-iou", type=float, default=0.9)
+    validate.add_argument("--conflict-iou", type=float, default=0.7)
+    validate.add_argument("--min-area", type=float, default=1e-5)
+    validate.add_argument("--issue-types", nargs="*", help="Only report these issue types")
+    validate.add_argument("--max-issues", type=int, default=1000, help="Issues listed in the result")
+    validate.set_defaults(run=run_validate, label="validate")
+
+    lint = commands.add_parser("lint", parents=[common], help="Lint label files; exit code 3 when errors remain")
+    lint.add_argument("dataset")
+    lint.add_argument("--workers", type=int, default=os.cpu_count(), help="Worker processes (default: CPU count)")
+    lint.add_argument("--codes", nargs="*", help="Only list these diagnostic codes")
+    lint.add_argument("--min-severity", choices=["warning", "error"], default="warning")
+    lint.add_argument("--fix", action="store_true", help="Repair fixable problems in place")
+    lint.add_argument("--fix-codes", nargs="*", help="Codes to repair (default: all but unknown_class)")
+    lint.add_argument("--max-issues", type=int, default=1000, help="Diagnostics listed in the result")
+    lint.set_defaults(run=run_lint, label="lint")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command == "merge" and len(args.datasets) < 2:
+        parser.error("merge needs at least 2 datasets")
+    progress = Progress(args.label, enabled=not args.quiet)
+    try:
+        result = args.run(args, progress)
+    except Exception as e:
+        # HTTPException carries the route's message in detail
+        detail = getattr(e, "detail", None) or str(e)
+        print(json.dumps({"status": "error", "command": args.command, "detail": detail}, indent=args.indent))
+        return EXIT_FAILED
+    print(json.dumps(result, indent=args.indent, default=str))
+    return EXIT_ISSUES if result.get("status") == "issues" else EXIT_OK
+
+
+if __name__ == "__main__":
+    sys.exit(main())
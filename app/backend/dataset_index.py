@@ -0,0 +1,84 @@
+"""
+Per-dataset index database for derived data.
+
+Hashes, verification results and other values computed from the dataset
+files are cached in <dataset>/.lama/index.db (SQLite, WAL mode). Every
+feature owns its own tables and keys rows by file path plus (size, mtime)
+so stale entries are detected without reading the files again.
+"""
+import os
+import sqlite3
+import threading
+
+INDEX_DIRNAME = ".lama"
+INDEX_FILENAME = "index.db"
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def index_dir(dataset_path):
+    path = os.path.join(dataset_path, INDEX_DIRNAME)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+class DatasetIndex:
+    """Shared SQLite connection for one dataset's derived data."""
+
+    def __init__(self, dataset_path):
+        self.dataset_path = dataset_path
+        self.path = os.path.join(index_dir(dataset_path), INDEX_FILENAME)
+        # Calls are serialized by the lock so the threadpool can share one connection
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self._schemas = set()
+
+    def ensure_schema(self, name, sql):
+        """Run a feature's CREATE TABLE script once per process."""
+        if name in self._schemas:
+            return
+        with self.lock:
+            self.conn.executescript(sql)
+            self._schemas.add(name)
+
+    def execute(self, sql, params=()):
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def executemany(self, sql, rows):
+        """Run a bulk write in a single transaction."""
+        with self.lock:
+            cur = self.conn.cursor()
+            cur.execute("BEGIN IMMEDIATE")
+            try:
+                cur.executemany(sql, rows)
+                cur.execute("COMMIT")
+            except Exception:
+                cur.execute("ROLLBACK")
+                raise
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def get_index(dataset_path):
+    """The dataset's index, created on first use and cached per dataset."""
+    key = os.path.normcase(os.path.abspath(dataset_path))
+    index = _indexes.get(key)
+    if index is not None:
+        return index
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = _indexes[key] = DatasetIndex(dataset_path)
+    return index
+
+
+def file_signature(path):
+    """(size, mtime) used to detect changed files."""
+    st = os.stat(path)
+    return st.st_size, st.st_mtime
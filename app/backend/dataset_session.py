@@ -0,0 +1,185 @@
+"""
+Cached per-dataset state shared by the routes.
+
+A DatasetSession keeps what every request used to rediscover: the resolved
+images/labels folders, the parsed class list and the sorted image listing,
+next to the image id registry. Each part is validated with a stat call
+(classes.txt size and mtime, the mtimes of the image folders) and only
+rebuilt when it changed, so steady-state requests do no directory walks.
+
+Sessions live in an LRU bounded by count (LAMA_SESSION_MAX, default 16) and
+by their estimated memory (LAMA_SESSION_CACHE_MB, default 256).
+"""
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    from backend import metrics, image_ids
+except ImportError:
+    import metrics
+    import image_ids
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+# Extensions match in lower or upper case, like the original glob patterns (*.jpg, *.JPG)
+IMAGE_SUFFIXES = IMAGE_EXTENSIONS + tuple(ext.upper() for ext in IMAGE_EXTENSIONS)
+CLASS_COLORS = ["#00e0ff", "#56b0ff", "#ff6b6b", "#4ecdc4", "#ffe66d", "#a8e6cf", "#ff8b94", "#c7ceea"]
+
+_sessions = OrderedDict()
+_sessions_lock = threading.Lock()
+
+
+def max_sessions():
+    return max(1, int(os.environ.get("LAMA_SESSION_MAX", "16")))
+
+
+def max_cache_bytes():
+    return int(float(os.environ.get("LAMA_SESSION_CACHE_MB", "256")) * 1024 * 1024)
+
+
+def is_image_name(name):
+    """Whether a file name is listed as an image: not hidden, with an image extension."""
+    return not name.startswith(".") and name.endswith(IMAGE_SUFFIXES)
+
+
+def _signature(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+
+class DatasetSession:
+    """Resolved layout, classes and image listing of one dataset."""
+
+    def __init__(self, dataset_path):
+        self.dataset_path = dataset_path
+        images_dir = os.path.join(dataset_path, "images")
+        if os.path.exists(images_dir):
+            self.images_dir = images_dir
+            self.labels_dir = os.path.join(dataset_path, "labels")
+        else:
+            # Flat structure - images and labels in the dataset root
+            self.images_dir = dataset_path
+            self.labels_dir = dataset_path
+        self._lock = threading.Lock()
+        self._classes = []
+        self._classes_sig = None
+        self._images = None
+        self._dir_mtimes = {}
+        self.nbytes = 0
+
+    @property
+    def registry(self):
+        return image_ids.get_registry(self.dataset_path)
+
+    def layout_valid(self):
+        """False once an images/ folder appears in (or disappears from) the dataset."""
+        has_images_dir = os.path.exists(os.path.join(self.dataset_path, "images"))
+        return has_images_dir == (self.images_dir != self.dataset_path)
+
+    def classes(self):
+        """[{"id", "name", "color"}] from classes.txt (blank lines keep their id)."""
+        path = os.path.join(self.dataset_path, "classes.txt")
+        sig = _signature(path)
+        metrics.cache_lookup("session_classes", sig == self._classes_sig)
+        if sig != self._classes_sig:
+            classes = []
+            if sig is not None:
+                with open(path, 'r', encoding='utf-8') as f:
+                    for i, line in enumerate(f.readlines()):
+                        name = line.strip()
+                        if name:
+                            classes.append({"id": i, "name": name, "color": CLASS_COLORS[i % len(CLASS_COLORS)]})
+            self._classes, self._classes_sig = classes, sig
+        return self._classes
+
+    def _listing_valid(self):
+        if self._images is None:
+            return False
+        for directory, mtime in self._dir_mtimes.items():
+            try:
+                if os.stat(directory).st_mtime_ns != mtime:
+                    return False
+            except OSError:
+                return False
+        return True
+
+    def image_list(self, caller="load_dataset"):
+        """Sorted absolute paths of every image (recursive). Shared: callers must not modify it."""
+        with self._lock:
+            valid = self._listing_valid()
+            metrics.cache_lookup("session_listing", valid)
+            if not valid:
+                self._images, self._dir_mtimes = _scan_images(self.images_dir, caller)
+                self.nbytes = sum(sys.getsizeof(p) + 8 for p in self._images)
+                with _sessions_lock:
+                    _evict()
+            return self._images
+
+    def invalidate_listing(self):
+        with self._lock:
+            self._images = None
+
+
+def _scan_images(images_dir, caller):
+    """(sorted absolute image paths, {directory: mtime_ns}) in one walk of images_dir."""
+    start = time.perf_counter()
+    images = []
+    dir_mtimes = {}
+    seen_paths = set()
+    for root, dirs, files in os.walk(os.path.abspath(images_dir)):
+        # Hidden folders (like the .lama index) are skipped, as glob does
+        dirs[:] = [d for d in dirs if not d.startswith(".")]
+        try:
+            dir_mtimes[root] = os.stat(root).st_mtime_ns
+        except OSError:
+            continue
+        for name in files:
+            if is_image_name(name):
+                path = os.path.join(root, name)
+                # Normalize path for comparison (lowercase on Windows)
+                normalized = path.lower() if os.name == 'nt' else path
+                if normalized not in seen_paths:
+                    seen_paths.add(normalized)
+                    images.append(path)
+    images.sort()  # Sort for consistent ordering
+    metrics.GLOB_WALKS.inc(caller)
+    metrics.GLOB_WALK_SECONDS.inc(caller, amount=time.perf_counter() - start)
+    metrics.GLOB_FILES.inc(caller, amount=len(images))
+    return images, dir_mtimes
+
+
+def _evict():
+    """Drop least recently used sessions beyond the count and memory limits."""
+    limit = max_cache_bytes()
+    while len(_sessions) > 1 and (len(_sessions) > max_sessions()
+                                  or sum(s.nbytes for s in _sessions.values()) > limit):
+        _sessions.popitem(last=False)
+
+
+def get_session(dataset_path):
+    """The cached session of a dataset, created (or re-created after a layout change) on demand."""
+    key = os.path.normcase(os.path.abspath(dataset_path))
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is not None and session.layout_valid():
+            _sessions.move_to_end(key)
+            return session
+        session = _sessions[key] = DatasetSession(dataset_path)
+        _sessions.move_to_end(key)
+        _evict()
+    return session
+
+
+def stats():
+    with _sessions_lock:
+        return {
+            "sessions": len(_sessions),
+            "bytes": sum(s.nbytes for s in _sessions.values()),
+            "max_sessions": max_sessions(),
+            "max_bytes": max_cache_bytes(),
+        }
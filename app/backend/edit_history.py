@@ -0,0 +1,197 @@
+"""
+Per-image edit history kept in the dataset index.
+
+Every save appends a revision holding only the line-level delta from the
+previous label content. Every SNAPSHOT_INTERVAL-th revision is a full
+snapshot, so rebuilding any revision applies at most SNAPSHOT_INTERVAL - 1
+deltas on top of the nearest snapshot instead of replaying the whole history.
+Retention is bounded per image: once an image has more than
+LAMA_HISTORY_KEEP revisions (plus one snapshot interval of slack), the oldest
+ones are dropped and the first remaining revision is rewritten as a snapshot.
+
+Revisions are keyed by label, not by image stem, so images with the same
+name in different subfolders keep separate histories: the label file's path
+relative to the dataset root (see label_key), or the stem for datasets in the
+annotation store, which keys its labels by stem.
+"""
+import difflib
+import json
+import os
+import time
+
+try:
+    from backend import dataset_index, annotation_store
+except ImportError:
+    import dataset_index
+    import annotation_store
+
+SNAPSHOT_INTERVAL = 16
+
+_migrated = set()  # index files already checked for the stem-keyed table
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS label_history (
+    label TEXT NOT NULL,
+    rev INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    snapshot INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    boxes INTEGER NOT NULL,
+    changed INTEGER NOT NULL,
+    PRIMARY KEY (label, rev)
+) WITHOUT ROWID;
+"""
+
+
+def max_revisions():
+    try:
+        return max(1, int(os.environ.get("LAMA_HISTORY_KEEP", "200")))
+    except ValueError:
+        return 200
+
+
+def _index(dataset_path):
+    index = dataset_index.get_index(dataset_path)
+    index.ensure_schema("label_history", _SCHEMA)
+    if index.path not in _migrated:
+        _migrate(index, dataset_path)
+        _migrated.add(index.path)
+    return index
+
+
+def _migrate(index, dataset_path):
+    """Move revisions of the former stem-keyed edit_history table to label keys."""
+    with index.lock:
+        if not index.conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'edit_history'").fetchall():
+            return
+        stems = [stem for (stem,) in index.conn.execute("SELECT DISTINCT stem FROM edit_history")]
+        in_store = os.path.exists(annotation_store.store_path(dataset_path))
+        cur = index.conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            for stem in stems:
+                label_file = os.path.join(dataset_path, "labels", stem + ".txt")
+                # Stems of nested images were ambiguous; only flat labels/ files can be told apart
+                key = stem if in_store or not os.path.exists(label_file) else label_key(dataset_path, label_file)
+                cur.execute(
+                    "INSERT OR IGNORE INTO label_history "
+                    "SELECT ?, rev, created_at, snapshot, data, boxes, changed FROM edit_history WHERE stem = ?",
+                    (key, stem),
+                )
+            cur.execute("DROP TABLE edit_history")
+            cur.execute("COMMIT")
+        except Exception:
+            cur.execute("ROLLBACK")
+            raise
+
+
+def label_key(dataset_path, label_file):
+    """History key of a label file: its path relative to the dataset root."""
+    rel = os.path.relpath(os.path.abspath(label_file), os.path.abspath(dataset_path))
+    return rel.replace(os.sep, "/")
+
+
+def diff_lines(old_lines, new_lines):
+    """Delta as [[start, end, replacement_lines], ...] over old_lines."""
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    return [[i1, i2, new_lines[j1:j2]] for tag, i1, i2, j1, j2 in matcher.get_opcodes() if tag != "equal"]
+
+
+def apply_delta(lines, delta):
+    lines = list(lines)
+    # Ranges refer to the old content, so apply from the end backwards
+    for start, end, replacement in reversed(delta):
+        lines[start:end] = replacement
+    return lines
+
+
+def _count_boxes(lines):
+    return sum(1 for line in lines if line.strip())
+
+
+def _insert(index, label, rev, snapshot, data, boxes, changed):
+    index.execute(
+        "INSERT OR REPLACE INTO label_history (label, rev, created_at, snapshot, data, boxes, changed) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (label, rev, time.time(), 1 if snapshot else 0, json.dumps(data), boxes, changed),
+    )
+
+
+def record(dataset_path, label, old_lines, new_lines):
+    """
+    Append a revision for a label change. The caller holds the label lock.
+    The first recorded change also stores the original content as revision 0.
+    """
+    if old_lines == new_lines:
+        return None
+    index = _index(dataset_path)
+    row = index.execute("SELECT MAX(rev) FROM label_history WHERE label = ?", (label,))[0]
+    if row[0] is None:
+        _insert(index, label, 0, True, old_lines, _count_boxes(old_lines), 0)
+        rev = 1
+    else:
+        rev = row[0] + 1
+
+    delta = diff_lines(old_lines, new_lines)
+    changed = sum(max(end - start, len(replacement)) for start, end, replacement in delta)
+    if rev % SNAPSHOT_INTERVAL == 0:
+        _insert(index, label, rev, True, new_lines, _count_boxes(new_lines), changed)
+    else:
+        _insert(index, label, rev, False, delta, _count_boxes(new_lines), changed)
+
+    _compact(index, label, rev)
+    return rev
+
+
+def _compact(index, label, last_rev):
+    keep = max_revisions()
+    first_rev = index.execute("SELECT MIN(rev) FROM label_history WHERE label = ?", (label,))[0][0]
+    # Compact in batches once the slack is used up, not on every save
+    if last_rev - first_rev + 1 <= keep + SNAPSHOT_INTERVAL:
+        return
+    new_first = last_rev - keep + 1
+    lines = _build(index, label, new_first)
+    with index.lock:
+        cur = index.conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            cur.execute("DELETE FROM label_history WHERE label = ? AND rev < ?", (label, new_first))
+            cur.execute(
+                "UPDATE label_history SET snapshot = 1, data = ? WHERE label = ? AND rev = ?",
+                (json.dumps(lines), label, new_first),
+            )
+            cur.execute("COMMIT")
+        except Exception:
+            cur.execute("ROLLBACK")
+            raise
+
+
+def _build(index, label, rev):
+    rows = index.execute(
+        "SELECT rev, snapshot, data FROM label_history WHERE label = ? AND rev <= ? "
+        "AND rev >= (SELECT MAX(rev) FROM label_history WHERE label = ? AND rev <= ? AND snapshot = 1) "
+        "ORDER BY rev",
+        (label, rev, label, rev),
+    )
+    if not rows or rows[-1][0] != rev:
+        return None
+    lines = json.loads(rows[0][2])
+    for _, _, data in rows[1:]:
+        lines = apply_delta(lines, json.loads(data))
+    return lines
+
+
+def revision_lines(dataset_path, label, rev):
+    """Label lines at a revision, or None if it is not (or no longer) in the history."""
+    return _build(_index(dataset_path), label, rev)
+
+
+def list_revisions(dataset_path, label):
+    rows = _index(dataset_path).execute(
+        "SELECT rev, created_at, snapshot, boxes, changed FROM label_history WHERE label = ? ORDER BY rev DESC",
+        (label,),
+    )
+    return [
+        {"rev": rev, "created_at": created_at, "snapshot": bool(snapshot), "boxes": boxes, "changed": changed}
+        for rev, created_at, snapshot, boxes, changed in rows
+    ]
@@ -1,20 +1,37 @@
 import os
+import itertools
 import json
+import shutil
+import zlib
 import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor
 from PIL import Image
 
-def export_coco(dataset_path, output_file):
-    images_dir = os.path.join(dataset_path, "images")
-    labels_dir = os.path.join(dataset_path, "labels")
-    
-    coco = {
-        "images": [],
-        "annotations": [],
-        "categories": [],
-        "info": {"description": "Exported from Lama Worlds Annotation Studio"}
-    }
-    
-    # Load classes
+try:
+    from backend import metrics, annotation_store, label_index, dataset_index, image_verify, dataset_session
+except ImportError:
+    import metrics
+    import annotation_store
+    import label_index
+    import dataset_index
+    import image_verify
+    import dataset_session
+
+LETTERBOX_COLOR = (114, 114, 114)
+
+_RESIZED_SCHEMA = """
+CREATE TABLE IF NOT EXISTS resized_export (
+    output_dir TEXT NOT NULL,
+    stem TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    label_crc INTEGER NOT NULL,
+    params TEXT NOT NULL,
+    PRIMARY KEY (output_dir, stem)
+) WITHOUT ROWID;
+"""
+
+def load_class_names(dataset_path):
     class_map = {}
     classes_file = os.path.join(dataset_path, "classes.txt")
     if os.path.exists(classes_file):
@@ -23,133 +40,470 @@ def export_coco(dataset_path, output_file):
             for i, line in enumerate(lines):
                 name = line.strip()
                 if name:
-                    coco["categories"].append({"id": i, "name": name, "supercategory": "none"})
                     class_map[i] = name
-    
+    return class_map
+
+def select_images(dataset_path, class_id=None, annotated=None):
+    """
+    Image file names to export, with the filters pushed down to the label
+    index (or the annotation store): only matching images are returned, so
+    the export never opens images or parses labels outside the result.
+    Images known to be corrupt (see image_verify) are left out.
+    Returns (filenames, images_dir, labels_dir, store).
+    """
+    images_dir = os.path.join(dataset_path, "images")
+    labels_dir = os.path.join(dataset_path, "labels")
+    store = annotation_store.get_store(dataset_path)
+
+    filenames = sorted(f for f in os.listdir(images_dir) if dataset_session.is_image_name(f))
+    # Images already found corrupt or unreadable are not retried
+    bad = image_verify.known_bad(dataset_path)
+    if bad:
+        abs_images_dir = os.path.abspath(images_dir)
+        filenames = [f for f in filenames if os.path.join(abs_images_dir, f) not in bad]
+    if class_id is None and annotated is None:
+        return filenames, images_dir, labels_dir, store
+
+    if store:
+        if class_id is not None:
+            matching = set(store.annotated_stems(class_id))
+        annotated_stems = set(store.annotated_stems())
+    else:
+        label_index.refresh(dataset_path, labels_dir)
+        if class_id is not None:
+            matching = {os.path.basename(p)[:-4] for p in label_index.label_files_with_class(dataset_path, class_id)}
+        annotated_stems = {os.path.basename(p)[:-4] for p in label_index.annotated_label_files(dataset_path)}
+
+    if class_id is not None:
+        stems = matching if annotated is not False else set()
+    elif annotated:
+        stems = annotated_stems
+    else:
+        stems = None
+
+    selected = []
+    for filename in filenames:
+        stem = os.path.splitext(filename)[0]
+        if stems is not None:
+            if stem in stems:
+                selected.append(filename)
+        elif stem not in annotated_stems:
+            # annotated=False: images without any box
+            selected.append(filename)
+    return selected, images_dir, labels_dir, store
+
+def read_label_lines(store, labels_dir, stem):
+    """Label lines of one image, or None if it has no label file."""
+    if store:
+        return store.read_lines(stem) if store.has_image(stem) else None
+    label_path = os.path.join(labels_dir, stem + ".txt")
+    if not os.path.exists(label_path):
+        return None
+    metrics.LABEL_PARSES.inc()
+    with open(label_path, 'r') as f:
+        return f.read().splitlines()
+
+def parse_boxes(lines, class_id=None):
+    """(cls_id, x_cen, y_cen, width, height) of the valid lines, optionally of one class."""
+    boxes = []
+    for line in lines:
+        parts = line.strip().split()
+        if len(parts) >= 5:
+            try:
+                box = (int(parts[0]), float(parts[1]), float(parts[2]), float(parts[3]), float(parts[4]))
+            except ValueError:
+                continue
+            if class_id is None or box[0] == class_id:
+                boxes.append(box)
+    return boxes
+
+SAMPLE_CHUNK = 1024
+
+def image_info(path):
+    """(width, height, depth) of an image, or None if it cannot be read. Also a process pool worker."""
+    try:
+        with Image.open(path) as img:
+            return img.size[0], img.size[1], len(img.getbands())
+    except Exception:
+        return None
+
+def iter_samples(dataset_path, class_id=None, annotated=None, need_size=True, require_labels=False,
+                 workers=None, progress=None):
+    """
+    Stream the selected images one at a time as dicts with filename, path,
+    stem, lines (raw label lines, None without label), boxes and, with
+    need_size, width/height/depth. Shared by the YOLO, COCO and VOC writers.
+    With workers > 1 image sizes are read on a process pool, SAMPLE_CHUNK
+    images at a time. progress(done, total) is called after each image.
+    """
+    filenames, images_dir, labels_dir, store = select_images(dataset_path, class_id, annotated)
+    total = len(filenames)
+    pool = ProcessPoolExecutor(max_workers=workers) if need_size and workers and workers > 1 and total > 1 else None
+    try:
+        for start in range(0, total, SAMPLE_CHUNK):
+            chunk = []
+            for filename in filenames[start:start + SAMPLE_CHUNK]:
+                stem = os.path.splitext(filename)[0]
+                lines = read_label_lines(store, labels_dir, stem)
+                if lines is None and require_labels:
+                    chunk.append(None)
+                    continue
+                chunk.append({
+                    "filename": filename,
+                    "path": os.path.join(images_dir, filename),
+                    "stem": stem,
+                    "lines": lines,
+                    "boxes": parse_boxes(lines or [], class_id)
+                })
+            if need_size:
+                paths = [sample["path"] for sample in chunk if sample is not None]
+                metrics.IMAGE_OPENS.inc("export", amount=len(paths))
+                infos = iter(pool.map(image_info, paths, chunksize=32) if pool else map(image_info, paths))
+            for i, sample in enumerate(chunk):
+                if sample is not None and need_size:
+                    info = next(infos)
+                    if info is None:
+                        image_verify.mark_bad(dataset_path, sample["path"], "Could not be read during export")
+                        sample = None
+                    else:
+                        sample["width"], sample["height"], sample["depth"] = info
+                if sample is not None:
+                    yield sample
+                if progress:
+                    progress(start + i + 1, total)
+    finally:
+        if pool:
+            pool.shutdown()
+
+def export_coco(dataset_path, output_file, class_id=None, annotated=None, workers=None, progress=None):
+    coco = {
+        "images": [],
+        "annotations": [],
+        "categories": [],
+        "info": {"description": "Exported from Lama Worlds Annotation Studio"}
+    }
+
+    # Load classes
+    for i, name in load_class_names(dataset_path).items():
+        if class_id is None or i == class_id:
+            coco["categories"].append({"id": i, "name": name, "supercategory": "none"})
+
     ann_id = 1
     img_id = 1
-    
-    for filename in os.listdir(images_dir):
-        if not filename.lower().endswith(('.jpg', '.png', '.jpeg')):
-            continue
-            
-        # Get dimensions
-        img_path = os.path.join(images_dir, filename)
-        try:
-            with Image.open(img_path) as img:
-                w, h = img.size
-        except:
-            continue
-            
+
+    for sample in iter_samples(dataset_path, class_id, annotated, workers=workers, progress=progress):
+        w, h = sample["width"], sample["height"]
         coco["images"].append({
             "id": img_id,
-            "file_name": filename,
+            "file_name": sample["filename"],
             "width": w,
             "height": h
         })
-        
-        # Load annotation
-        basename = os.path.splitext(filename)[0]
-        label_path = os.path.join(labels_dir, basename + ".txt")
-        if os.path.exists(label_path):
-            with open(label_path, 'r') as f:
-                for line in f:
-                    parts = line.strip().split()
-                    if len(parts) >= 5:
-                        cls_id = int(parts[0])
-                        x_cen = float(parts[1])
-                        y_cen = float(parts[2])
-                        width = float(parts[3])
-                        height = float(parts[4])
-                        
-                        # COCO: x_top_left, y_top_left, width, height (pixels)
-                        abs_w = width * w
-                        abs_h = height * h
-                        abs_x = (x_cen * w) - (abs_w / 2)
-                        abs_y = (y_cen * h) - (abs_h / 2)
-                        
-                        coco["annotations"].append({
-                            "id": ann_id,
-                            "image_id": img_id,
-                            "category_id": cls_id,
-                            "bbox": [abs_x, abs_y, abs_w, abs_h],
-                            "area": abs_w * abs_h,
-                            "iscrowd": 0
-                        })
-                        ann_id += 1
-                        
+
+        for cls_id, x_cen, y_cen, width, height in sample["boxes"]:
+            # COCO: x_top_left, y_top_left, width, height (pixels)
+            abs_w = width * w
+            abs_h = height * h
+            abs_x = (x_cen * w) - (abs_w / 2)
+            abs_y = (y_cen * h) - (abs_h / 2)
+
+            coco["annotations"].append({
+                "id": ann_id,
+                "image_id": img_id,
+                "category_id": cls_id,
+                "bbox": [abs_x, abs_y, abs_w, abs_h],
+                "area": abs_w * abs_h,
+                "iscrowd": 0
+            })
+            ann_id += 1
+
         img_id += 1
-        
+
     with open(output_file, 'w') as f:
         json.dump(coco, f, indent=4)
-        
+    metrics.BYTES_WRITTEN.inc("export", amount=os.path.getsize(output_file))
+
     return output_file
 
-def export_voc(dataset_path, output_dir):
+def _write_voc(args):
+    """Process pool worker: write the VOC XML of one image. Returns bytes written, None if unreadable."""
+    path, filename, boxes, xml_path = args
+    info = image_info(path)
+    if info is None:
+        return None
+    w, h, depth = info
+
+    root = ET.Element("annotation")
+    ET.SubElement(root, "folder").text = "images"
+    ET.SubElement(root, "filename").text = filename
+
+    size = ET.SubElement(root, "size")
+    ET.SubElement(size, "width").text = str(w)
+    ET.SubElement(size, "height").text = str(h)
+    ET.SubElement(size, "depth").text = str(depth)
+
+    for cls_id, x_cen, y_cen, width, height in boxes:
+        obj = ET.SubElement(root, "object")
+        ET.SubElement(obj, "name").text = str(cls_id) # Should map to name if possible
+        ET.SubElement(obj, "pose").text = "Unspecified"
+        ET.SubElement(obj, "truncated").text = "0"
+        ET.SubElement(obj, "difficult").text = "0"
+
+        bndbox = ET.SubElement(obj, "bndbox")
+
+        xmin = int((x_cen - width/2) * w)
+        ymin = int((y_cen - height/2) * h)
+        xmax = int((x_cen + width/2) * w)
+        ymax = int((y_cen + height/2) * h)
+
+        ET.SubElement(bndbox, "xmin").text = str(max(0, xmin))
+        ET.SubElement(bndbox, "ymin").text = str(max(0, ymin))
+        ET.SubElement(bndbox, "xmax").text = str(min(w, xmax))
+        ET.SubElement(bndbox, "ymax").text = str(min(h, ymax))
+
+    tree = ET.ElementTree(root)
+    tree.write(xml_path)
+    return os.path.getsize(xml_path)
+
+def export_voc(dataset_path, output_dir, class_id=None, annotated=None, workers=None, progress=None):
+    """
+    One VOC XML per labeled image. With workers > 1 the images are opened
+    and their XML built and written on a process pool, SAMPLE_CHUNK at a time.
+    """
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
-        
-    images_dir = os.path.join(dataset_path, "images")
-    labels_dir = os.path.join(dataset_path, "labels")
-    
+
+    position = [0, 0]
+    def track(done, total):
+        position[:] = done, total
+
+    samples = iter_samples(dataset_path, class_id, annotated, need_size=False, require_labels=True,
+                           progress=track)
+    pool = ProcessPoolExecutor(max_workers=workers) if workers and workers > 1 else None
     count = 0
-    for filename in os.listdir(images_dir):
-        if not filename.lower().endswith(('.jpg', '.png', '.jpeg')):
+    try:
+        while True:
+            chunk = [(sample["path"], sample["filename"], sample["boxes"],
+                      os.path.join(output_dir, sample["stem"] + ".xml"))
+                     for sample in itertools.islice(samples, SAMPLE_CHUNK)]
+            if not chunk:
+                break
+            metrics.IMAGE_OPENS.inc("export", amount=len(chunk))
+            results = pool.map(_write_voc, chunk, chunksize=32) if pool else map(_write_voc, chunk)
+            for args, written in zip(chunk, results):
+                if written is None:
+                    image_verify.mark_bad(dataset_path, args[0], "Could not be read during export")
+                else:
+                    metrics.BYTES_WRITTEN.inc("export", amount=written)
+                    count += 1
+            if progress:
+                progress(*position)
+    finally:
+        if pool:
+            pool.shutdown()
+    if progress and position[0] < position[1]:
+        # Trailing images without labels
+        progress(position[1], position[1])
+
+    return count
+
+def export_yolo(dataset_path, output_dir, class_id=None, annotated=None, progress=None):
+    """
+    Copy the selected images and their labels into output_dir/images and
+    output_dir/labels, with classes.txt. Images are hard-linked when the
+    file system allows it. With class_id only boxes of that class are kept.
+    """
+    images_out = os.path.join(output_dir, "images")
+    labels_out = os.path.join(output_dir, "labels")
+    os.makedirs(images_out, exist_ok=True)
+    os.makedirs(labels_out, exist_ok=True)
+
+    classes_file = os.path.join(dataset_path, "classes.txt")
+    if os.path.exists(classes_file):
+        shutil.copy2(classes_file, os.path.join(output_dir, "classes.txt"))
+
+    count = 0
+    for sample in iter_samples(dataset_path, class_id, annotated, need_size=False, progress=progress):
+        image_out = os.path.join(images_out, sample["filename"])
+        if os.path.exists(image_out):
+            os.remove(image_out)
+        try:
+            os.link(sample["path"], image_out)
+        except OSError:
+            shutil.copy2(sample["path"], image_out)
+
+        if sample["lines"] is not None:
+            lines = sample["lines"]
+            if class_id is not None:
+                lines = [line for line in lines if parse_boxes([line], class_id)]
+            content = "".join(line + "\n" for line in lines)
+            with open(os.path.join(labels_out, sample["stem"] + ".txt"), 'w') as f:
+                f.write(content)
+            metrics.BYTES_WRITTEN.inc("export", amount=len(content))
+        count += 1
+
+    return count
+
+def transform_label_lines(lines, class_id, scale_x, scale_y, pad_x, pad_y, out_w, out_h):
+    """Map normalized YOLO lines of the source image onto a resized (and padded) output image."""
+    out = []
+    for line in lines:
+        parts = line.split()
+        try:
+            cls_id = int(parts[0])
+            x_cen, y_cen, width, height = (float(v) for v in parts[1:5])
+        except (IndexError, ValueError):
             continue
-            
-        basename = os.path.splitext(filename)[0]
-        label_path = os.path.join(labels_dir, basename + ".txt")
-        
-        if not os.path.exists(label_path):
+        if class_id is not None and cls_id != class_id:
             continue
-            
-        img_path = os.path.join(images_dir, filename)
+        x_cen = (x_cen * scale_x + pad_x) / out_w
+        y_cen = (y_cen * scale_y + pad_y) / out_h
+        width = width * scale_x / out_w
+        height = height * scale_y / out_h
+        extra = f" {parts[5]}" if len(parts) > 5 else ""
+        out.append(f"{cls_id} {x_cen:.6f} {y_cen:.6f} {width:.6f} {height:.6f}{extra}")
+    return out
+
+def _resize_one(args):
+    """Process pool worker: write one resized/letterboxed image and its label. Returns bytes written (None if unreadable)."""
+    src, lines, image_out, label_out, size, letterbox, quality, class_id = args
+    try:
+        with Image.open(src) as source:
+            w, h = source.size
+            ratio = min(size / max(w, h), 1.0)
+            new_w, new_h = max(1, round(w * ratio)), max(1, round(h * ratio))
+            # JPEG draft decoding at reduced scale skips most of the decode work for large photos
+            source.draft("RGB", (new_w, new_h))
+            img = source.convert("RGB")
+    except Exception:
+        # Corrupt or unreadable: reported to the caller, nothing written
+        return None
+    if img.size != (new_w, new_h):
+        img = img.resize((new_w, new_h), Image.BILINEAR)
+    if letterbox:
+        canvas = Image.new("RGB", (size, size), LETTERBOX_COLOR)
+        pad_x, pad_y = (size - new_w) // 2, (size - new_h) // 2
+        canvas.paste(img, (pad_x, pad_y))
+        img, out_w, out_h = canvas, size, size
+    else:
+        pad_x, pad_y, out_w, out_h = 0, 0, new_w, new_h
+    tmp_path = image_out + ".part"
+    img.save(tmp_path, "JPEG", quality=quality)
+    os.replace(tmp_path, image_out)
+    written = os.path.getsize(image_out)
+
+    if lines is not None:
+        content = "".join(line + "\n" for line in
+                          transform_label_lines(lines, class_id, new_w, new_h, pad_x, pad_y, out_w, out_h))
+        with open(label_out, 'w') as f:
+            f.write(content)
+        written += len(content)
+    elif os.path.exists(label_out):
+        os.remove(label_out)
+    return written
+
+def export_resized(dataset_path, output_dir, size=640, letterbox=True, quality=90,
+                   class_id=None, annotated=None, workers=None, progress=None):
+    """
+    Write a training-ready YOLO copy with every image downscaled to fit size
+    (letterboxed to size x size when letterbox is set) and boxes recomputed.
+    Images run on a process pool; an image is only reprocessed when its
+    source file, its label or the export settings changed since the last run
+    into the same output_dir. Images whose names differ only in extension
+    are written as stem, stem_1, ... Returns a summary dict; "skipped" counts
+    images that vanished or could not be stat'ed before they were read.
+    """
+    images_out = os.path.join(output_dir, "images")
+    labels_out = os.path.join(output_dir, "labels")
+    os.makedirs(images_out, exist_ok=True)
+    os.makedirs(labels_out, exist_ok=True)
+
+    classes_file = os.path.join(dataset_path, "classes.txt")
+    if os.path.exists(classes_file):
+        shutil.copy2(classes_file, os.path.join(output_dir, "classes.txt"))
+
+    index = dataset_index.get_index(dataset_path)
+    index.ensure_schema("resized_export", _RESIZED_SCHEMA)
+    output_key = os.path.normcase(os.path.abspath(output_dir))
+    previous = {stem: (size_, mtime, crc, params) for stem, size_, mtime, crc, params in index.execute(
+        "SELECT stem, size, mtime, label_crc, params FROM resized_export WHERE output_dir = ?", (output_key,)
+    )}
+    params = f"{size}:{int(letterbox)}:{quality}:{class_id}"
+
+    filenames, images_dir, labels_dir, store = select_images(dataset_path, class_id, annotated)
+    todo, rows = [], []
+    selected = set()
+    skipped = 0
+    for filename in filenames:
+        stem = os.path.splitext(filename)[0]
+        # Every output is a .jpg, so a.jpg and a.png would overwrite each other:
+        # later ones get a _N suffix like in merge (file names are sorted, so the
+        # same image keeps the same output name between runs)
+        out_stem, n = stem, 0
+        while out_stem in selected:
+            n += 1
+            out_stem = f"{stem}_{n}"
+        selected.add(out_stem)
+        src = os.path.join(images_dir, filename)
         try:
-            with Image.open(img_path) as img:
-                w, h = img.size
-                depth = len(img.getbands())
-        except:
+            src_size, src_mtime = dataset_index.file_signature(src)
+        except OSError:
+            skipped += 1
             continue
-            
-        root = ET.Element("annotation")
-        ET.SubElement(root, "folder").text = "images"
-        ET.SubElement(root, "filename").text = filename
-        
-        size = ET.SubElement(root, "size")
-        ET.SubElement(size, "width").text = str(w)
-        ET.SubElement(size, "height").text = str(h)
-        ET.SubElement(size, "depth").text = str(depth)
-        
-        with open(label_path, 'r') as f:
-            for line in f:
-                parts = line.strip().split()
-                if len(parts) >= 5:
-                    cls_id = int(parts[0])
-                    x_cen = float(parts[1])
-                    y_cen = float(parts[2])
-                    width = float(parts[3])
-                    height = float(parts[4])
-                    
-                    obj = ET.SubElement(root, "object")
-                    ET.SubElement(obj, "name").text = str(cls_id) # Should map to name if possible
-                    ET.SubElement(obj, "pose").text = "Unspecified"
-                    ET.SubElement(obj, "truncated").text = "0"
-                    ET.SubElement(obj, "difficult").text = "0"
-                    
-                    bndbox = ET.SubElement(obj, "bndbox")
-                    
-                    xmin = int((x_cen - width/2) * w)
-                    ymin = int((y_cen - height/2) * h)
-                    xmax = int((x_cen + width/2) * w)
-                    ymax = int((y_cen + height/2) * h)
-                    
-                    ET.SubElement(bndbox, "xmin").text = str(max(0, xmin))
-                    ET.SubElement(bndbox, "ymin").text = str(max(0, ymin))
-                    ET.SubElement(bndbox, "xmax").text = str(min(w, xmax))
-                    ET.SubElement(bndbox, "ymax").text = str(min(h, ymax))
-                    
-        tree = ET.ElementTree(root)
-        tree.write(os.path.join(output_dir, basename + ".xml"))
-        count += 1
-        
-    return count
+        lines = read_label_lines(store, labels_dir, stem)
+        crc = zlib.crc32("\n".join(lines).encode("utf-8")) if lines is not None else -1
+        image_out = os.path.join(images_out, out_stem + ".jpg")
+        if previous.get(out_stem) == (src_size, src_mtime, crc, params) and os.path.exists(image_out):
+            continue
+        todo.append((src, lines, image_out, os.path.join(labels_out, out_stem + ".txt"),
+                     size, letterbox, quality, class_id))
+        rows.append((output_key, out_stem, src_size, src_mtime, crc, params))
+
+    written = 0
+    done_rows = []
+    failed = 0
+    if todo:
+        workers = workers or os.cpu_count() or 1
+        pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 and len(todo) > 1 else None
+        try:
+            results = pool.map(_resize_one, todo, chunksize=16) if pool else map(_resize_one, todo)
+            for i, (args, row, result) in enumerate(zip(todo, rows, results)):
+                if result is None:
+                    image_verify.mark_bad(dataset_path, args[0], "Could not be read during export")
+                    failed += 1
+                else:
+                    written += result
+                    done_rows.append(row)
+                if progress:
+                    progress(i + 1, len(todo))
+        finally:
+            if pool:
+                pool.shutdown()
+        metrics.IMAGE_OPENS.inc("export", amount=len(todo))
+        metrics.BYTES_WRITTEN.inc("export", amount=written)
+        index.executemany(
+            "INSERT OR REPLACE INTO resized_export (output_dir, stem, size, mtime, label_crc, params) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            done_rows,
+        )
+
+    # Images that left the selection (deleted, or filtered out) are removed from the output
+    stale = [stem for stem in previous if stem not in selected]
+    for stem in stale:
+        for path in (os.path.join(images_out, stem + ".jpg"), os.path.join(labels_out, stem + ".txt")):
+            if os.path.exists(path):
+                os.remove(path)
+    if stale:
+        index.executemany(
+            "DELETE FROM resized_export WHERE output_dir = ? AND stem = ?", [(output_key, stem) for stem in stale]
+        )
+
+    return {
+        "count": len(selected),
+        "processed": len(done_rows),
+        "unchanged": len(selected) - len(done_rows) - failed - skipped,
+        "failed": failed,
+        "skipped": skipped,
+        "removed": len(stale),
+        "bytes_written": written
+    }
@@ -0,0 +1,182 @@
+"""
+Stable integer ids for the images of a dataset.
+
+An image gets its id in the dataset index the first time it is listed,
+keyed by its path relative to the dataset root. Ids come from an
+AUTOINCREMENT column, so an id is never handed out again after its image is
+deleted. Resolved images are kept in memory with their absolute path, base
+name and label file, and their dimensions are stored once read (and reread
+when the file's size or mtime changes), so load and save calls addressed by
+id skip the path munging, existence checks and image opens of the path-based
+calls.
+"""
+import os
+import threading
+
+try:
+    from backend import dataset_index, subsystems, metrics, shared_state
+except ImportError:
+    import dataset_index
+    import subsystems
+    import metrics
+    import shared_state
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS image_ids (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    path TEXT NOT NULL UNIQUE,
+    width INTEGER,
+    height INTEGER,
+    size INTEGER,
+    mtime REAL
+);
+CREATE TABLE IF NOT EXISTS image_ids_generation (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO image_ids_generation (id, value) VALUES (0, 0);
+"""
+
+_registries = {}
+_registries_lock = threading.Lock()
+
+
+def label_location(image_path):
+    """(base_name, label_file) of an image: labels/ next to an images/ folder, else beside the image."""
+    base_name = os.path.splitext(os.path.basename(image_path))[0]
+    image_dir = os.path.dirname(image_path)
+    if os.path.basename(image_dir) == "images":
+        label_dir = os.path.join(os.path.dirname(image_dir), "labels")
+    else:
+        label_dir = image_dir
+    return base_name, os.path.join(label_dir, base_name + ".txt")
+
+
+class ImageRecord:
+    """Resolved locations and cached dimensions of one image."""
+
+    __slots__ = ("id", "path", "base_name", "label_file", "width", "height", "signature", "checked")
+
+    def __init__(self, image_id, path, width=None, height=None):
+        self.id = image_id
+        self.path = path
+        self.base_name, self.label_file = label_location(path)
+        self.width = width
+        self.height = height
+        # (size, mtime) the cached dimensions were read or validated at
+        self.signature = None
+        # The image file and label folder are checked once per process
+        self.checked = False
+
+
+class ImageRegistry:
+    """Id <-> image mapping of one dataset, backed by the dataset index."""
+
+    def __init__(self, dataset_path):
+        self.dataset_path = os.path.abspath(dataset_path)
+        self._prefix = os.path.join(self.dataset_path, "")
+        self.index = dataset_index.get_index(dataset_path)
+        self.index.ensure_schema("image_ids", _SCHEMA)
+        self._lock = threading.Lock()
+        self._ids = None  # relative path -> id, loaded on first use
+        self._records = {}
+        self._generation = None
+
+    def _key(self, image_path):
+        if image_path.startswith(self._prefix):
+            # Listed images are absolute paths inside the dataset: no relpath needed
+            rel = image_path[len(self._prefix):]
+        else:
+            rel = os.path.relpath(os.path.abspath(image_path), self.dataset_path)
+        if os.sep != "/":
+            rel = rel.replace(os.sep, "/")
+        return rel.lower() if os.name == 'nt' else rel
+
+    def _sync(self):
+        """With several workers, drop cached ids after another worker deleted an image."""
+        if not shared_state.multi_worker():
+            return
+        generation = self.index.execute("SELECT value FROM image_ids_generation")[0][0]
+        if generation != self._generation:
+            self._ids = None
+            self._records = {}
+            self._generation = generation
+
+    def _load(self):
+        self._sync()
+        if self._ids is None:
+            self._ids = {path: image_id for image_id, path in self.index.execute("SELECT id, path FROM image_ids")}
+
+    def assign(self, image_paths):
+        """Ids of image paths (absolute or relative to the current directory), creating missing ones."""
+        keys = [self._key(p) for p in image_paths]
+        with self._lock:
+            self._load()
+            new = list(dict.fromkeys(k for k in keys if k not in self._ids))
+            if new:
+                self.index.executemany("INSERT OR IGNORE INTO image_ids (path) VALUES (?)", [(k,) for k in new])
+                for i in range(0, len(new), 500):
+                    part = new[i:i + 500]
+                    self._ids.update(self.index.execute(
+                        f"SELECT path, id FROM image_ids WHERE path IN ({','.join('?' * len(part))})", part
+                    ))
+            return [self._ids[k] for k in keys]
+
+    def get(self, image_id):
+        """The ImageRecord of an id, or None if the id is unknown."""
+        self._sync()
+        record = self._records.get(image_id)
+        if record is not None:
+            return record
+        rows = self.index.execute("SELECT path, width, height FROM image_ids WHERE id = ?", (int(image_id),))
+        if not rows:
+            return None
+        path, width, height = rows[0]
+        record = ImageRecord(image_id, os.path.join(self.dataset_path, *path.split("/")), width, height)
+        self._records[image_id] = record
+        return record
+
+    def image_size(self, record, caller):
+        """(width, height) of a record's image, stored in the index and reread when the file changes."""
+        size, mtime = dataset_index.file_signature(record.path)
+        if record.signature == (size, mtime):
+            return record.width, record.height
+        rows = self.index.execute("SELECT width, height FROM image_ids WHERE id = ? AND size = ? AND mtime = ?",
+                                  (record.id, size, mtime))
+        if rows and rows[0][0]:
+            record.width, record.height = rows[0]
+        else:
+            Image = subsystems.image_module()
+            metrics.IMAGE_OPENS.inc(caller)
+            with Image.open(record.path) as img:
+                record.width, record.height = img.size
+            self.index.execute("UPDATE image_ids SET width = ?, height = ?, size = ?, mtime = ? WHERE id = ?",
+                               (record.width, record.height, size, mtime, record.id))
+        record.signature = (size, mtime)
+        record.checked = True
+        return record.width, record.height
+
+    def forget(self, image_path):
+        """Drop a deleted image; its id is not reused."""
+        key = self._key(image_path)
+        with self._lock:
+            if self._ids is not None:
+                self._ids.pop(key, None)
+            rows = self.index.execute("SELECT id FROM image_ids WHERE path = ?", (key,))
+            for (image_id,) in rows:
+                self._records.pop(image_id, None)
+            self.index.execute("DELETE FROM image_ids WHERE path = ?", (key,))
+            self.index.execute("UPDATE image_ids_generation SET value = value + 1")
+
+
+def get_registry(dataset_path):
+    """The dataset's registry, cached per dataset."""
+    key = os.path.normcase(os.path.abspath(dataset_path))
+    registry = _registries.get(key)
+    if registry is not None:
+        return registry
+    with _registries_lock:
+        registry = _registries.get(key)
+        if registry is None:
+            registry = _registries[key] = ImageRegistry(dataset_path)
+    return registry
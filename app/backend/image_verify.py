@@ -0,0 +1,164 @@
+"""
+Corrupt image detection with cached results.
+
+Each image is checked with PIL's verify() (structure and checksums) and a
+full decode (catches truncated data that verify() accepts). Images are
+checked in chunks on a process pool, and every result is stored in the
+dataset index with the file's (size, mtime), so later passes only check new
+or modified files.
+
+Statuses:
+- ok
+- corrupt: not a recognized image, fails verify() or does not decode
+- unreadable: the file cannot be opened (permissions, vanished)
+
+Failures seen elsewhere (an export that cannot read an image) are recorded
+with mark_bad(), so exports and Vision LLM batches skip known-bad files
+instead of retrying them until the file changes.
+"""
+import os
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from backend import dataset_index, metrics
+except ImportError:
+    import dataset_index
+    import metrics
+
+CHUNK_SIZE = 256
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS image_verify (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    status TEXT NOT NULL,
+    error TEXT,
+    checked_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS image_verify_status ON image_verify(status);
+"""
+
+
+def _index(dataset_path):
+    index = dataset_index.get_index(dataset_path)
+    index.ensure_schema("image_verify", _SCHEMA)
+    return index
+
+
+def verify_image(path):
+    """(status, error message or None) of one image file."""
+    from PIL import Image
+    try:
+        f = open(path, 'rb')
+    except OSError as e:
+        return "unreadable", str(e)
+    try:
+        with f, warnings.catch_warnings():
+            # Decompression bomb warnings are not corruption
+            warnings.simplefilter("ignore")
+            with Image.open(f) as img:
+                img.verify()
+            # verify() leaves the image unusable: decode from a fresh handle
+            f.seek(0)
+            with Image.open(f) as img:
+                img.load()
+    except Exception as e:
+        return "corrupt", f"{type(e).__name__}: {e}"
+    return "ok", None
+
+
+def _verify_chunk(paths):
+    return [verify_image(path) for path in paths]
+
+
+def verify_images(dataset_path, image_paths, workers=None, recheck=False, progress=None):
+    """
+    Check image_paths, reusing cached results of unchanged files unless
+    recheck. Returns ({absolute path: (status, error)}, number of files
+    checked now).
+    progress(done, total) is called as chunks complete.
+    """
+    index = _index(dataset_path)
+    cached = {path: (size, mtime, status, error) for path, size, mtime, status, error in
+              index.execute("SELECT path, size, mtime, status, error FROM image_verify")}
+    results = {}
+    todo = []
+    signatures = {}
+    for path in map(os.path.abspath, image_paths):
+        try:
+            signature = dataset_index.file_signature(path)
+        except OSError as e:
+            results[path] = ("unreadable", str(e))
+            continue
+        entry = cached.get(path)
+        if not recheck and entry is not None and entry[:2] == signature:
+            results[path] = entry[2:]
+        else:
+            signatures[path] = signature
+            todo.append(path)
+    metrics.cache_lookup("image_verify", not todo)
+
+    total = len(todo)
+    if todo:
+        chunks = [todo[i:i + CHUNK_SIZE] for i in range(0, total, CHUNK_SIZE)]
+        workers = workers or os.cpu_count() or 1
+        done = 0
+        pool = ProcessPoolExecutor(max_workers=min(workers, len(chunks))) if workers > 1 and len(chunks) > 1 else None
+        try:
+            chunk_results = pool.map(_verify_chunk, chunks) if pool else map(_verify_chunk, chunks)
+            for chunk, statuses in zip(chunks, chunk_results):
+                results.update(zip(chunk, statuses))
+                done += len(chunk)
+                if progress:
+                    progress(done, total)
+        finally:
+            if pool:
+                pool.shutdown()
+        metrics.IMAGE_OPENS.inc("verify", amount=total)
+        now = time.time()
+        index.executemany(
+            "INSERT OR REPLACE INTO image_verify (path, size, mtime, status, error, checked_at) VALUES (?, ?, ?, ?, ?, ?)",
+            [(path, *signatures[path], *results[path], now) for path in todo],
+        )
+    return results, total
+
+
+def mark_bad(dataset_path, path, error, status="corrupt"):
+    """Record an image that failed to open outside a verification pass."""
+    path = os.path.abspath(path)
+    try:
+        signature = dataset_index.file_signature(path)
+    except OSError:
+        return
+    _index(dataset_path).execute(
+        "INSERT OR REPLACE INTO image_verify (path, size, mtime, status, error, checked_at) VALUES (?, ?, ?, ?, ?, ?)",
+        (path, *signature, status, error, time.time()),
+    )
+
+
+def known_bad(dataset_path):
+    """
+    {absolute path: (status, error)} of the images recorded as corrupt or
+    unreadable that have not changed since. Only the bad files are stat'ed.
+    """
+    index = _index(dataset_path)
+    bad = {}
+    gone = []
+    for path, size, mtime, status, error in index.execute(
+            "SELECT path, size, mtime, status, error FROM image_verify WHERE status != 'ok'"):
+        try:
+            if dataset_index.file_signature(path) != (size, mtime):
+                continue
+        except FileNotFoundError:
+            gone.append((path,))
+            continue
+        except OSError:
+            # Still unreadable
+            pass
+        bad[path] = (status, error)
+    if gone:
+        index.executemany("DELETE FROM image_verify WHERE path = ?", gone)
+    return bad
@@ -0,0 +1,134 @@
+"""
+Per-dataset index of the classes used by each label file.
+
+For every <stem>.txt in the labels folder the dataset index keeps the box
+count per class, keyed by (size, mtime), plus a (class_id, path) table so
+"images containing class N" or "annotated images" are answered with one
+indexed query. Refreshing only stats the label files and re-reads the
+ones that changed, so filters never open images or parse labels that do
+not match.
+"""
+import os
+
+try:
+    from backend import dataset_index
+except ImportError:
+    import dataset_index
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS label_class_counts (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    classes TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS label_class_members (
+    class_id INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (class_id, path)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS label_class_members_path ON label_class_members(path);
+"""
+
+
+def _index(dataset_path):
+    index = dataset_index.get_index(dataset_path)
+    index.ensure_schema("label_index", _SCHEMA)
+    return index
+
+
+def encode_counts(counts):
+    return " ".join(f"{class_id}:{count}" for class_id, count in sorted(counts.items()))
+
+
+def decode_counts(text):
+    counts = {}
+    for item in text.split():
+        class_id, count = item.split(":")
+        counts[int(class_id)] = int(count)
+    return counts
+
+
+def count_classes(label_file):
+    """{class_id: box count} of one label file (malformed lines skipped)."""
+    counts = {}
+    try:
+        with open(label_file, 'r', encoding='utf-8') as f:
+            lines = f.readlines()
+    except UnicodeDecodeError:
+        with open(label_file, 'r', encoding='latin-1') as f:
+            lines = f.readlines()
+    for line in lines:
+        parts = line.split()
+        if len(parts) < 5:
+            continue
+        try:
+            class_id = int(parts[0])
+        except ValueError:
+            continue
+        counts[class_id] = counts.get(class_id, 0) + 1
+    return counts
+
+
+def refresh(dataset_path, labels_dir):
+    """Bring the index up to date with labels_dir. Returns the number of re-read files."""
+    index = _index(dataset_path)
+    cached = {path: (size, mtime)
+              for path, size, mtime in index.execute("SELECT path, size, mtime FROM label_class_counts")}
+    seen = set()
+    changed = []
+    if os.path.isdir(labels_dir):
+        for entry in os.scandir(labels_dir):
+            if not entry.name.endswith(".txt") or entry.name == "classes.txt" or not entry.is_file():
+                continue
+            st = entry.stat()
+            seen.add(entry.path)
+            if cached.get(entry.path) != (st.st_size, st.st_mtime):
+                changed.append((entry.path, st.st_size, st.st_mtime))
+    removed = [path for path in cached if path not in seen]
+    if not changed and not removed:
+        return 0
+
+    rows = []
+    member_rows = []
+    for path, size, mtime in changed:
+        try:
+            counts = count_classes(path)
+        except OSError:
+            continue
+        rows.append((path, size, mtime, encode_counts(counts)))
+        member_rows.extend((class_id, path, count) for class_id, count in counts.items())
+
+    with index.lock:
+        cur = index.conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            stale = [(path,) for path in removed] + [(path,) for path, _, _ in changed]
+            cur.executemany("DELETE FROM label_class_counts WHERE path = ?", stale)
+            cur.executemany("DELETE FROM label_class_members WHERE path = ?", stale)
+            cur.executemany("INSERT INTO label_class_counts (path, size, mtime, classes) VALUES (?, ?, ?, ?)", rows)
+            cur.executemany("INSERT INTO label_class_members (class_id, path, count) VALUES (?, ?, ?)", member_rows)
+            cur.execute("COMMIT")
+        except Exception:
+            cur.execute("ROLLBACK")
+            raise
+    return len(rows)
+
+
+def histograms(dataset_path):
+    """{label path: {class_id: count}} for every indexed label file."""
+    return {path: decode_counts(classes)
+            for path, classes in _index(dataset_path).execute("SELECT path, classes FROM label_class_counts")}
+
+
+def label_files_with_class(dataset_path, class_id):
+    rows = _index(dataset_path).execute(
+        "SELECT path FROM label_class_members WHERE class_id = ?", (int(class_id),)
+    )
+    return {row[0] for row in rows}
+
+
+def annotated_label_files(dataset_path):
+    rows = _index(dataset_path).execute("SELECT path FROM label_class_counts WHERE classes != ''")
+    return {row[0] for row in rows}
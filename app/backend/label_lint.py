@@ -0,0 +1,321 @@
+"""
+Lint engine for YOLO label files.
+
+Every line of every label file is checked, and problems are reported as
+structured diagnostics instead of being skipped with a print:
+
+- encoding: the file is not valid UTF-8 (read as latin-1), has a BOM or NUL bytes
+- malformed: fewer than 5 fields, non-numeric or non-finite values, non-integer class
+- extra_fields: more than 6 fields (class, box, confidence)
+- bad_confidence: confidence that is not a number in [0, 1]
+- unknown_class: class id without a name in classes.txt
+- out_of_range: center or size outside [0, 1], or box edges outside the image
+- zero_area: width or height <= 0
+- duplicate_line: same class and box as an earlier line
+
+Files are linted in chunks on a process pool. Results are cached in the
+dataset index by (size, mtime) of each file and the class list, so a re-run
+only reads the files that changed. fix_file() rewrites a file atomically
+(temporary file + rename) with the fixable problems repaired.
+"""
+import json
+import math
+import os
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from backend import dataset_index, annotation_patch, metrics
+except ImportError:
+    import dataset_index
+    import annotation_patch
+    import metrics
+
+# Bump when the rules change so cached results are recomputed
+RULES_VERSION = 1
+CHUNK_SIZE = 2000
+EDGE_TOLERANCE = 1e-3
+
+SEVERITY = {
+    "encoding": "warning",
+    "malformed": "error",
+    "extra_fields": "warning",
+    "bad_confidence": "warning",
+    "unknown_class": "error",
+    "out_of_range": "error",
+    "zero_area": "error",
+    "duplicate_line": "warning",
+}
+
+# Repairs: malformed, zero-area and duplicate lines are dropped, out-of-range
+# boxes clipped to the image, extra fields and bad confidences removed,
+# files re-encoded as UTF-8. Dropping unknown classes must be asked for.
+FIXABLE = set(SEVERITY)
+DEFAULT_FIX = FIXABLE - {"unknown_class"}
+DROP_CODES = {"malformed", "zero_area", "out_of_range"}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS label_lint (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    context TEXT NOT NULL,
+    diagnostics TEXT NOT NULL
+);
+"""
+
+
+def _diagnostic(code, line, message):
+    return {"code": code, "severity": SEVERITY[code], "line": line, "message": message}
+
+
+def decode_label(content):
+    """(text, encoding diagnostics) of raw label file bytes."""
+    diagnostics = []
+    if content.startswith(b"\xef\xbb\xbf"):
+        content = content[3:]
+        diagnostics.append(_diagnostic("encoding", None, "UTF-8 byte order mark"))
+    if b"\x00" in content:
+        content = content.replace(b"\x00", b"")
+        diagnostics.append(_diagnostic("encoding", None, "NUL bytes"))
+    try:
+        text = content.decode("utf-8")
+    except UnicodeDecodeError as e:
+        text = content.decode("latin-1")
+        diagnostics.append(_diagnostic("encoding", None, f"Not valid UTF-8 (byte {e.start}), read as latin-1"))
+    return text, diagnostics
+
+
+def check_line(parts, class_ids):
+    """
+    Diagnostic codes and messages of one split line, and the fixed fields
+    (None when the line has to be dropped). class_ids is None when the
+    dataset has no class list.
+    """
+    problems = []
+    if len(parts) < 5:
+        return [("malformed", f"Expected at least 5 fields, got {len(parts)}")], None
+    try:
+        class_id = int(parts[0])
+        x, y, w, h = (float(v) for v in parts[1:5])
+    except ValueError:
+        return [("malformed", "Non-numeric class id or coordinate")], None
+    if not all(math.isfinite(v) for v in (x, y, w, h)):
+        return [("malformed", "Non-finite coordinate")], None
+
+    confidence = None
+    if len(parts) > 6:
+        problems.append(("extra_fields", f"{len(parts)} fields, at most 6 expected"))
+    if len(parts) > 5:
+        try:
+            confidence = float(parts[5])
+        except ValueError:
+            confidence = None
+        if confidence is None or not 0.0 <= confidence <= 1.0:
+            problems.append(("bad_confidence", f"Confidence {parts[5]!r} is not a number in [0, 1]"))
+            confidence = None
+
+    keep = True
+    if class_id < 0 or (class_ids is not None and class_id not in class_ids):
+        problems.append(("unknown_class", f"Class id {class_id} is not in classes.txt"))
+    if w <= 0 or h <= 0:
+        problems.append(("zero_area", f"Box size {w:g} x {h:g}"))
+        keep = False
+    else:
+        x1, y1, x2, y2 = x - w / 2, y - h / 2, x + w / 2, y + h / 2
+        if not all(0.0 <= v <= 1.0 for v in (x, y, w, h)) or min(x1, y1) < -EDGE_TOLERANCE \
+                or max(x2, y2) > 1 + EDGE_TOLERANCE:
+            problems.append(("out_of_range", f"Box ({x:g}, {y:g}, {w:g}, {h:g}) is outside [0, 1]"))
+            x1, y1, x2, y2 = max(0.0, x1), max(0.0, y1), min(1.0, x2), min(1.0, y2)
+            if x2 - x1 <= 0 or y2 - y1 <= 0:
+                keep = False
+            x, y, w, h = (x1 + x2) / 2, (y1 + y2) / 2, x2 - x1, y2 - y1
+    return problems, (class_id, x, y, w, h, confidence) if keep else None
+
+
+def lint_text(text, class_ids):
+    """
+    Diagnostics of a label file's text and its lines with the fixable problems
+    repaired, as a list of (original line, fixed line or None, codes).
+    """
+    diagnostics = []
+    lines = []
+    seen = {}
+    for number, line in enumerate(text.splitlines(), 1):
+        parts = line.split()
+        if not parts:
+            lines.append((line, None, {"blank"}))
+            continue
+        problems, fields = check_line(parts, class_ids)
+        codes = {code for code, _ in problems}
+        for code, message in problems:
+            diagnostics.append(_diagnostic(code, number, message))
+        fixed = None
+        if fields is not None:
+            key = fields[:5]
+            if key in seen:
+                diagnostics.append(_diagnostic("duplicate_line", number, f"Same box as line {seen[key]}"))
+                codes.add("duplicate_line")
+            else:
+                seen[key] = number
+            if codes & {"out_of_range", "extra_fields", "bad_confidence"}:
+                class_id, x, y, w, h, confidence = fields
+                fixed = f"{class_id} {x:.6f} {y:.6f} {w:.6f} {h:.6f}"
+                if confidence is not None:
+                    fixed += f" {parts[5]}"
+            else:
+                fixed = line.strip()
+        lines.append((line, fixed, codes))
+    return diagnostics, lines
+
+
+def lint_file(path, class_ids):
+    """Diagnostics of one label file."""
+    try:
+        with open(path, 'rb') as f:
+            content = f.read()
+    except OSError as e:
+        return [_diagnostic("encoding", None, f"Unreadable: {e}")]
+    text, diagnostics = decode_label(content)
+    line_diagnostics, _ = lint_text(text, class_ids)
+    return diagnostics + line_diagnostics
+
+
+def _lint_chunk(args):
+    paths, class_ids = args
+    return [lint_file(path, class_ids) for path in paths]
+
+
+def load_class_ids(dataset_path):
+    """Ids with a name in classes.txt, or None without a class list."""
+    classes_file = os.path.join(dataset_path, "classes.txt")
+    if not os.path.exists(classes_file):
+        return None
+    with open(classes_file, 'r', encoding='utf-8', errors='replace') as f:
+        return {i for i, line in enumerate(f.read().splitlines()) if line.strip()}
+
+
+def _context(class_ids):
+    ids = "none" if class_ids is None else ",".join(map(str, sorted(class_ids)))
+    return f"{RULES_VERSION}:{zlib.crc32(ids.encode('ascii')):08x}"
+
+
+def label_files(labels_dir):
+    if not os.path.isdir(labels_dir):
+        return []
+    return sorted(entry.path for entry in os.scandir(labels_dir)
+                  if entry.name.endswith(".txt") and entry.name != "classes.txt" and entry.is_file())
+
+
+def lint_dataset(dataset_path, labels_dir, workers=None, paths=None):
+    """
+    {label path: diagnostics} for every label file of labels_dir (or only
+    paths), reusing cached results of unchanged files. Returns
+    (results, number of files re-linted).
+    """
+    index = dataset_index.get_index(dataset_path)
+    index.ensure_schema("label_lint", _SCHEMA)
+    class_ids = load_class_ids(dataset_path)
+    context = _context(class_ids)
+    cached = {path: (size, mtime, ctx, diagnostics) for path, size, mtime, ctx, diagnostics in
+              index.execute("SELECT path, size, mtime, context, diagnostics FROM label_lint")}
+
+    files = label_files(labels_dir) if paths is None else list(paths)
+    results = {}
+    todo = []
+    signatures = {}
+    for path in files:
+        try:
+            signature = dataset_index.file_signature(path)
+        except OSError:
+            continue
+        entry = cached.get(path)
+        if entry is not None and entry[:3] == (*signature, context):
+            results[path] = json.loads(entry[3])
+        else:
+            signatures[path] = signature
+            todo.append(path)
+    metrics.cache_lookup("label_lint", not todo)
+
+    if todo:
+        chunks = [(todo[i:i + CHUNK_SIZE], class_ids) for i in range(0, len(todo), CHUNK_SIZE)]
+        workers = workers or os.cpu_count() or 1
+        if len(chunks) <= 1 or workers <= 1:
+            for (chunk_paths, _), diagnostics in zip(chunks, map(_lint_chunk, chunks)):
+                results.update(zip(chunk_paths, diagnostics))
+        else:
+            with ProcessPoolExecutor(max_workers=min(workers, len(chunks))) as pool:
+                for (chunk_paths, _), diagnostics in zip(chunks, pool.map(_lint_chunk, chunks)):
+                    results.update(zip(chunk_paths, diagnostics))
+        metrics.LABEL_PARSES.inc(amount=len(todo))
+        index.executemany(
+            "INSERT OR REPLACE INTO label_lint (path, size, mtime, context, diagnostics) VALUES (?, ?, ?, ?, ?)",
+            [(path, *signatures[path], context, json.dumps(results[path])) for path in todo],
+        )
+    if paths is None:
+        stale = [(path,) for path in cached if path not in results]
+        if stale:
+            index.executemany("DELETE FROM label_lint WHERE path = ?", stale)
+    return results, len(todo)
+
+
+def atomic_write_lines(label_file, lines):
+    """Write label lines through a temporary file renamed over the original."""
+    content = "".join(line + "\n" for line in lines)
+    tmp_path = f"{label_file}.{os.getpid()}.lint"
+    with open(tmp_path, 'w', encoding='utf-8', newline='\n') as f:
+        f.write(content)
+    os.replace(tmp_path, label_file)
+    metrics.BYTES_WRITTEN.inc("labels", amount=len(content))
+
+
+def fix_file(label_file, class_ids, codes=None, on_change=None):
+    """
+    Repair the problems of one label file whose code is in codes (default
+    DEFAULT_FIX), under the label lock. on_change(old_lines, new_lines) runs
+    before the lock is released (used to record the edit history). Returns
+    (old lines, new lines, fixed diagnostics) or None when nothing was changed.
+    """
+    codes = DEFAULT_FIX if codes is None else set(codes) & FIXABLE
+    with annotation_patch.label_lock(label_file):
+        with open(label_file, 'rb') as f:
+            content = f.read()
+        text, file_diagnostics = decode_label(content)
+        line_diagnostics, lines = lint_text(text, class_ids)
+        old_lines = text.splitlines()
+        new_lines = []
+        changed = "encoding" in codes and bool(file_diagnostics)
+        for original, fixed, line_codes in lines:
+            if "blank" in line_codes:
+                continue
+            selected = line_codes & codes
+            if not selected:
+                new_lines.append(original)
+                continue
+            changed = True
+            if fixed is None:
+                # Malformed, zero-area or clipped away: dropped unless its problem was not selected
+                if selected & DROP_CODES:
+                    continue
+                new_lines.append(original)
+            elif selected & {"unknown_class", "duplicate_line"}:
+                continue
+            else:
+                new_lines.append(fixed)
+        if not changed:
+            return None
+        atomic_write_lines(label_file, new_lines)
+        if on_change:
+            on_change(old_lines, new_lines)
+    fixed_diagnostics = [d for d in file_diagnostics + line_diagnostics if d["code"] in codes]
+    return old_lines, new_lines, fixed_diagnostics
+
+
+def summarize(results):
+    """{code: count} and {severity: count} over lint results."""
+    codes, severities = {}, {}
+    for diagnostics in results.values():
+        for d in diagnostics:
+            codes[d["code"]] = codes.get(d["code"], 0) + 1
+            severities[d["severity"]] = severities.get(d["severity"], 0) + 1
+    return codes, severities
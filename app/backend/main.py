@@ -1,18 +1,21 @@
 from fastapi import FastAPI, HTTPException, Body, UploadFile, File, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import PlainTextResponse, FileResponse
 import os
-import glob
+import bisect
 import json
-import yaml
 import sys
 import io
+import threading
+import time
+from contextlib import asynccontextmanager
 from typing import List
 from pydantic import BaseModel
-from PIL import Image
 
-# Handle imports for both module and direct execution
-import io
+# Heavy subsystems (PIL, yaml, exporter, Vision LLM) are imported lazily
+# through backend.subsystems so the server starts answering immediately.
 
 # Fix encoding for Windows console (cp1252 doesn't support Unicode)
 # Force UTF-8 encoding for stdout/stderr
@@ -32,13 +35,26 @@ if _backend_dir not in sys.path:
     sys.path.insert(0, _backend_dir)
 
 try:
-    from backend.models import DatasetPath, AnnotationData, ClassUpdate, MergeDatasetsRequest, ExportProjectRequest, ImportProjectRequest
+    from backend.models import DatasetPath, AnnotationData, ClassUpdate, ClassOperationRequest, SplitDatasetRequest, MergeDatasetsRequest, ExportProjectRequest, ImportProjectRequest, AnnotationStoreRequest, NearDuplicatesRequest, BoxAuditRequest, AnnotationPatch, HistoryRequest, SearchRequest, SearchMetadataRequest, NextImageRequest, LintRequest, VerifyImagesRequest
     from backend.yolo_handler import parse_yolo_file, save_yolo_file
+    from backend import subsystems, metrics, profiling, annotation_store, annotation_patch, edit_history, search_index, responses, image_ids, dataset_session, shared_state, image_verify
 except ImportError:
     # If running as script directly (packaged mode), use direct imports
     try:
-        from models import DatasetPath, AnnotationData, ClassUpdate, MergeDatasetsRequest, ExportProjectRequest, ImportProjectRequest
+        from models import DatasetPath, AnnotationData, ClassUpdate, ClassOperationRequest, SplitDatasetRequest, MergeDatasetsRequest, ExportProjectRequest, ImportProjectRequest, AnnotationStoreRequest, NearDuplicatesRequest, BoxAuditRequest, AnnotationPatch, HistoryRequest, SearchRequest, SearchMetadataRequest, NextImageRequest, LintRequest, VerifyImagesRequest
         from yolo_handler import parse_yolo_file, save_yolo_file
+        import subsystems
+        import metrics
+        import profiling
+        import annotation_store
+        import annotation_patch
+        import edit_history
+        import search_index
+        import responses
+        import image_ids
+        import dataset_session
+        import shared_state
+        import image_verify
     except ImportError as e:
         print(f"[ERROR] Import error: {e}")
         print(f"   Current directory: {os.getcwd()}")
@@ -47,7 +63,13 @@ except ImportError:
         print(f"   Python path: {sys.path}")
         raise
 
-app = FastAPI(title="Lama Worlds Annotation Studio Backend")
+@asynccontextmanager
+async def lifespan(app):
+    # Preload common subsystems in the background once the server is listening
+    subsystems.warm_up()
+    yield
+
+app = FastAPI(title="Lama Worlds Annotation Studio Backend", lifespan=lifespan)
 
 # CORS for React
 app.add_middleware(
@@ -58,20 +80,66 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compress large responses (dataset listings) for clients sending Accept-Encoding: gzip
+app.add_middleware(GZipMiddleware, minimum_size=4096, compresslevel=5)
+
+# Per-route latency and in-flight counts, served by /metrics
+app.add_middleware(metrics.TimingMiddleware, routes=lambda: app.routes)
+
+# Opt-in request profiling (LAMA_PROFILE=header|all); not installed when off
+if profiling.profile_mode() != "off":
+    app.add_middleware(profiling.ProfilingMiddleware, mode=profiling.profile_mode())
+
 @app.get("/")
 def read_root():
     return {
         "status": "ok", 
         "app": "Lama Worlds Annotation Studio",
         "version": "1.0.0",
-        "python_version": __import__('sys').version
+        "python_version": sys.version,
+        "workers": shared_state.worker_count(),
+        "pid": os.getpid(),
+        **subsystems.status()
     }
 
+@app.get("/metrics")
+def metrics_endpoint():
+    """Prometheus text exposition of request and hot-path metrics"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/profiles")
+def list_profiles(limit: int = Query(50, ge=1, le=500)):
+    """List recent request profiles (newest first)"""
+    return {
+        "mode": profiling.profile_mode(),
+        "directory": profiling.profile_dir(),
+        "profiles": profiling.list_profiles(limit)
+    }
+
+@app.get("/profiles/{filename}")
+def get_profile(filename: str):
+    """Download a speedscope profile written by the profiling middleware"""
+    path = profiling.profile_path(filename)
+    if not path:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, media_type="application/json", filename=filename)
+
+def scan_dataset_images(path):
+    """
+    List every image of a dataset, sorted and de-duplicated.
+    Returns (image_list, images_dir, labels_dir); the list is cached in the
+    dataset session and must not be modified.
+    """
+    session = dataset_session.get_session(path)
+    return session.image_list(), session.images_dir, session.labels_dir
+
 @app.post("/load_dataset")
-def load_dataset(data: DatasetPath, page: int = Query(0, ge=0), page_size: int = Query(999999, ge=1)):
+def load_dataset(data: DatasetPath, page: int = Query(0, ge=0), page_size: int = Query(999999, ge=1),
+                 compact: bool = Query(False)):
     """
     Load dataset with pagination support for large datasets.
-    Returns total count and a page of images.
+    Returns total count and a page of images. With compact, image paths are
+    relative to base_dir (the images folder).
     """
     path = data.path
     if not path or not isinstance(path, str):
@@ -79,99 +147,66 @@ def load_dataset(data: DatasetPath, page: int = Query(0, ge=0), page_size: int =
     if not os.path.isdir(path):
         raise HTTPException(status_code=400, detail="Directory not found")
     
-    # Check structure
-    images_dir = os.path.join(path, "images")
-    labels_dir = os.path.join(path, "labels")
-    
-    if not os.path.exists(images_dir):
-        # Allow loading flat root if no subdirs
-        images_dir = path
-        labels_dir = path
-    
-    # Use recursive glob for better performance on large directories
-    # List images - use case-insensitive search to avoid duplicates
-    exts = ['*.jpg', '*.jpeg', '*.png', '*.bmp', '*.JPG', '*.JPEG', '*.PNG', '*.BMP']
-    images = set()  # Use set to automatically remove duplicates
-    
-    # Use recursive glob if available (Python 3.5+)
-    import glob
-    try:
-        # Try recursive pattern first (faster for large directories)
-        for ext in exts:
-            pattern = os.path.join(images_dir, '**', ext)
-            found = glob.glob(pattern, recursive=True)
-            images.update(found)
-    except:
-        # Fallback to non-recursive
-        for ext in exts:
-            found = glob.glob(os.path.join(images_dir, ext))
-            images.update(found)
-    
-    # Convert to absolute paths and remove duplicates (case-insensitive on Windows)
-    image_list = []
-    seen_paths = set()
-    for img in images:
-        abs_path = os.path.abspath(img)
-        # Normalize path for comparison (lowercase on Windows)
-        normalized = abs_path.lower() if os.name == 'nt' else abs_path
-        if normalized not in seen_paths:
-            seen_paths.add(normalized)
-            image_list.append(abs_path)
-    
-    image_list.sort()  # Sort for consistent ordering
+    image_list, images_dir, labels_dir = scan_dataset_images(path)
     
     # Pagination
     total_count = len(image_list)
     start_idx = page * page_size
     end_idx = start_idx + page_size
     paginated_images = image_list[start_idx:end_idx]
+    ids = dataset_session.get_session(path).registry.assign(paginated_images)
     
-    return {
-        "images": paginated_images,
-        "total_count": total_count,
-        "page": page,
-        "page_size": page_size,
-        "has_more": end_idx < total_count,
-        "images_dir": images_dir,
-        "labels_dir": labels_dir
-    }
+    return responses.listing(
+        "images", paginated_images, images_dir, compact,
+        ids=ids,
+        total_count=total_count,
+        page=page,
+        page_size=page_size,
+        has_more=end_idx < total_count,
+        images_dir=images_dir,
+        labels_dir=labels_dir
+    )
 
 @app.post("/load_annotation")
-def load_annotation(dataset_path: str = Body(...), image_path: str = Body(...)):
+def load_annotation(dataset_path: str = Body(...), image_path: str = Body(None), image_id: int = Body(None)):
     try:
         # Validate inputs
         if not dataset_path or not isinstance(dataset_path, str):
             raise HTTPException(status_code=400, detail="Invalid dataset_path")
-        if not image_path or not isinstance(image_path, str):
-            raise HTTPException(status_code=400, detail="Invalid image_path")
-        
-        # derive label path
-        if os.path.isabs(image_path):
-            image_full_path = image_path
+        if image_id is not None:
+            image_full_path, base_name, label_file, record = _resolve_image(dataset_path, image_id=image_id)
         else:
-            image_full_path = os.path.join(dataset_path, "images", image_path)
-        
-        # Verify image exists
-        if not os.path.exists(image_full_path):
-            raise HTTPException(status_code=404, detail=f"Image not found: {image_full_path}")
-        
-        # Validate it's actually a file
-        if not os.path.isfile(image_full_path):
-            raise HTTPException(status_code=400, detail=f"Path is not a file: {image_full_path}")
+            if not image_path or not isinstance(image_path, str):
+                raise HTTPException(status_code=400, detail="Invalid image_path")
             
-        base_name = os.path.splitext(os.path.basename(image_full_path))[0]
-        if not base_name:
-            raise HTTPException(status_code=400, detail="Invalid image filename")
-        
-        # Try logic to find label dir
-        if os.path.basename(os.path.dirname(image_full_path)) == "images":
-            label_dir = os.path.join(os.path.dirname(os.path.dirname(image_full_path)), "labels")
-        else:
-            label_dir = os.path.dirname(image_full_path)
+            # derive label path
+            if os.path.isabs(image_path):
+                image_full_path = image_path
+            else:
+                image_full_path = os.path.join(dataset_path, "images", image_path)
             
-        label_file = os.path.join(label_dir, base_name + ".txt")
-        
-        boxes = parse_yolo_file(label_file)
+            # Verify image exists
+            if not os.path.exists(image_full_path):
+                raise HTTPException(status_code=404, detail=f"Image not found: {image_full_path}")
+            
+            # Validate it's actually a file
+            if not os.path.isfile(image_full_path):
+                raise HTTPException(status_code=400, detail=f"Path is not a file: {image_full_path}")
+            
+            base_name, label_file = image_ids.label_location(image_full_path)
+            if not base_name:
+                raise HTTPException(status_code=400, detail="Invalid image filename")
+            record = None
+        
+        # Datasets imported into the single-file store no longer read .txt files
+        store = annotation_store.get_store(dataset_path)
+        with annotation_patch.label_lock(label_file):
+            if store:
+                boxes = store.read(base_name)
+                version = store.version(base_name)
+            else:
+                boxes = parse_yolo_file(label_file)
+                version = annotation_patch.file_version(label_file)
         
         # Validate boxes is a list
         if not isinstance(boxes, list):
@@ -179,14 +214,18 @@ def load_annotation(dataset_path: str = Body(...), image_path: str = Body(...)):
         
         # Convert normalized to pixel
         try:
-            with Image.open(image_full_path) as img:
-                img_w, img_h = img.size
+            try:
+                img_w, img_h = _image_size(dataset_path, record, image_full_path, "load_annotation")
+            except OSError as e:
+                image_verify.mark_bad(dataset_path, image_full_path, f"{type(e).__name__}: {e}")
+                raise HTTPException(status_code=422, detail=f"Image is corrupt or unreadable: {e}")
                 
             # Validate image dimensions
             if img_w <= 0 or img_h <= 0:
                 raise HTTPException(status_code=400, detail=f"Invalid image dimensions: {img_w}x{img_h}")
                 
             pixel_boxes = []
+            skipped = []
             for idx, box in enumerate(boxes):
                 # Validate box structure
                 if not isinstance(box, dict):
@@ -210,6 +249,7 @@ def load_annotation(dataset_path: str = Body(...), image_path: str = Body(...)):
                 
                 # Validate normalized values are in range [0, 1]
                 if not (0 <= x_norm <= 1 and 0 <= y_norm <= 1 and 0 <= w_norm <= 1 and 0 <= h_norm <= 1):
+                    skipped.append(f"{box['id']}: coordinates outside [0, 1] ({x_norm}, {y_norm}, {w_norm}, {h_norm})")
                     continue
                 
                 w = w_norm * img_w
@@ -233,8 +273,16 @@ def load_annotation(dataset_path: str = Body(...), image_path: str = Body(...)):
                     "height": h,
                     "confidence": box['confidence']
                 })
-            return {"boxes": pixel_boxes, "label_file": label_file}
+            response = {"boxes": pixel_boxes, "label_file": label_file, "version": version}
+            if record is not None:
+                response["image_id"] = record.id
+            if skipped:
+                # Boxes left out of the editor; /lint_labels can clip them
+                response["warnings"] = skipped
+            return response
             
+        except HTTPException:
+            raise
         except Exception as e:
             print(f"Error processing image {image_full_path}: {e}")
             raise HTTPException(status_code=500, detail=f"Error processing image: {str(e)}")
@@ -244,28 +292,36 @@ def load_annotation(dataset_path: str = Body(...), image_path: str = Body(...)):
         raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
 
 @app.post("/get_annotated_images")
-def get_annotated_images(dataset_path: str = Body(...), class_id: int = Body(None)):
-    """Return list of image paths that have annotation files, optionally filtered by class_id"""
+def get_annotated_images(dataset_path: str = Body(...), class_id: int = Body(None), compact: bool = Body(False)):
+    """
+    Return list of image paths that have annotation files, optionally filtered by class_id.
+    With compact, paths are relative to base_dir (the images folder).
+    """
     try:
-        annotated_images = []
-        
-        # Determine labels directory
-        labels_dir = os.path.join(dataset_path, "labels")
-        if not os.path.exists(labels_dir):
-            # Try flat structure
-            labels_dir = dataset_path
+        annotated_images = _annotated_image_paths(dataset_path, class_id)
+        images_dir = dataset_session.get_session(dataset_path).images_dir
         
+        return responses.listing("annotated_images", annotated_images, images_dir, compact,
+                                 count=len(annotated_images))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+def _annotated_image_paths(dataset_path, class_id=None):
+    """Absolute paths of the images with a non-empty label, optionally containing class_id."""
+    annotated_images = []
+    
+    # Labels directory (flat structure if there is none) and images directory
+    labels_dir = _labels_dir(dataset_path)
+    images_dir = dataset_session.get_session(dataset_path).images_dir
+    
+    store = annotation_store.get_store(dataset_path)
+    if store:
+        # The store answers "annotated (with class)" with one indexed query
+        base_names = store.annotated_stems(class_id)
+    else:
         # Find all .txt files in labels directory
-        label_files = glob.glob(os.path.join(labels_dir, "*.txt"))
-        
-        # Determine images directory
-        images_dir = os.path.join(dataset_path, "images")
-        if not os.path.exists(images_dir):
-            images_dir = dataset_path
-        
-        # Normalize dataset path for comparison
-        dataset_path_normalized = os.path.normpath(os.path.abspath(dataset_path))
-        
+        label_files = metrics.counted_glob(os.path.join(labels_dir, "*.txt"), "get_annotated_images")
+        base_names = []
         for label_file in label_files:
             # Check if file is not empty
             if os.path.getsize(label_file) > 0:
@@ -276,60 +332,189 @@ def get_annotated_images(dataset_path: str = Body(...), class_id: int = Body(Non
                     has_class = any(int(box.get('class_id', -1)) == int(class_id) for box in boxes)
                     if not has_class:
                         continue
-                
-                base_name = os.path.splitext(os.path.basename(label_file))[0]
-                
-                # Try to find corresponding image
-                for ext in ['.jpg', '.jpeg', '.png', '.bmp', '.JPG', '.JPEG', '.PNG', '.BMP']:
-                    image_path = os.path.join(images_dir, base_name + ext)
-                    if os.path.exists(image_path):
-                        # Return absolute path, normalized (same format as load_dataset)
-                        abs_path = os.path.abspath(image_path)
-                        # Normalize path for consistency (same as load_dataset)
-                        if os.name == 'nt':  # Windows
-                            abs_path = abs_path.replace('/', '\\')
-                        annotated_images.append(abs_path)
-                        break
-        
-        return {"annotated_images": annotated_images, "count": len(annotated_images)}
+                base_names.append(os.path.splitext(os.path.basename(label_file))[0])
+    
+    for base_name in base_names:
+        # Try to find corresponding image
+        for ext in dataset_session.IMAGE_SUFFIXES:
+            image_path = os.path.join(images_dir, base_name + ext)
+            if os.path.exists(image_path):
+                # Return absolute path, normalized (same format as load_dataset)
+                abs_path = os.path.abspath(image_path)
+                # Normalize path for consistency (same as load_dataset)
+                if os.name == 'nt':  # Windows
+                    abs_path = abs_path.replace('/', '\\')
+                annotated_images.append(abs_path)
+                break
+    
+    return annotated_images
+
+def _label_location(dataset_path, image_name):
+    """(image_full_path, base_name, label_file) for an image, as save_annotation resolves them."""
+    if os.path.isabs(image_name):
+        image_full_path = image_name
+    else:
+        # Try images subdirectory first, then flat structure
+        image_full_path = os.path.join(dataset_path, "images", image_name)
+        if not os.path.exists(image_full_path):
+            image_full_path = os.path.join(dataset_path, image_name)
+
+    # Verify image exists
+    if not os.path.exists(image_full_path):
+        raise HTTPException(status_code=404, detail=f"Image not found: {image_full_path}")
+
+    base_name, label_file = image_ids.label_location(image_full_path)
+    os.makedirs(os.path.dirname(label_file), exist_ok=True)
+    return image_full_path, base_name, label_file
+
+def _resolve_image(dataset_path, image_name=None, image_id=None):
+    """
+    (image_full_path, base_name, label_file, record) of an image addressed by
+    stable id or by name; record is the cached ImageRecord (None for names).
+    """
+    if image_id is None:
+        if not image_name:
+            raise HTTPException(status_code=400, detail="Image name or image id is required")
+        return (*_label_location(dataset_path, image_name), None)
+    record = image_ids.get_registry(dataset_path).get(image_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail=f"Unknown image id: {image_id}")
+    if not record.checked:
+        # Checked once per process; later calls by id do no filesystem discovery
+        if not os.path.isfile(record.path):
+            raise HTTPException(status_code=404, detail=f"Image not found: {record.path}")
+        os.makedirs(os.path.dirname(record.label_file), exist_ok=True)
+    return record.path, record.base_name, record.label_file, record
+
+def _image_size(dataset_path, record, image_full_path, caller):
+    if record is not None:
+        return image_ids.get_registry(dataset_path).image_size(record, caller)
+    return annotation_patch.image_size(image_full_path, caller)
+
+def _to_yolo_box(box, idx, img_w, img_h, validation_errors):
+    """Validate a pixel box from the frontend and convert it to normalized YOLO, or None if rejected."""
+    # Validate box object
+    if not hasattr(box, 'x') or not hasattr(box, 'y') or not hasattr(box, 'width') or not hasattr(box, 'height') or not hasattr(box, 'class_id'):
+        validation_errors.append(f"Box {idx}: Missing required fields")
+        return None
+    
+    # Validate types
+    try:
+        x_val = float(box.x) if box.x is not None else 0
+        y_val = float(box.y) if box.y is not None else 0
+        w_val = float(box.width) if box.width is not None else 0
+        h_val = float(box.height) if box.height is not None else 0
+        class_id_val = int(box.class_id) if box.class_id is not None else 0
+    except (ValueError, TypeError) as e:
+        validation_errors.append(f"Box {idx}: Invalid type for coordinates ({e})")
+        return None
+    
+    # Validate box dimensions
+    if w_val <= 0 or h_val <= 0:
+        validation_errors.append(f"Box {idx}: Invalid dimensions (width={w_val}, height={h_val})")
+        return None
+    
+    if x_val < 0 or y_val < 0:
+        validation_errors.append(f"Box {idx}: Negative position (x={x_val}, y={y_val})")
+    
+    # Clamp box to image bounds
+    x_left = max(0, min(x_val, img_w))
+    y_top = max(0, min(y_val, img_h))
+    width = max(0, min(w_val, img_w - x_left))
+    height = max(0, min(h_val, img_h - y_top))
+    
+    if width <= 0 or height <= 0:
+        validation_errors.append(f"Box {idx}: Box outside image bounds")
+        return None
+    
+    # Check minimum size (at least 5x5 pixels)
+    if width < 5 or height < 5:
+        validation_errors.append(f"Box {idx}: Too small (min 5x5 pixels required)")
+
+    # Calculate normalized values with division by zero protection
+    w_norm = width / img_w if img_w > 0 else 0
+    h_norm = height / img_h if img_h > 0 else 0
+    
+    x_center_pixel = x_left + (width / 2)
+    y_center_pixel = y_top + (height / 2)
+    
+    x_norm = x_center_pixel / img_w if img_w > 0 else 0
+    y_norm = y_center_pixel / img_h if img_h > 0 else 0
+    
+    # Clamp 0-1 and validate
+    w_norm = min(max(w_norm, 0), 1)
+    h_norm = min(max(h_norm, 0), 1)
+    x_norm = min(max(x_norm, 0), 1)
+    y_norm = min(max(y_norm, 0), 1)
+    
+    # Final validation of normalized values
+    if not (0 <= x_norm <= 1 and 0 <= y_norm <= 1 and 0 <= w_norm <= 1 and 0 <= h_norm <= 1):
+        validation_errors.append(f"Box {idx}: Normalized values out of range")
+        return None
+
+    # Preserve confidence if present in the box
+    confidence = 1.0
+    if hasattr(box, 'confidence') and box.confidence is not None:
+        confidence = float(box.confidence)
+        confidence = max(0.0, min(1.0, confidence))
+    elif isinstance(box, dict) and 'confidence' in box:
+        confidence = float(box.get('confidence', 1.0))
+        confidence = max(0.0, min(1.0, confidence))
+    
+    return {
+        "class_id": class_id_val,
+        "x": x_norm,
+        "y": y_norm,
+        "width": w_norm,
+        "height": h_norm,
+        "confidence": confidence
+    }
+
+def _read_label(store, base_name, label_file):
+    """(lines, version) of one label from the store or its .txt file."""
+    if store:
+        return store.read_lines(base_name), store.version(base_name)
+    return annotation_patch.read_lines(label_file), annotation_patch.file_version(label_file)
+
+def _history_key(dataset_path, store, base_name, label_file):
+    """Edit history key of a label: the store keys labels by stem, files by their path."""
+    return base_name if store else edit_history.label_key(dataset_path, label_file)
+
+def _write_label(store, dataset_path, base_name, label_file, old_lines, new_lines):
+    """Write label lines and record the change in the edit history. Returns the new version."""
+    if store:
+        store.write_lines(base_name, new_lines)
+    else:
+        annotation_patch.write_lines(label_file, new_lines)
+    try:
+        edit_history.record(dataset_path, _history_key(dataset_path, store, base_name, label_file),
+                            old_lines, new_lines)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        print(f"Warning: Could not record history for {base_name}: {e}")
+    search_index.mark_dirty(dataset_path, base_name)
+    return store.version(base_name) if store else annotation_patch.file_version(label_file)
+
+def _check_version(base_version, current_version):
+    if base_version is not None and base_version != current_version:
+        raise HTTPException(status_code=409, detail={
+            "message": "Annotation was modified since it was loaded",
+            "version": current_version
+        })
 
 @app.post("/save_annotation")
 def save_annotation_endpoint(data: AnnotationData):
     try:
-        if not data.image_name or not data.dataset_path:
-            raise HTTPException(status_code=400, detail="Image name and dataset path are required")
+        if not (data.image_name or data.image_id is not None) or not data.dataset_path:
+            raise HTTPException(status_code=400, detail="Image name (or id) and dataset path are required")
         
-        # Determine full path
-        if os.path.isabs(data.image_name):
-            image_full_path = data.image_name
-        else:
-            # Try images subdirectory first, then flat structure
-            image_full_path = os.path.join(data.dataset_path, "images", data.image_name)
-            if not os.path.exists(image_full_path):
-                image_full_path = os.path.join(data.dataset_path, data.image_name)
-
-        # Verify image exists
-        if not os.path.exists(image_full_path):
-            raise HTTPException(status_code=404, detail=f"Image not found: {image_full_path}")
-
-        base_name = os.path.splitext(os.path.basename(image_full_path))[0]
-        
-        # Label dir logic
-        if os.path.basename(os.path.dirname(image_full_path)) == "images":
-            label_dir = os.path.join(os.path.dirname(os.path.dirname(image_full_path)), "labels")
-        else:
-            label_dir = os.path.dirname(image_full_path)
-            
-        if not os.path.exists(label_dir):
-            os.makedirs(label_dir, exist_ok=True)
-            
-        label_file = os.path.join(label_dir, base_name + ".txt")
+        image_full_path, base_name, label_file, record = _resolve_image(data.dataset_path, data.image_name, data.image_id)
         
         try:
-            with Image.open(image_full_path) as img:
-                img_w, img_h = img.size
+            img_w, img_h = _image_size(data.dataset_path, record, image_full_path, "save_annotation")
+
+            # Validate image dimensions
+            if img_w <= 0 or img_h <= 0:
+                raise HTTPException(status_code=400, detail=f"Invalid image dimensions: {img_w}x{img_h}")
 
             # Convert pixels to normalized YOLO with validation
             yolo_boxes = []
@@ -340,95 +525,25 @@ def save_annotation_endpoint(data: AnnotationData):
                 raise HTTPException(status_code=400, detail="boxes must be a list")
             
             for idx, box in enumerate(data.boxes):
-                # Validate box object
-                if not hasattr(box, 'x') or not hasattr(box, 'y') or not hasattr(box, 'width') or not hasattr(box, 'height') or not hasattr(box, 'class_id'):
-                    validation_errors.append(f"Box {idx}: Missing required fields")
-                    continue
-                
-                # Validate types
-                try:
-                    x_val = float(box.x) if box.x is not None else 0
-                    y_val = float(box.y) if box.y is not None else 0
-                    w_val = float(box.width) if box.width is not None else 0
-                    h_val = float(box.height) if box.height is not None else 0
-                    class_id_val = int(box.class_id) if box.class_id is not None else 0
-                except (ValueError, TypeError) as e:
-                    validation_errors.append(f"Box {idx}: Invalid type for coordinates ({e})")
-                    continue
-                
-                # Validate box dimensions
-                if w_val <= 0 or h_val <= 0:
-                    validation_errors.append(f"Box {idx}: Invalid dimensions (width={w_val}, height={h_val})")
-                    continue
-                
-                if x_val < 0 or y_val < 0:
-                    validation_errors.append(f"Box {idx}: Negative position (x={x_val}, y={y_val})")
-                
-                # Validate image dimensions
-                if img_w <= 0 or img_h <= 0:
-                    raise HTTPException(status_code=400, detail=f"Invalid image dimensions: {img_w}x{img_h}")
-                
-                # Clamp box to image bounds
-                x_left = max(0, min(x_val, img_w))
-                y_top = max(0, min(y_val, img_h))
-                width = max(0, min(w_val, img_w - x_left))
-                height = max(0, min(h_val, img_h - y_top))
-                
-                if width <= 0 or height <= 0:
-                    validation_errors.append(f"Box {idx}: Box outside image bounds")
-                    continue
-                
-                # Check minimum size (at least 5x5 pixels)
-                if width < 5 or height < 5:
-                    validation_errors.append(f"Box {idx}: Too small (min 5x5 pixels required)")
-
-                # Calculate normalized values with division by zero protection
-                w_norm = width / img_w if img_w > 0 else 0
-                h_norm = height / img_h if img_h > 0 else 0
-                
-                x_center_pixel = x_left + (width / 2)
-                y_center_pixel = y_top + (height / 2)
-                
-                x_norm = x_center_pixel / img_w if img_w > 0 else 0
-                y_norm = y_center_pixel / img_h if img_h > 0 else 0
-                
-                # Clamp 0-1 and validate
-                w_norm = min(max(w_norm, 0), 1)
-                h_norm = min(max(h_norm, 0), 1)
-                x_norm = min(max(x_norm, 0), 1)
-                y_norm = min(max(y_norm, 0), 1)
-                
-                # Final validation of normalized values
-                if not (0 <= x_norm <= 1 and 0 <= y_norm <= 1 and 0 <= w_norm <= 1 and 0 <= h_norm <= 1):
-                    validation_errors.append(f"Box {idx}: Normalized values out of range")
-                    continue
-
-                # Preserve confidence if present in the box
-                confidence = 1.0
-                if hasattr(box, 'confidence') and box.confidence is not None:
-                    confidence = float(box.confidence)
-                    confidence = max(0.0, min(1.0, confidence))
-                elif isinstance(box, dict) and 'confidence' in box:
-                    confidence = float(box.get('confidence', 1.0))
-                    confidence = max(0.0, min(1.0, confidence))
-                
-                yolo_boxes.append({
-                    "class_id": class_id_val,
-                    "x": x_norm,
-                    "y": y_norm,
-                    "width": w_norm,
-                    "height": h_norm,
-                    "confidence": confidence
-                })
+                yolo_box = _to_yolo_box(box, idx, img_w, img_h, validation_errors)
+                if yolo_box:
+                    yolo_boxes.append(yolo_box)
             
-            save_yolo_file(label_file, yolo_boxes)
+            store = annotation_store.get_store(data.dataset_path)
+            with annotation_patch.label_lock(label_file):
+                old_lines, current_version = _read_label(store, base_name, label_file)
+                _check_version(data.base_version, current_version)
+                new_lines = [annotation_store.format_line(box) for box in yolo_boxes]
+                version = _write_label(store, data.dataset_path, base_name, label_file, old_lines, new_lines)
             
-            response = {"status": "saved", "file": label_file}
+            response = {"status": "saved", "file": store.path if store else label_file, "version": version}
             if validation_errors:
                 response["warnings"] = validation_errors
             
             return response
             
+        except HTTPException:
+            raise
         except Exception as e:
             print(f"Error saving {label_file}: {e}")
             raise HTTPException(status_code=500, detail=f"Error saving annotation: {str(e)}")
@@ -437,6 +552,106 @@ def save_annotation_endpoint(data: AnnotationData):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
 
+@app.post("/patch_annotation")
+def patch_annotation(data: AnnotationPatch):
+    """
+    Apply box-level add/update/delete operations to one image's labels.
+    
+    Only the addressed lines are converted and rewritten. Boxes keep their
+    "box_<n>" ids; ids that shift because of deletes (and the client ids of
+    added boxes) are returned in id_map together with the new version.
+    """
+    try:
+        if not (data.image_name or data.image_id is not None) or not data.dataset_path:
+            raise HTTPException(status_code=400, detail="Image name (or id) and dataset path are required")
+        
+        image_full_path, base_name, label_file, record = _resolve_image(data.dataset_path, data.image_name, data.image_id)
+        
+        validation_errors = []
+        ops = []
+        img_size = None
+        for idx, patch in enumerate(data.ops):
+            if patch.op not in ("add", "update", "delete"):
+                raise HTTPException(status_code=400, detail=f"Op {idx}: Unknown operation '{patch.op}'")
+            if patch.op == "delete":
+                ops.append(("delete", patch.id, None))
+                continue
+            if patch.box is None:
+                raise HTTPException(status_code=400, detail=f"Op {idx}: '{patch.op}' requires a box")
+            if img_size is None:
+                img_size = _image_size(data.dataset_path, record, image_full_path, "patch_annotation")
+                if img_size[0] <= 0 or img_size[1] <= 0:
+                    raise HTTPException(status_code=400, detail=f"Invalid image dimensions: {img_size[0]}x{img_size[1]}")
+            yolo_box = _to_yolo_box(patch.box, idx, img_size[0], img_size[1], validation_errors)
+            if yolo_box:
+                ops.append((patch.op, patch.id or patch.box.id, annotation_store.format_line(yolo_box)))
+        
+        store = annotation_store.get_store(data.dataset_path)
+        with annotation_patch.label_lock(label_file):
+            lines, version = _read_label(store, base_name, label_file)
+            _check_version(data.base_version, version)
+            
+            new_lines, id_map, op_errors = annotation_patch.apply_ops(lines, ops)
+            validation_errors.extend(op_errors)
+            
+            if new_lines != lines:
+                version = _write_label(store, data.dataset_path, base_name, label_file, lines, new_lines)
+        
+        response = {
+            "status": "saved",
+            "file": store.path if store else label_file,
+            "version": version,
+            "id_map": id_map,
+            "box_count": len(new_lines)
+        }
+        if validation_errors:
+            response["warnings"] = validation_errors
+        return response
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error patching annotation: {str(e)}")
+
+@app.post("/history/list")
+def list_history(data: HistoryRequest):
+    """Revisions of one image's labels, newest first."""
+    try:
+        image_full_path, base_name, label_file, _ = _resolve_image(data.dataset_path, data.image_name, data.image_id)
+        store = annotation_store.get_store(data.dataset_path)
+        key = _history_key(data.dataset_path, store, base_name, label_file)
+        return {
+            "image_name": data.image_name or os.path.basename(image_full_path),
+            "revisions": edit_history.list_revisions(data.dataset_path, key),
+            "max_revisions": edit_history.max_revisions()
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error listing history: {str(e)}")
+
+@app.post("/history/restore")
+def restore_history(data: HistoryRequest):
+    """Restore a past revision of one image's labels; the restore is itself a new revision."""
+    try:
+        if data.rev is None:
+            raise HTTPException(status_code=400, detail="rev is required")
+        _, base_name, label_file, _ = _resolve_image(data.dataset_path, data.image_name, data.image_id)
+        store = annotation_store.get_store(data.dataset_path)
+        with annotation_patch.label_lock(label_file):
+            lines, version = _read_label(store, base_name, label_file)
+            _check_version(data.base_version, version)
+            key = _history_key(data.dataset_path, store, base_name, label_file)
+            restored = edit_history.revision_lines(data.dataset_path, key, data.rev)
+            if restored is None:
+                raise HTTPException(status_code=404, detail=f"Revision {data.rev} not found")
+            if restored != lines:
+                version = _write_label(store, data.dataset_path, base_name, label_file, lines, restored)
+        return {"status": "restored", "rev": data.rev, "version": version, "box_count": len(restored)}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error restoring revision: {str(e)}")
+
 @app.post("/save_classes")
 def save_classes(data: ClassUpdate):
     try:
@@ -454,22 +669,69 @@ def save_classes(data: ClassUpdate):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error saving classes: {str(e)}")
 
+@app.post("/class_operation")
+def class_operation(data: ClassOperationRequest):
+    """
+    Rename, merge, delete or reorder classes and rewrite the class ids of
+    every label file that uses an affected class, under its label lock and
+    recorded in the edit history. With dry_run nothing is written and the
+    response reports what would change.
+    """
+    try:
+        if not os.path.isdir(data.dataset_path):
+            raise HTTPException(status_code=404, detail="Dataset path not found")
+        class_ops = subsystems.load("class_ops")
+        names = class_ops.read_class_names(data.dataset_path)
+        try:
+            new_names, mapping = class_ops.plan(names, data.operation, data.class_ids,
+                                                data.target_id, data.name, data.order)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        
+        def record_change(key, old_lines, new_lines):
+            # Every rewritten label gets a revision, so a class operation can be undone per image
+            try:
+                edit_history.record(data.dataset_path, key, old_lines, new_lines)
+            except Exception as e:
+                print(f"Warning: Could not record history for {key}: {e}")
+        
+        def record_file_change(label_file, old_lines, new_lines):
+            record_change(edit_history.label_key(data.dataset_path, label_file), old_lines, new_lines)
+        
+        start = time.perf_counter()
+        store = annotation_store.get_store(data.dataset_path)
+        if store:
+            totals = class_ops.remap_store(store, mapping, dry_run=data.dry_run, on_change=record_change)
+        else:
+            labels_dir = _labels_dir(data.dataset_path)
+            label_files = [
+                f for f in metrics.counted_glob(os.path.join(labels_dir, "*.txt"), "class_operation")
+                if os.path.basename(f) != "classes.txt"
+            ]
+            totals = class_ops.remap_label_files(label_files, mapping, dry_run=data.dry_run, workers=data.workers,
+                                                 on_change=record_file_change)
+        
+        if not data.dry_run:
+            class_ops.write_class_names(data.dataset_path, new_names)
+            search_index.invalidate(data.dataset_path)
+        
+        return {
+            "status": "dry_run" if data.dry_run else "applied",
+            "operation": data.operation,
+            "classes": new_names,
+            "mapping": {str(old_id): new_id for old_id, new_id in mapping.items()},
+            **totals,
+            "duration": time.perf_counter() - start
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error applying class operation: {str(e)}")
+
 @app.post("/load_classes")
 def load_classes(data: DatasetPath):
     try:
-        path = os.path.join(data.path, "classes.txt")
-        classes = []
-        if os.path.exists(path):
-            with open(path, 'r', encoding='utf-8') as f:
-                lines = f.readlines()
-            for i, line in enumerate(lines):
-                name = line.strip()
-                if name:
-                    # Generate color based on index for variety
-                    colors = ["#00e0ff", "#56b0ff", "#ff6b6b", "#4ecdc4", "#ffe66d", "#a8e6cf", "#ff8b94", "#c7ceea"]
-                    color = colors[i % len(colors)]
-                    classes.append({"id": i, "name": name, "color": color})
-        return {"classes": classes}
+        return {"classes": dataset_session.get_session(data.path).classes()}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error loading classes: {str(e)}")
 
@@ -481,6 +743,7 @@ async def import_yaml_classes(file: UploadFile = File(...)):
         content_str = content.decode('utf-8')
         
         # Parse YAML
+        yaml = subsystems.load("yaml")
         try:
             yaml_data = yaml.safe_load(content_str)
         except yaml.YAMLError as e:
@@ -532,6 +795,7 @@ def merge_datasets_endpoint(data: MergeDatasetsRequest):
     try:
         import shutil
         from collections import OrderedDict
+        yaml = subsystems.load("yaml")
         
         if len(data.dataset_paths) < 2:
             raise HTTPException(status_code=400, detail="At least 2 datasets are required for merging")
@@ -583,7 +847,7 @@ def merge_datasets_endpoint(data: MergeDatasetsRequest):
                         class_id_counter += 1
             else:
                 # Try to load from YAML file
-                yaml_files = glob.glob(os.path.join(dataset_path, "*.yaml")) + glob.glob(os.path.join(dataset_path, "*.yml"))
+                yaml_files = metrics.counted_glob(os.path.join(dataset_path, "*.yaml"), "merge_datasets") + metrics.counted_glob(os.path.join(dataset_path, "*.yml"), "merge_datasets")
                 if yaml_files:
                     yaml_file = yaml_files[0]
                     try:
@@ -651,33 +915,37 @@ def merge_datasets_endpoint(data: MergeDatasetsRequest):
         total_images = 0
         total_annotations = 0
         image_counter = {}  # Track image name conflicts
+        pending_copies = {}  # output path -> source path
+        
+        # Optional near-duplicate filtering across all merged datasets
+        skipped_duplicates = 0
+        seen_hashes = None
+        if data.dedupe_near_duplicates:
+            phash_index = subsystems.load("phash")
+            seen_hashes = phash_index.DynamicHashSet(max_distance=data.dedupe_max_distance)
         
         for dataset_idx, dataset_path in enumerate(data.dataset_paths):
             class_mapping = dataset_class_mappings[dataset_idx]
             
-            # Determine images and labels directories
-            images_dir = os.path.join(dataset_path, "images")
-            labels_dir = os.path.join(dataset_path, "labels")
+            # Datasets imported into the annotation store are read from it, not from .txt files
+            store = annotation_store.get_store(dataset_path)
             
-            if not os.path.exists(images_dir):
-                images_dir = dataset_path
-            if not os.path.exists(labels_dir):
-                labels_dir = dataset_path
+            # Find all images (sorted, recursive listing of the images folder)
+            images = dataset_session.get_session(dataset_path).image_list("merge_datasets")
             
-            # Find all images
-            exts = ['*.jpg', '*.jpeg', '*.png', '*.bmp', '*.JPG', '*.JPEG', '*.PNG', '*.BMP']
-            images = set()
-            for ext in exts:
-                pattern = os.path.join(images_dir, '**', ext)
-                try:
-                    found = glob.glob(pattern, recursive=True)
-                    images.update(found)
-                except:
-                    found = glob.glob(os.path.join(images_dir, ext))
-                    images.update(found)
+            image_hashes = {}
+            if seen_hashes is not None:
+                image_hashes, _ = phash_index.update_hashes(dataset_path, images)
             
             # Process each image
             for image_path in images:
+                image_hash = image_hashes.get(image_path)
+                if image_hash is not None:
+                    if seen_hashes.find(image_hash) is not None:
+                        skipped_duplicates += 1
+                        continue
+                    seen_hashes.add(image_hash)
+                
                 image_name = os.path.basename(image_path)
                 base_name = os.path.splitext(image_name)[0]
                 
@@ -691,36 +959,52 @@ def merge_datasets_endpoint(data: MergeDatasetsRequest):
                     new_image_name = image_name
                     new_base_name = base_name
                 
-                # Copy image
+                # Copy image (queued, see below)
                 output_image_path = os.path.join(output_images_dir, new_image_name)
-                if not os.path.exists(output_image_path):
-                    shutil.copy2(image_path, output_image_path)
+                if output_image_path not in pending_copies and not os.path.exists(output_image_path):
+                    pending_copies[output_image_path] = image_path
                     total_images += 1
                 
-                # Process annotation file
-                label_file = os.path.join(labels_dir, base_name + ".txt")
-                if os.path.exists(label_file):
+                # Process annotation file (labels/ or beside the image, where saves write it)
+                label_file = image_ids.label_location(image_path)[1]
+                if store:
+                    boxes = store.read(base_name)
+                else:
                     boxes = parse_yolo_file(label_file)
-                    if boxes:
-                        # Update class IDs
-                        updated_boxes = []
-                        for box in boxes:
-                            old_class_id = int(box.get('class_id', 0))
-                            new_class_id = class_mapping.get(old_class_id, old_class_id)
-                            
-                            updated_boxes.append({
-                                'class_id': new_class_id,
-                                'x': box.get('x', 0),
-                                'y': box.get('y', 0),
-                                'width': box.get('width', 0),
-                                'height': box.get('height', 0),
-                                'confidence': box.get('confidence', 1.0)
-                            })
-                            total_annotations += 1
+                if boxes:
+                    # Update class IDs
+                    updated_boxes = []
+                    for box in boxes:
+                        old_class_id = int(box.get('class_id', 0))
+                        new_class_id = class_mapping.get(old_class_id, old_class_id)
                         
-                        # Save updated annotation
-                        output_label_path = os.path.join(output_labels_dir, new_base_name + ".txt")
-                        save_yolo_file(output_label_path, updated_boxes)
+                        updated_boxes.append({
+                            'class_id': new_class_id,
+                            'x': box.get('x', 0),
+                            'y': box.get('y', 0),
+                            'width': box.get('width', 0),
+                            'height': box.get('height', 0),
+                            'confidence': box.get('confidence', 1.0)
+                        })
+                        total_annotations += 1
+                    
+                    # Save updated annotation
+                    output_label_path = os.path.join(output_labels_dir, new_base_name + ".txt")
+                    save_yolo_file(output_label_path, updated_boxes)
+        
+        # Image copies are I/O bound: with workers they overlap on a thread pool
+        def copy_image(item):
+            output_image_path, image_path = item
+            shutil.copy2(image_path, output_image_path)
+            metrics.BYTES_WRITTEN.inc("image_copy", amount=os.path.getsize(output_image_path))
+        
+        if data.workers and data.workers > 1 and len(pending_copies) > 1:
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=data.workers) as pool:
+                list(pool.map(copy_image, pending_copies.items()))
+        else:
+            for item in pending_copies.items():
+                copy_image(item)
         
         return {
             "status": "success",
@@ -729,6 +1013,7 @@ def merge_datasets_endpoint(data: MergeDatasetsRequest):
             "total_images": total_images,
             "total_annotations": total_annotations,
             "total_classes": len(all_classes),
+            "skipped_duplicates": skipped_duplicates,
             "classes": [{"id": new_id, "name": original_name, "color": color} 
                        for class_name_lower, (new_id, color, original_name) in classes_list]
         }
@@ -740,34 +1025,59 @@ def merge_datasets_endpoint(data: MergeDatasetsRequest):
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Error merging datasets: {str(e)}")
 
-# ... existing code ...
-try:
-    from backend.exporter import export_coco, export_voc
-except ImportError:
-    from exporter import export_coco, export_voc
-
 class ExportRequest(BaseModel):
     dataset_path: str
     format: str # coco, voc, yolo
     apply_filters: bool = False
     filter_class_id: int = None
     filter_annotated: bool = None
+    output_path: str = None
+    # coco/voc: processes reading image sizes; yolo_resized: resize processes
+    workers: int = None
+    # yolo_resized only
+    image_size: int = 640
+    letterbox: bool = True
+    jpeg_quality: int = 90
 
 @app.post("/export")
 def export_dataset_endpoint(data: ExportRequest):
+    exporter = subsystems.load("exporter")
+    # Filters are pushed down to the label index so only matching images are read
+    class_id = data.filter_class_id if data.apply_filters else None
+    annotated = data.filter_annotated if data.apply_filters else None
+    start = time.perf_counter()
     if data.format == "coco":
-        output_file = os.path.join(data.dataset_path, "output.json")
+        output_file = data.output_path or os.path.join(data.dataset_path, "output.json")
         try:
-            res = export_coco(data.dataset_path, output_file)
-            return {"status": "success", "file": res}
+            res = exporter.export_coco(data.dataset_path, output_file, class_id, annotated, data.workers)
+            return {"status": "success", "file": res, "duration": time.perf_counter() - start}
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e))
             
     elif data.format == "voc":
-        output_dir = os.path.join(data.dataset_path, "voc_xmls")
+        output_dir = data.output_path or os.path.join(data.dataset_path, "voc_xmls")
         try:
-            count = export_voc(data.dataset_path, output_dir)
-            return {"status": "success", "count": count, "dir": output_dir}
+            count = exporter.export_voc(data.dataset_path, output_dir, class_id, annotated, data.workers)
+            return {"status": "success", "count": count, "dir": output_dir, "duration": time.perf_counter() - start}
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+            
+    elif data.format == "yolo":
+        output_dir = data.output_path or os.path.normpath(data.dataset_path) + "_yolo_export"
+        try:
+            count = exporter.export_yolo(data.dataset_path, output_dir, class_id, annotated)
+            return {"status": "success", "count": count, "dir": output_dir, "duration": time.perf_counter() - start}
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+            
+    elif data.format == "yolo_resized":
+        if data.image_size < 32 or not 1 <= data.jpeg_quality <= 100:
+            raise HTTPException(status_code=400, detail="image_size must be >= 32 and jpeg_quality between 1 and 100")
+        output_dir = data.output_path or os.path.normpath(data.dataset_path) + f"_yolo_{data.image_size}"
+        try:
+            result = exporter.export_resized(data.dataset_path, output_dir, data.image_size, data.letterbox,
+                                             data.jpeg_quality, class_id, annotated, data.workers)
+            return {"status": "success", **result, "dir": output_dir, "duration": time.perf_counter() - start}
         except Exception as e:
             raise HTTPException(status_code=500, detail=str(e))
             
@@ -785,12 +1095,10 @@ def export_report_endpoint(data: ReportRequest):
         from datetime import datetime
         
         # Get annotated images
-        annotated_res = get_annotated_images(dataset_path=data.dataset_path, class_id=None)
-        annotated_images = set(annotated_res["annotated_images"])
+        annotated_images = set(_annotated_image_paths(data.dataset_path))
         
         # Get all images
-        images_res = load_dataset(DatasetPath(path=data.dataset_path))
-        all_images = images_res["images"]
+        all_images, _, _ = scan_dataset_images(data.dataset_path)
         
         # Load classes
         classes_res = load_classes(DatasetPath(path=data.dataset_path))
@@ -805,7 +1113,8 @@ def export_report_endpoint(data: ReportRequest):
             try:
                 ann_res = load_annotation(
                     dataset_path=data.dataset_path,
-                    image_path=img_path
+                    image_path=img_path,
+                    image_id=None
                 )
                 boxes = ann_res["boxes"]
                 total_annotations += len(boxes)
@@ -863,34 +1172,50 @@ def export_project(data: ExportProjectRequest):
         if not os.path.exists(data.dataset_path):
             raise HTTPException(status_code=404, detail="Dataset path not found")
         
+        # Archive output: stream the project into a single .zip/.tar file
+        project_archive = subsystems.load("project_archive")
+        if project_archive.is_archive(data.output_path):
+            if data.background:
+                job_id = project_archive.start_job(project_archive.export_archive, data.dataset_path, data.output_path)
+                return {"status": "started", "job_id": job_id, "output_path": data.output_path}
+            result = project_archive.export_archive(data.dataset_path, data.output_path)
+            return {"status": "success", **result, "message": "Project exported successfully"}
+        
         if not os.path.exists(data.output_path):
             os.makedirs(data.output_path, exist_ok=True)
         
         # Copy images directory
-        src_images = os.path.join(data.dataset_path, "images")
+        session = dataset_session.get_session(data.dataset_path)
         dst_images = os.path.join(data.output_path, "images")
-        if os.path.exists(src_images):
+        if session.images_dir != data.dataset_path:
             if os.path.exists(dst_images):
                 shutil.rmtree(dst_images)
-            shutil.copytree(src_images, dst_images)
+            shutil.copytree(session.images_dir, dst_images)
         else:
-            # Flat structure - copy images from root
+            # Flat structure - copy the images in the root (not those of other subfolders)
             os.makedirs(dst_images, exist_ok=True)
-            for ext in ['*.jpg', '*.jpeg', '*.png', '*.bmp', '*.JPG', '*.JPEG', '*.PNG', '*.BMP']:
-                for img_file in glob.glob(os.path.join(data.dataset_path, ext)):
+            root = os.path.abspath(data.dataset_path)
+            for img_file in session.image_list("export_project"):
+                if os.path.dirname(img_file) == root:
                     shutil.copy2(img_file, dst_images)
         
         # Copy labels directory
         src_labels = os.path.join(data.dataset_path, "labels")
         dst_labels = os.path.join(data.output_path, "labels")
-        if os.path.exists(src_labels):
+        store = annotation_store.get_store(data.dataset_path)
+        if store:
+            # Labels kept in the annotation store are written as .txt files, with their original lines
+            if os.path.exists(dst_labels):
+                shutil.rmtree(dst_labels)
+            store.export_yolo(dst_labels)
+        elif os.path.exists(src_labels):
             if os.path.exists(dst_labels):
                 shutil.rmtree(dst_labels)
             shutil.copytree(src_labels, dst_labels)
         else:
             os.makedirs(dst_labels, exist_ok=True)
             for ext in ['*.txt']:
-                for label_file in glob.glob(os.path.join(data.dataset_path, ext)):
+                for label_file in metrics.counted_glob(os.path.join(data.dataset_path, ext), "export_project"):
                     shutil.copy2(label_file, dst_labels)
         
         # Copy classes.txt
@@ -900,7 +1225,7 @@ def export_project(data: ExportProjectRequest):
             shutil.copy2(src_classes, dst_classes)
         
         # Copy data.yaml if exists
-        for yaml_file in glob.glob(os.path.join(data.dataset_path, "*.yaml")) + glob.glob(os.path.join(data.dataset_path, "*.yml")):
+        for yaml_file in metrics.counted_glob(os.path.join(data.dataset_path, "*.yaml"), "export_project") + metrics.counted_glob(os.path.join(data.dataset_path, "*.yml"), "export_project"):
             shutil.copy2(yaml_file, data.output_path)
         
         return {
@@ -911,6 +1236,15 @@ def export_project(data: ExportProjectRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error exporting project: {str(e)}")
 
+@app.get("/project_jobs/{job_id}")
+def project_job_status(job_id: str):
+    """Progress of a background project export/import."""
+    project_archive = subsystems.load("project_archive")
+    progress = project_archive.get_job(job_id)
+    if progress is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {"job_id": job_id, **progress}
+
 @app.post("/import_project")
 def import_project(data: ImportProjectRequest):
     """
@@ -920,12 +1254,28 @@ def import_project(data: ImportProjectRequest):
         if not os.path.exists(data.project_path):
             raise HTTPException(status_code=404, detail="Project path not found")
         
+        # Archive: validate from the central directory, then stream members into place
+        project_archive = subsystems.load("project_archive")
+        if os.path.isfile(data.project_path) and project_archive.is_archive(data.project_path):
+            extract_path = data.extract_path or project_archive.default_import_dir(data.project_path)
+            try:
+                summary = project_archive.archive_summary(project_archive.list_archive(data.project_path))
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            if summary["images"] == 0:
+                raise HTTPException(status_code=400, detail="Project archive does not contain images")
+            if data.background:
+                job_id = project_archive.start_job(project_archive.import_archive, data.project_path, extract_path)
+                return {"status": "started", "job_id": job_id, "dataset_path": extract_path, **summary}
+            result = project_archive.import_archive(data.project_path, extract_path)
+            return {"status": "success", **result, "message": "Project imported successfully"}
+        
         # Verify it's a valid project (has images or classes.txt)
         has_images = False
         images_dir = os.path.join(data.project_path, "images")
         if os.path.exists(images_dir) and len(os.listdir(images_dir)) > 0:
             has_images = True
-        elif any(f.lower().endswith(('.jpg', '.jpeg', '.png', '.bmp')) for f in os.listdir(data.project_path) if os.path.isfile(os.path.join(data.project_path, f))):
+        elif any(dataset_session.is_image_name(f) for f in os.listdir(data.project_path) if os.path.isfile(os.path.join(data.project_path, f))):
             has_images = True
         
         if not has_images:
@@ -942,34 +1292,30 @@ def import_project(data: ImportProjectRequest):
         raise HTTPException(status_code=500, detail=f"Error importing project: {str(e)}")
 
 @app.post("/delete_image")
-def delete_image(dataset_path: str = Body(...), image_path: str = Body(...)):
+def delete_image(dataset_path: str = Body(...), image_path: str = Body(None), image_id: int = Body(None)):
     """Delete an image and its corresponding annotation file"""
     try:
-        if not dataset_path or not image_path:
-            raise HTTPException(status_code=400, detail="Dataset path and image path are required")
+        if not dataset_path or not (image_path or image_id is not None):
+            raise HTTPException(status_code=400, detail="Dataset path and image path (or id) are required")
         
-        # Determine full image path
-        if os.path.isabs(image_path):
-            image_full_path = image_path
+        if image_id is not None:
+            image_full_path, base_name, label_file, _ = _resolve_image(dataset_path, image_id=image_id)
         else:
-            # Try images subdirectory first, then flat structure
-            image_full_path = os.path.join(dataset_path, "images", image_path)
+            # Determine full image path
+            if os.path.isabs(image_path):
+                image_full_path = image_path
+            else:
+                # Try images subdirectory first, then flat structure
+                image_full_path = os.path.join(dataset_path, "images", image_path)
+                if not os.path.exists(image_full_path):
+                    image_full_path = os.path.join(dataset_path, image_path)
+            
+            # Verify image exists
             if not os.path.exists(image_full_path):
-                image_full_path = os.path.join(dataset_path, image_path)
-        
-        # Verify image exists
-        if not os.path.exists(image_full_path):
-            raise HTTPException(status_code=404, detail=f"Image not found: {image_full_path}")
-        
-        # Determine label file path
-        base_name = os.path.splitext(os.path.basename(image_full_path))[0]
-        
-        if os.path.basename(os.path.dirname(image_full_path)) == "images":
-            label_dir = os.path.join(os.path.dirname(os.path.dirname(image_full_path)), "labels")
-        else:
-            label_dir = os.path.dirname(image_full_path)
-        
-        label_file = os.path.join(label_dir, base_name + ".txt")
+                raise HTTPException(status_code=404, detail=f"Image not found: {image_full_path}")
+            
+            # Determine label file path
+            base_name, label_file = image_ids.label_location(image_full_path)
         
         deleted_files = []
         
@@ -979,6 +1325,12 @@ def delete_image(dataset_path: str = Body(...), image_path: str = Body(...)):
             deleted_files.append(image_full_path)
         except Exception as e:
             print(f"Warning: Could not delete image file {image_full_path}: {e}")
+        image_ids.get_registry(dataset_path).forget(image_full_path)
+        
+        search_index.mark_dirty(dataset_path, base_name)
+        store = annotation_store.get_store(dataset_path)
+        if store and store.delete(base_name):
+            deleted_files.append(f"{store.path}#{base_name}")
         
         # Delete annotation file if it exists
         if os.path.exists(label_file):
@@ -1000,6 +1352,510 @@ def delete_image(dataset_path: str = Body(...), image_path: str = Body(...)):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error deleting image: {str(e)}")
 
+@app.post("/split_dataset")
+def split_dataset(data: SplitDatasetRequest):
+    """
+    Create stratified train/val/test splits as image list files referenced
+    from data.yaml. Existing assignments are kept unless reshuffle is set,
+    so only new images are placed.
+    """
+    try:
+        if not os.path.isdir(data.dataset_path):
+            raise HTTPException(status_code=404, detail="Dataset path not found")
+        ratios = {"train": data.train, "val": data.val, "test": data.test}
+        if any(r < 0 for r in ratios.values()) or sum(ratios.values()) <= 0:
+            raise HTTPException(status_code=400, detail="Split ratios must be non-negative and not all zero")
+        splits = subsystems.load("splits")
+        
+        start = time.perf_counter()
+        image_list, _, labels_dir = scan_dataset_images(data.dataset_path)
+        keys = [splits.relative_key(data.dataset_path, p) for p in image_list]
+        histograms = splits.class_histograms(data.dataset_path, image_list, labels_dir)
+        
+        groups = []
+        if data.group_near_duplicates:
+            phash_index = subsystems.load("phash")
+            index, _ = phash_index.build_index(data.dataset_path, image_list)
+            position = {path: i for i, path in enumerate(image_list)}
+            hash_groups, _ = index.duplicate_groups(data.max_distance)
+            groups = [[position[index.paths[i]] for i in group] for group in hash_groups]
+        
+        previous = {} if data.reshuffle else splits.load_assignment(data.dataset_path)
+        assignment = splits.stratify(keys, histograms, ratios, groups, previous, data.seed)
+        splits.save_assignment(data.dataset_path, keys, assignment)
+        files = splits.write_split_files(data.dataset_path, keys, assignment)
+        
+        # data.yaml references the list files; other keys (names, nc, ...) are kept
+        yaml = subsystems.load("yaml")
+        yaml_path = os.path.join(data.dataset_path, "data.yaml")
+        yaml_data = {}
+        if os.path.exists(yaml_path):
+            with open(yaml_path, 'r', encoding='utf-8') as f:
+                yaml_data = yaml.safe_load(f) or {}
+        for split in splits.SPLITS:
+            yaml_data.pop(split, None)
+        yaml_data['path'] = os.path.abspath(data.dataset_path)
+        yaml_data.update(files)
+        if 'names' not in yaml_data:
+            classes_path = os.path.join(data.dataset_path, "classes.txt")
+            if os.path.exists(classes_path):
+                with open(classes_path, 'r', encoding='utf-8') as f:
+                    yaml_data['names'] = {i: line.strip() for i, line in enumerate(f.readlines()) if line.strip()}
+        with open(yaml_path, 'w', encoding='utf-8') as f:
+            yaml.dump(yaml_data, f, default_flow_style=False, allow_unicode=True)
+        
+        summary = {}
+        for split in splits.SPLITS:
+            members = [i for i, s in enumerate(assignment) if s == split]
+            class_counts = {}
+            for i in members:
+                for class_id, count in histograms[i].items():
+                    class_counts[class_id] = class_counts.get(class_id, 0) + count
+            summary[split] = {"images": len(members), "boxes_per_class": dict(sorted(class_counts.items()))}
+        
+        return {
+            "status": "success",
+            "files": files,
+            "data_yaml": yaml_path,
+            "splits": summary,
+            "kept_assignments": sum(1 for k, s in zip(keys, assignment) if previous.get(k) == s),
+            # Previously assigned images that had to change split (e.g. to join their near-duplicate group)
+            "moved_assignments": sum(1 for k, s in zip(keys, assignment) if k in previous and previous[k] != s),
+            "new_assignments": sum(1 for k in keys if k not in previous),
+            "near_duplicate_groups": len(groups),
+            "duration": time.perf_counter() - start
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error splitting dataset: {str(e)}")
+
+@app.post("/near_duplicates")
+def find_near_duplicates(data: NearDuplicatesRequest):
+    """
+    Find near-duplicate images with perceptual hashes.
+    With image_path: neighbours of that image. Without: all duplicate groups.
+    """
+    try:
+        if not os.path.isdir(data.dataset_path):
+            raise HTTPException(status_code=404, detail="Dataset path not found")
+        phash_index = subsystems.load("phash")
+        if not 0 <= data.max_distance <= phash_index.MAX_DISTANCE:
+            raise HTTPException(status_code=400, detail=f"max_distance must be between 0 and {phash_index.MAX_DISTANCE}")
+        
+        start = time.perf_counter()
+        image_list, _, _ = scan_dataset_images(data.dataset_path)
+        index, hashed = phash_index.build_index(data.dataset_path, image_list, workers=data.workers)
+        build_time = time.perf_counter() - start
+        
+        start = time.perf_counter()
+        if data.image_path:
+            image_path = os.path.abspath(data.image_path)
+            position = bisect.bisect_left(index.paths, image_path)
+            if position < len(index.paths) and index.paths[position] == image_path:
+                value = int(index.hashes[position])
+            elif os.path.isfile(image_path):
+                value = phash_index.dhash(image_path)
+            else:
+                raise HTTPException(status_code=404, detail=f"Image not found: {data.image_path}")
+            indices, distances = index.query(value, data.max_distance)
+            matches = sorted(
+                ({"image_path": index.paths[i], "distance": int(d)} for i, d in zip(indices, distances)
+                 if index.paths[i] != image_path),
+                key=lambda m: (m["distance"], m["image_path"])
+            )
+            result = {"image_path": image_path, "matches": matches}
+        else:
+            groups, pair_count = index.duplicate_groups(data.max_distance)
+            result = {
+                "groups": [[index.paths[i] for i in group] for group in groups],
+                "distinct_hash_pairs": pair_count,
+                "duplicate_images": sum(len(g) - 1 for g in groups)
+            }
+        
+        return {
+            "status": "success",
+            "total_images": len(index),
+            "hashed_images": hashed,
+            "index_time": build_time,
+            "query_time": time.perf_counter() - start,
+            **result
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error finding near-duplicates: {str(e)}")
+
+def _find_image(images_dir, base_name):
+    for ext in dataset_session.IMAGE_SUFFIXES:
+        image_path = os.path.join(images_dir, base_name + ext)
+        if os.path.exists(image_path):
+            return os.path.abspath(image_path)
+    return None
+
+@app.post("/audit_boxes")
+def audit_boxes(data: BoxAuditRequest):
+    """
+    Dataset-wide box audit: same-class duplicates, cross-class conflicts,
+    near-zero-area and out-of-bounds boxes. Results are paged; pass the
+    returned audit_id to fetch further pages without re-running the audit.
+    """
+    try:
+        box_audit = subsystems.load("box_audit")
+        result = box_audit.recall(data.audit_id) if data.audit_id else None
+        audit_id = data.audit_id
+        
+        if result is None:
+            if not os.path.isdir(data.dataset_path):
+                raise HTTPException(status_code=404, detail="Dataset path not found")
+            params = {
+                "duplicate_iou": data.duplicate_iou,
+                "conflict_iou": data.conflict_iou,
+                "min_area": data.min_area,
+                "bounds_tolerance": data.bounds_tolerance
+            }
+            labels_dir = _labels_dir(data.dataset_path)
+            start = time.perf_counter()
+            store = annotation_store.get_store(data.dataset_path)
+            if store:
+                issues, total_boxes = box_audit.audit_store(store, labels_dir, params)
+            else:
+                label_files = sorted(
+                    f for f in metrics.counted_glob(os.path.join(labels_dir, "*.txt"), "audit_boxes")
+                    if os.path.basename(f) != "classes.txt"
+                )
+                issues, total_boxes = box_audit.audit_label_files(label_files, params, workers=data.workers)
+            issues.sort(key=lambda i: (i["label_file"], i["lines"]))
+            result = {
+                "dataset_path": data.dataset_path,
+                "issues": issues,
+                "summary": box_audit.summarize(issues),
+                "total_boxes": total_boxes,
+                "duration": time.perf_counter() - start
+            }
+            audit_id = box_audit.remember(result)
+        
+        issues = result["issues"]
+        if data.issue_types:
+            issues = [i for i in issues if i["type"] in data.issue_types]
+        start_idx = data.page * data.page_size
+        page_issues = issues[start_idx:start_idx + data.page_size]
+        
+        images_dir = dataset_session.get_session(result["dataset_path"]).images_dir
+        page = []
+        for issue in page_issues:
+            base_name = os.path.splitext(os.path.basename(issue["label_file"]))[0]
+            page.append({
+                **issue,
+                "image_path": _find_image(images_dir, base_name),
+                "box_ids": [f"box_{line}" for line in issue["lines"]],
+                "lines": [line + 1 for line in issue["lines"]]
+            })
+        
+        return {
+            "audit_id": audit_id,
+            "summary": result["summary"],
+            "total_boxes": result["total_boxes"],
+            "total_issues": len(issues),
+            "duration": result["duration"],
+            "page": data.page,
+            "page_size": data.page_size,
+            "has_more": start_idx + data.page_size < len(issues),
+            "issues": page
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error auditing boxes: {str(e)}")
+
+@app.post("/lint_labels")
+def lint_labels(data: LintRequest):
+    """
+    Check every label file for malformed lines, unknown classes, coordinates
+    outside [0, 1], zero-area and duplicate boxes and encoding problems.
+    Diagnostics are paged with file and line references; results of
+    unchanged files come from the dataset index. With fix, the fixable
+    problems are repaired with atomic rewrites (recorded in the edit history).
+    Datasets kept in the annotation store are refused (400): lint reads and
+    rewrites .txt files, so write the store back with /annotation_store/export
+    and drop_store first.
+    """
+    try:
+        label_lint = subsystems.load("label_lint")
+        if not os.path.isdir(data.dataset_path):
+            raise HTTPException(status_code=404, detail="Dataset path not found")
+        if annotation_store.get_store(data.dataset_path):
+            raise HTTPException(status_code=400, detail="Labels are in the annotation store; write them back with /annotation_store/export (drop_store) to lint them")
+        if data.min_severity not in ("warning", "error"):
+            raise HTTPException(status_code=400, detail="min_severity must be 'warning' or 'error'")
+        unknown = set(data.codes or []) | set(data.fix_codes or [])
+        unknown -= set(label_lint.SEVERITY)
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown lint codes: {', '.join(sorted(unknown))}")
+        
+        labels_dir = _labels_dir(data.dataset_path)
+        start = time.perf_counter()
+        results, relinted = label_lint.lint_dataset(data.dataset_path, labels_dir, data.workers)
+        
+        fixed = None
+        if data.fix:
+            class_ids = label_lint.load_class_ids(data.dataset_path)
+            fixed = {"files": 0, "diagnostics": 0}
+            fix_codes = label_lint.DEFAULT_FIX if data.fix_codes is None else set(data.fix_codes)
+            targets = [path for path, diagnostics in results.items()
+                       if any(d["code"] in fix_codes for d in diagnostics)]
+            for label_file in targets:
+                base_name = os.path.splitext(os.path.basename(label_file))[0]
+                
+                def record_change(old_lines, new_lines):
+                    # Runs under the label lock, so revisions cannot race another save
+                    try:
+                        edit_history.record(data.dataset_path, edit_history.label_key(data.dataset_path, label_file),
+                                            old_lines, new_lines)
+                    except Exception as e:
+                        print(f"Warning: Could not record history for {label_file}: {e}")
+                
+                try:
+                    outcome = label_lint.fix_file(label_file, class_ids, fix_codes, on_change=record_change)
+                except OSError as e:
+                    print(f"Warning: Could not fix {label_file}: {e}")
+                    continue
+                if outcome is None:
+                    continue
+                fixed_diagnostics = outcome[2]
+                search_index.mark_dirty(data.dataset_path, base_name)
+                fixed["files"] += 1
+                fixed["diagnostics"] += len(fixed_diagnostics)
+            if targets:
+                results.update(label_lint.lint_dataset(data.dataset_path, labels_dir, data.workers, targets)[0])
+        
+        codes, severities = label_lint.summarize(results)
+        diagnostics = []
+        for label_file in sorted(results):
+            for d in results[label_file]:
+                if data.codes and d["code"] not in data.codes:
+                    continue
+                if data.min_severity == "error" and d["severity"] != "error":
+                    continue
+                diagnostics.append({"file": label_file, **d})
+        start_idx = data.page * data.page_size
+        
+        response = {
+            "files_checked": len(results),
+            "files_relinted": relinted,
+            "files_with_issues": sum(1 for d in results.values() if d),
+            "summary": codes,
+            "severities": severities,
+            "total_diagnostics": len(diagnostics),
+            "page": data.page,
+            "page_size": data.page_size,
+            "has_more": start_idx + data.page_size < len(diagnostics),
+            "diagnostics": diagnostics[start_idx:start_idx + data.page_size],
+            "duration": time.perf_counter() - start
+        }
+        if fixed is not None:
+            response["fixed"] = fixed
+        return response
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error linting labels: {str(e)}")
+
+def _labels_dir(dataset_path):
+    """Labels folder of the dataset's layout: labels/ next to images/, else the root."""
+    return dataset_session.get_session(dataset_path).labels_dir
+
+@app.post("/search_images")
+def search_images(data: SearchRequest):
+    """
+    Filter images on the server: free text over names, class names, tags and
+    comments, plus box class/area/aspect, box count, annotated and tag
+    filters. Returns one page of image ids and paths.
+    """
+    try:
+        if not os.path.isdir(data.dataset_path):
+            raise HTTPException(status_code=404, detail="Dataset path not found")
+        start = time.perf_counter()
+        reindexed = search_index.ensure_fresh(data.dataset_path, full=data.refresh)
+        result = search_index.search(
+            data.dataset_path, data.query, data.class_id, data.min_area, data.max_area, data.min_aspect,
+            data.max_aspect, data.min_boxes, data.max_boxes, data.annotated, data.tag, data.page, data.page_size
+        )
+        images_dir = os.path.join(data.dataset_path, "images")
+        if not os.path.isdir(images_dir):
+            images_dir = data.dataset_path
+        return {
+            "status": "success",
+            "total": result["total"],
+            "page": data.page,
+            "ids": result["ids"],
+            "images": [os.path.join(images_dir, name) for name in result["names"]],
+            "reindexed": reindexed,
+            "duration": time.perf_counter() - start
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error searching images: {str(e)}")
+
+@app.post("/search_images/metadata")
+def search_images_metadata(data: SearchMetadataRequest):
+    """Store the tags and comments of images so server-side search can match them."""
+    try:
+        if not os.path.isdir(data.dataset_path):
+            raise HTTPException(status_code=404, detail="Dataset path not found")
+        items = {image: {"tags": data.tags.get(image), "comments": data.comments.get(image)}
+                 for image in set(data.tags) | set(data.comments)}
+        updated = search_index.set_metadata(data.dataset_path, items)
+        return {"status": "success", "updated": updated, "tags": search_index.all_tags(data.dataset_path)}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error storing search metadata: {str(e)}")
+
+@app.post("/next_image")
+def next_image(data: NextImageRequest):
+    """
+    Next image(s) of a review queue: unannotated first, lowest mean box
+    confidence, rarest class or oldest label edit. The queue lives in the
+    search index, which saves keep current, so each call is an index lookup.
+    Pass the returned cursor back to continue the queue.
+    """
+    try:
+        if not os.path.isdir(data.dataset_path):
+            raise HTTPException(status_code=404, detail="Dataset path not found")
+        if data.order not in search_index.QUEUE_ORDERS:
+            raise HTTPException(status_code=400, detail=f"Unknown order '{data.order}' "
+                                                        f"(expected one of: {', '.join(search_index.QUEUE_ORDERS)})")
+        if data.cursor is not None and len(data.cursor) != 2:
+            raise HTTPException(status_code=400, detail="cursor must be the [key, name] of a previous response")
+        start = time.perf_counter()
+        reindexed = search_index.ensure_fresh(data.dataset_path)
+        result = search_index.next_images(data.dataset_path, data.order, data.after, data.cursor, data.count,
+                                          data.wrap)
+        images_dir = os.path.join(data.dataset_path, "images")
+        if not os.path.isdir(images_dir):
+            images_dir = data.dataset_path
+        for item in result["items"]:
+            item["image"] = os.path.join(images_dir, item.pop("name"))
+        return {
+            "status": "success",
+            "order": data.order,
+            **result,
+            "reindexed": reindexed,
+            "duration": time.perf_counter() - start
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error getting next image: {str(e)}")
+
+@app.post("/verify_images")
+def verify_images(data: VerifyImagesRequest):
+    """
+    Check every image of the dataset with PIL verify() and a full decode on a
+    process pool. Results are cached per file (size, mtime), so repeated
+    passes only check new or modified images. Returns the corrupt and
+    unreadable images; with cached_only, the known-bad list without checking.
+    """
+    try:
+        if not os.path.isdir(data.dataset_path):
+            raise HTTPException(status_code=404, detail="Dataset path not found")
+        start = time.perf_counter()
+        if data.cached_only:
+            results, checked, total = image_verify.known_bad(data.dataset_path), 0, None
+        else:
+            image_list, _, _ = scan_dataset_images(data.dataset_path)
+            results, checked = image_verify.verify_images(data.dataset_path, image_list, data.workers, data.recheck)
+            total = len(results)
+        bad = {"corrupt": [], "unreadable": []}
+        for path in sorted(results):
+            status, error = results[path]
+            if status in bad:
+                bad[status].append({"image_path": path, "error": error})
+        return {
+            "total": total,
+            "checked": checked,
+            "ok": total - len(bad["corrupt"]) - len(bad["unreadable"]) if total is not None else None,
+            "corrupt": bad["corrupt"],
+            "unreadable": bad["unreadable"],
+            "duration": time.perf_counter() - start
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error verifying images: {str(e)}")
+
+def _skip_known_bad(dataset_path, images):
+    """(usable images, skipped [{image_path, error}]) without the images known to be corrupt."""
+    bad = image_verify.known_bad(dataset_path) if dataset_path and os.path.isdir(dataset_path) else {}
+    if not bad:
+        return images, []
+    usable, skipped = [], []
+    for img_path in images:
+        entry = bad.get(os.path.abspath(img_path))
+        if entry is None:
+            usable.append(img_path)
+        else:
+            skipped.append({"image_path": img_path, "error": entry[1]})
+    return usable, skipped
+
+@app.post("/annotation_store/import")
+def import_annotation_store(data: AnnotationStoreRequest):
+    """
+    Move a dataset's YOLO .txt labels into the single-file annotation store.
+    Label files are kept unless remove_label_files is set.
+    """
+    try:
+        if not os.path.isdir(data.dataset_path):
+            raise HTTPException(status_code=404, detail="Dataset path not found")
+        
+        start = time.perf_counter()
+        store = annotation_store.create_store(data.dataset_path)
+        imported = store.import_yolo(_labels_dir(data.dataset_path), remove_files=data.remove_label_files)
+        search_index.invalidate(data.dataset_path)
+        return {
+            "status": "success",
+            "store": store.path,
+            "imported_files": imported,
+            "duration": time.perf_counter() - start,
+            **store.stats()
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error importing annotation store: {str(e)}")
+
+@app.post("/annotation_store/export")
+def export_annotation_store(data: AnnotationStoreRequest):
+    """
+    Write the store back to standard YOLO .txt files (labels/ by default).
+    With drop_store the dataset goes back to per-image .txt files.
+    """
+    try:
+        store = annotation_store.get_store(data.dataset_path)
+        if not store:
+            raise HTTPException(status_code=404, detail="Dataset has no annotation store")
+        
+        output_dir = data.output_dir or os.path.join(data.dataset_path, "labels")
+        written = store.export_yolo(output_dir)
+        if data.drop_store:
+            annotation_store.drop_store(data.dataset_path)
+            search_index.invalidate(data.dataset_path)
+        return {"status": "success", "output_dir": output_dir, "written_files": written, "store_dropped": data.drop_store}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error exporting annotation store: {str(e)}")
+
+@app.post("/annotation_store/status")
+def annotation_store_status(data: AnnotationStoreRequest):
+    """Report whether a dataset uses the annotation store, with its size"""
+    store = annotation_store.get_store(data.dataset_path)
+    if not store:
+        return {"enabled": False}
+    return {"enabled": True, "store": store.path, **store.stats()}
+
 # Vision LLM Models
 class VisionLLMRequest(BaseModel):
     images: List[str]
@@ -1014,9 +1870,137 @@ class VisionLLMRequest(BaseModel):
     confidence_threshold: float = 0.7
     mode: str = "verify"  # verify, annotate, modify
     auto_apply: bool = False
+    # Mosaic batching (verify/annotate): images per provider request (1 = off) and tile size in pixels
+    mosaic_tiles: int = 1
+    mosaic_tile_size: int = 512
+
+# Rate limits (429) and server errors are retried with exponential backoff,
+# or after the server's Retry-After when it sends one
+LLM_MAX_RETRIES = 3
+LLM_RETRY_BACKOFF = 1.0
+LLM_MAX_RETRY_AFTER = 60.0
+LLM_RETRY_STATUS = {429, 500, 502, 503, 504}
+
+# The Vision LLM routes run on the threadpool; a GGUF model is loaded once and
+# called by one request at a time
+_gguf_lock = threading.Lock()
+
+def _call_vision_llm(request, prompt, image_base64, endpoint, cache_owner, max_tokens, timeout, results=None):
+    """
+    Raw text answer of the configured provider for one prompt and one JPEG
+    image (None: no provider, or the GGUF model failed). Blocks while
+    retrying, so callers must not run on the event loop. Retries are counted
+    in results["llm_retries"].
+    """
+    requests = subsystems.load("vision_llm")
+    if request.api_provider == "gguf":
+        if not request.gguf_model_path or not os.path.exists(request.gguf_model_path):
+            raise HTTPException(status_code=400, detail="GGUF model file not found")
+        try:
+            from llama_cpp import Llama
+        except ImportError:
+            raise HTTPException(status_code=500, detail="llama-cpp-python is required for GGUF models. Install with: pip install llama-cpp-python")
+        # Shares the model cache of the route; a failing model answers None (the route's default result)
+        try:
+            with _gguf_lock:
+                if not hasattr(cache_owner, '_gguf_model_cache'):
+                    cache_owner._gguf_model_cache = {}
+                model_key = request.gguf_model_path
+                metrics.cache_lookup("gguf_model", model_key in cache_owner._gguf_model_cache)
+                if model_key not in cache_owner._gguf_model_cache:
+                    print(f"Loading GGUF model: {request.gguf_model_path}")
+                    cache_owner._gguf_model_cache[model_key] = Llama(model_path=request.gguf_model_path, n_ctx=4096,
+                                                                     n_threads=4, verbose=False)
+                    print("Model loaded successfully")
+                llm = cache_owner._gguf_model_cache[model_key]
+                llm_start = time.perf_counter()
+                response = llm(f"{prompt}\n\nImage data (base64): {image_base64[:100]}...", max_tokens=max_tokens,
+                               temperature=0.7, stop=["\n\n"])
+                metrics.LLM_CALL_DURATION.observe("gguf", endpoint, value=time.perf_counter() - llm_start)
+            return response['choices'][0]['text']
+        except Exception as e:
+            print(f"Error with GGUF model: {str(e)}")
+            return None
+    if request.api_provider in ("openai", "custom"):
+        # "custom" is any OpenAI-compatible chat completions server at api_endpoint
+        payload = {
+            "model": request.model,
+            "messages": [{"role": "user", "content": [
+                {"type": "text", "text": prompt},
+                {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{image_base64}"}}
+            ]}],
+            "max_tokens": max_tokens
+        }
+        headers = {"Content-Type": "application/json"}
+        if request.api_key:
+            headers["Authorization"] = f"Bearer {request.api_key}"
+        url = request.api_endpoint or "https://api.openai.com/v1/chat/completions"
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            llm_start = time.perf_counter()
+            try:
+                response = requests.post(url, headers=headers, json=payload, timeout=timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == LLM_MAX_RETRIES:
+                    raise
+                reason, delay = "connection", LLM_RETRY_BACKOFF * 2 ** attempt
+            else:
+                metrics.LLM_CALL_DURATION.observe(request.api_provider, endpoint, value=time.perf_counter() - llm_start)
+                if response.status_code not in LLM_RETRY_STATUS or attempt == LLM_MAX_RETRIES:
+                    response.raise_for_status()
+                    return response.json()['choices'][0]['message']['content']
+                reason, delay = str(response.status_code), LLM_RETRY_BACKOFF * 2 ** attempt
+                try:
+                    delay = min(float(response.headers.get("Retry-After")), LLM_MAX_RETRY_AFTER)
+                except (TypeError, ValueError):
+                    pass
+            metrics.LLM_RETRIES.inc(request.api_provider, endpoint, reason)
+            if results is not None:
+                results["llm_retries"] = results.get("llm_retries", 0) + 1
+            time.sleep(delay)
+    return None
+
+def _check_mosaic(request):
+    vision_mosaic = subsystems.load("vision_mosaic")
+    if not 1 <= request.mosaic_tiles <= vision_mosaic.MAX_TILES:
+        raise HTTPException(status_code=400, detail=f"mosaic_tiles must be between 1 and {vision_mosaic.MAX_TILES}")
+    if not 64 <= request.mosaic_tile_size <= 2048:
+        raise HTTPException(status_code=400, detail="mosaic_tile_size must be between 64 and 2048")
+
+def _mosaic_results(request, images, results, endpoint, task_prompt, result_example, cache_owner,
+                    max_tokens_per_tile, timeout):
+    """
+    Send the images request.mosaic_tiles at a time as one numbered grid image
+    and yield (tile, tile result dict or None, error or None) per image.
+    Counts provider requests in results["mosaic_requests"].
+    """
+    import base64
+    vision_mosaic = subsystems.load("vision_mosaic")
+    results["mosaic_requests"] = 0
+    existing = [img_path for img_path in images if os.path.exists(img_path)]
+    for batch in vision_mosaic.batches(existing, request.mosaic_tiles):
+        mosaic, tiles, failed = vision_mosaic.build_mosaic(batch, request.mosaic_tile_size)
+        for img_path, error in failed:
+            yield vision_mosaic.Tile(0, img_path, 1, 1, 1), None, error
+        if not tiles:
+            continue
+        prompt = vision_mosaic.mosaic_prompt(tiles, task_prompt(tiles), result_example)
+        try:
+            results["mosaic_requests"] += 1
+            content = _call_vision_llm(request, prompt, base64.b64encode(mosaic).decode('utf-8'), endpoint,
+                                       cache_owner, min(max_tokens_per_tile * len(tiles), 16384), timeout, results)
+        except HTTPException:
+            raise
+        except Exception as e:
+            print(f"Error with mosaic request ({len(tiles)} images): {str(e)}")
+            for tile in tiles:
+                yield tile, None, str(e)
+            continue
+        tile_results = vision_mosaic.parse_tile_results(content, len(tiles)) if content is not None else {}
+        for tile in tiles:
+            yield tile, tile_results.get(tile.number), None
 
 @app.post("/vision_llm/verify_all")
-async def verify_all_images(request: VisionLLMRequest):
+def verify_all_images(request: VisionLLMRequest):
     """
     Verify all images and annotations using Vision LLM.
     Returns confidence scores and validation results.
@@ -1024,7 +2008,8 @@ async def verify_all_images(request: VisionLLMRequest):
     try:
         import base64
         try:
-            import requests
+            # Fails early with a clear message; the calls themselves go through _call_vision_llm
+            subsystems.load("vision_llm")
         except ImportError:
             raise HTTPException(status_code=500, detail="The 'requests' library is required for Vision LLM. Install it with: pip install requests")
         
@@ -1032,13 +2017,55 @@ async def verify_all_images(request: VisionLLMRequest):
             "total_count": len(request.images),
             "verified_count": 0,
             "overall_score": 0.0,
-            "image_results": []
+            "image_results": [],
+            "llm_retries": 0
         }
         
         total_score = 0.0
         verified = 0
         
-        for img_path in request.images:
+        # Images known to be corrupt are not sent to the model again
+        images, results["skipped_corrupt"] = _skip_known_bad(request.dataset_path, request.images)
+        
+        # Checked on every request, so 0 or negative tiles are refused instead of meaning one image per call
+        _check_mosaic(request)
+        if request.mosaic_tiles > 1:
+            classes_str = ", ".join([f"{c.get('id')}: {c.get('name', 'Unknown')}" for c in request.classes])
+            annotation_counts = {}
+            for ann in request.annotations:
+                annotation_counts[ann.get('image_name')] = annotation_counts.get(ann.get('image_name'), 0) + 1
+        
+            def task(tiles):
+                existing = "; ".join(f"tile {tile.number}: {annotation_counts.get(os.path.basename(tile.path), 0)}"
+                                     for tile in tiles)
+                return (f"verify the annotations. Classes available: {classes_str}. "
+                        f"Existing annotations: {existing}. "
+                        f"Give a confidence score (0-1) for annotation quality, issues found and suggestions.")
+        
+            example = {"confidence": 0.9, "issues": ["issue1"], "suggestions": ["suggestion1"],
+                       "overall_quality": "good|fair|poor"}
+            for tile, result, error in _mosaic_results(request, images, results, "verify_all", task, example,
+                                                       verify_all_images, 300, 120):
+                if error is not None:
+                    results["image_results"].append({"image_path": tile.path, "confidence": 0.0, "error": error})
+                    continue
+                result = result or {"confidence": 0.5, "issues": [], "suggestions": [], "overall_quality": "fair"}
+                try:
+                    confidence = float(result.get("confidence", 0.5))
+                except (TypeError, ValueError):
+                    confidence = 0.5
+                total_score += confidence
+                verified += 1
+                results["image_results"].append({
+                    "image_path": tile.path,
+                    "confidence": confidence,
+                    "issues": result.get("issues", []),
+                    "suggestions": result.get("suggestions", []),
+                    "overall_quality": result.get("overall_quality", "fair")
+                })
+            images = []
+        
+        for img_path in images:
             try:
                 # Read and encode image
                 if not os.path.exists(img_path):
@@ -1071,87 +2098,11 @@ Respond in JSON format:
 }}"""
                 
                 # Call LLM API or local model
-                if request.api_provider == "gguf":
-                    # Use local GGUF model
-                    if not request.gguf_model_path or not os.path.exists(request.gguf_model_path):
-                        raise HTTPException(status_code=400, detail="GGUF model file not found")
-                    
-                    try:
-                        from llama_cpp import Llama
-                        # Load model (cache it for performance)
-                        if not hasattr(verify_all_images, '_gguf_model_cache'):
-                            verify_all_images._gguf_model_cache = {}
-                        
-                        model_key = request.gguf_model_path
-                        if model_key not in verify_all_images._gguf_model_cache:
-                            print(f"Loading GGUF model: {request.gguf_model_path}")
-                            verify_all_images._gguf_model_cache[model_key] = Llama(
-                                model_path=request.gguf_model_path,
-                                n_ctx=4096,  # Context window
-                                n_threads=4,  # Number of CPU threads
-                                verbose=False
-                            )
-                            print("Model loaded successfully")
-                        
-                        llm = verify_all_images._gguf_model_cache[model_key]
-                        
-                        # For vision models, we need to encode the image
-                        # LLaVA-style models expect image tokens
-                        # For now, we'll use a text-only approach with image description
-                        # In a full implementation, you'd use the model's vision encoder
-                        
-                        # Create a combined prompt with image info
-                        full_prompt = f"{prompt}\n\nImage data (base64): {image_base64[:100]}..."  # Truncated for token limits
-                        
-                        # Generate response
-                        response = llm(
-                            full_prompt,
-                            max_tokens=500,
-                            temperature=0.7,
-                            stop=["\n\n"]
-                        )
-                        content = response['choices'][0]['text']
-                    except ImportError:
-                        raise HTTPException(status_code=500, detail="llama-cpp-python is required for GGUF models. Install with: pip install llama-cpp-python")
-                    except Exception as e:
-                        print(f"Error with GGUF model: {str(e)}")
-                        # Fallback to default
-                        content = '{"confidence": 0.5, "issues": [], "suggestions": [], "overall_quality": "fair"}'
-                        
-                elif request.api_provider == "openai":
-                    headers = {
-                        "Authorization": f"Bearer {request.api_key}",
-                        "Content-Type": "application/json"
-                    }
-                    payload = {
-                        "model": request.model,
-                        "messages": [
-                            {
-                                "role": "user",
-                                "content": [
-                                    {"type": "text", "text": prompt},
-                                    {
-                                        "type": "image_url",
-                                        "image_url": {
-                                            "url": f"data:image/jpeg;base64,{image_base64}"
-                                        }
-                                    }
-                                ]
-                            }
-                        ],
-                        "max_tokens": 500
-                    }
-                    response = requests.post(
-                        "https://api.openai.com/v1/chat/completions",
-                        headers=headers,
-                        json=payload,
-                        timeout=60
-                    )
-                    response.raise_for_status()
-                    llm_response = response.json()
-                    content = llm_response['choices'][0]['message']['content']
+                if request.api_provider in ("gguf", "openai", "custom"):
+                    content = _call_vision_llm(request, prompt, image_base64, "verify_all", verify_all_images, 500, 60,
+                                               results)
                 else:
-                    # Custom API or Claude - would need similar implementation
+                    # Claude - would need similar implementation
                     content = '{"confidence": 0.5, "issues": [], "suggestions": [], "overall_quality": "fair"}'
                 
                 # Parse response
@@ -1191,11 +2142,13 @@ Respond in JSON format:
         
         return results
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error in vision LLM verification: {str(e)}")
 
 @app.post("/vision_llm/annotate_all")
-async def annotate_all_images(request: VisionLLMRequest):
+def annotate_all_images(request: VisionLLMRequest):
     """
     Annotate all images using Vision LLM.
     Creates new annotations based on LLM analysis.
@@ -1203,7 +2156,8 @@ async def annotate_all_images(request: VisionLLMRequest):
     try:
         import base64
         try:
-            import requests
+            # Fails early with a clear message; the calls themselves go through _call_vision_llm
+            subsystems.load("vision_llm")
         except ImportError:
             raise HTTPException(status_code=500, detail="The 'requests' library is required for Vision LLM. Install it with: pip install requests")
         
@@ -1211,10 +2165,48 @@ async def annotate_all_images(request: VisionLLMRequest):
             "total_count": len(request.images),
             "annotated_count": 0,
             "annotations_count": 0,
-            "annotations": []
+            "annotations": [],
+            "llm_retries": 0
         }
         
-        for img_path in request.images:
+        # Images known to be corrupt are not sent to the model again
+        images, results["skipped_corrupt"] = _skip_known_bad(request.dataset_path, request.images)
+        
+        # Checked on every request, so 0 or negative tiles are refused instead of meaning one image per call
+        _check_mosaic(request)
+        if request.mosaic_tiles > 1:
+            classes_str = ", ".join([f"{c.get('id')}: {c.get('name', 'Unknown')}" for c in request.classes])
+            task = (f"identify all objects and give their bounding boxes (center-based). "
+                    f"Classes available: {classes_str}. "
+                    f"Only include annotations with confidence >= {request.confidence_threshold}.")
+            example = {"annotations": [{"class_id": 0, "x_center": 0.5, "y_center": 0.5, "width": 0.2,
+                                        "height": 0.2, "confidence": 0.9}]}
+            for tile, result, error in _mosaic_results(request, images, results, "annotate_all", lambda tiles: task,
+                                                       example, annotate_all_images, 1000, 180):
+                if error is not None:
+                    print(f"Error annotating image {tile.path}: {error}")
+                    continue
+                annotations = []
+                for ann_data in (result or {}).get("annotations", []):
+                    try:
+                        confidence = max(0.0, min(1.0, float(ann_data.get("confidence", 0.5))))
+                        if confidence < request.confidence_threshold:
+                            continue
+                        # Tile coordinates back to the source image
+                        box = tile.to_source(float(ann_data.get("x_center", 0.5)), float(ann_data.get("y_center", 0.5)),
+                                             float(ann_data.get("width", 0.1)), float(ann_data.get("height", 0.1)))
+                        class_id = int(ann_data.get("class_id", 0))
+                    except (TypeError, ValueError, AttributeError):
+                        continue
+                    if box is not None:
+                        annotations.append({"class_id": class_id, **box, "confidence": confidence})
+                if annotations:
+                    results["annotations"].append({"image_path": tile.path, "annotations": annotations})
+                    results["annotated_count"] += 1
+                    results["annotations_count"] += len(annotations)
+            return results
+        
+        for img_path in images:
             try:
                 # Read and encode image
                 if not os.path.exists(img_path):
@@ -1225,7 +2217,8 @@ async def annotate_all_images(request: VisionLLMRequest):
                     image_base64 = base64.b64encode(image_data).decode('utf-8')
                 
                 # Get image dimensions
-                img = Image.open(img_path)
+                metrics.IMAGE_OPENS.inc("vision_llm")
+                img = subsystems.image_module().open(img_path)
                 img_width, img_height = img.size
                 
                 # Prepare prompt for LLM
@@ -1252,79 +2245,9 @@ Use YOLO format (normalized coordinates 0-1, center-based).
 Only include annotations with confidence >= {request.confidence_threshold}."""
                 
                 # Call LLM API or local model
-                if request.api_provider == "gguf":
-                    # Use local GGUF model
-                    if not request.gguf_model_path or not os.path.exists(request.gguf_model_path):
-                        raise HTTPException(status_code=400, detail="GGUF model file not found")
-                    
-                    try:
-                        from llama_cpp import Llama
-                        # Load model (cache it for performance)
-                        if not hasattr(annotate_all_images, '_gguf_model_cache'):
-                            annotate_all_images._gguf_model_cache = {}
-                        
-                        model_key = request.gguf_model_path
-                        if model_key not in annotate_all_images._gguf_model_cache:
-                            print(f"Loading GGUF model: {request.gguf_model_path}")
-                            annotate_all_images._gguf_model_cache[model_key] = Llama(
-                                model_path=request.gguf_model_path,
-                                n_ctx=4096,
-                                n_threads=4,
-                                verbose=False
-                            )
-                            print("Model loaded successfully")
-                        
-                        llm = annotate_all_images._gguf_model_cache[model_key]
-                        
-                        # Create a combined prompt with image info
-                        full_prompt = f"{prompt}\n\nImage data (base64): {image_base64[:100]}..."
-                        
-                        # Generate response
-                        response = llm(
-                            full_prompt,
-                            max_tokens=2000,
-                            temperature=0.7,
-                            stop=["\n\n"]
-                        )
-                        content = response['choices'][0]['text']
-                    except ImportError:
-                        raise HTTPException(status_code=500, detail="llama-cpp-python is required for GGUF models. Install with: pip install llama-cpp-python")
-                    except Exception as e:
-                        print(f"Error with GGUF model: {str(e)}")
-                        content = '{"annotations": []}'
-                        
-                elif request.api_provider == "openai":
-                    headers = {
-                        "Authorization": f"Bearer {request.api_key}",
-                        "Content-Type": "application/json"
-                    }
-                    payload = {
-                        "model": request.model,
-                        "messages": [
-                            {
-                                "role": "user",
-                                "content": [
-                                    {"type": "text", "text": prompt},
-                                    {
-                                        "type": "image_url",
-                                        "image_url": {
-                                            "url": f"data:image/jpeg;base64,{image_base64}"
-                                        }
-                                    }
-                                ]
-                            }
-                        ],
-                        "max_tokens": 2000
-                    }
-                    response = requests.post(
-                        "https://api.openai.com/v1/chat/completions",
-                        headers=headers,
-                        json=payload,
-                        timeout=120
-                    )
-                    response.raise_for_status()
-                    llm_response = response.json()
-                    content = llm_response['choices'][0]['message']['content']
+                if request.api_provider in ("gguf", "openai", "custom"):
+                    content = _call_vision_llm(request, prompt, image_base64, "annotate_all", annotate_all_images, 2000, 120,
+                                               results)
                 else:
                     content = '{"annotations": []}'
                 
@@ -1349,25 +2272,25 @@ Only include annotations with confidence >= {request.confidence_threshold}."""
                         width = ann_data.get("width", 0.1)
                         height = ann_data.get("height", 0.1)
                         
-                # Convert to pixel coordinates
-                x = (x_center - width/2) * img_width
-                y = (y_center - height/2) * img_height
-                w = width * img_width
-                h = height * img_height
-                
-                # Get confidence, default to 0.5 if not provided
-                confidence = float(ann_data.get("confidence", 0.5))
-                # Ensure confidence is between 0 and 1
-                confidence = max(0.0, min(1.0, confidence))
-                
-                annotations.append({
-                    "class_id": int(ann_data.get("class_id", 0)),
-                    "x": x,
-                    "y": y,
-                    "width": w,
-                    "height": h,
-                    "confidence": confidence
-                })
+                        # Convert to pixel coordinates
+                        x = (x_center - width/2) * img_width
+                        y = (y_center - height/2) * img_height
+                        w = width * img_width
+                        h = height * img_height
+                        
+                        # Get confidence, default to 0.5 if not provided
+                        confidence = float(ann_data.get("confidence", 0.5))
+                        # Ensure confidence is between 0 and 1
+                        confidence = max(0.0, min(1.0, confidence))
+                        
+                        annotations.append({
+                            "class_id": int(ann_data.get("class_id", 0)),
+                            "x": x,
+                            "y": y,
+                            "width": w,
+                            "height": h,
+                            "confidence": confidence
+                        })
                 
                 if annotations:
                     results["annotations"].append({
@@ -1382,11 +2305,13 @@ Only include annotations with confidence >= {request.confidence_threshold}."""
         
         return results
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error in vision LLM annotation: {str(e)}")
 
 @app.post("/vision_llm/modify_annotations")
-async def modify_annotations(request: VisionLLMRequest):
+def modify_annotations(request: VisionLLMRequest):
     """
     Modify existing annotations using Vision LLM.
     Improves annotation quality and fixes issues.
@@ -1394,7 +2319,8 @@ async def modify_annotations(request: VisionLLMRequest):
     try:
         import base64
         try:
-            import requests
+            # Fails early with a clear message; the calls themselves go through _call_vision_llm
+            subsystems.load("vision_llm")
         except ImportError:
             raise HTTPException(status_code=500, detail="The 'requests' library is required for Vision LLM. Install it with: pip install requests")
         
@@ -1402,10 +2328,14 @@ async def modify_annotations(request: VisionLLMRequest):
             "total_count": len(request.images),
             "modified_count": 0,
             "modifications_count": 0,
-            "modifications": []
+            "modifications": [],
+            "llm_retries": 0
         }
         
-        for img_path in request.images:
+        # Images known to be corrupt are not sent to the model again
+        images, results["skipped_corrupt"] = _skip_known_bad(request.dataset_path, request.images)
+        
+        for img_path in images:
             try:
                 # Read and encode image
                 if not os.path.exists(img_path):
@@ -1422,7 +2352,8 @@ async def modify_annotations(request: VisionLLMRequest):
                     continue
                 
                 # Get image dimensions
-                img = Image.open(img_path)
+                metrics.IMAGE_OPENS.inc("vision_llm")
+                img = subsystems.image_module().open(img_path)
                 img_width, img_height = img.size
                 
                 # Prepare prompt for LLM
@@ -1458,79 +2389,9 @@ Respond with improved annotations in JSON format:
 Use pixel coordinates (not normalized)."""
                 
                 # Call LLM API or local model
-                if request.api_provider == "gguf":
-                    # Use local GGUF model
-                    if not request.gguf_model_path or not os.path.exists(request.gguf_model_path):
-                        raise HTTPException(status_code=400, detail="GGUF model file not found")
-                    
-                    try:
-                        from llama_cpp import Llama
-                        # Load model (cache it for performance)
-                        if not hasattr(modify_annotations, '_gguf_model_cache'):
-                            modify_annotations._gguf_model_cache = {}
-                        
-                        model_key = request.gguf_model_path
-                        if model_key not in modify_annotations._gguf_model_cache:
-                            print(f"Loading GGUF model: {request.gguf_model_path}")
-                            modify_annotations._gguf_model_cache[model_key] = Llama(
-                                model_path=request.gguf_model_path,
-                                n_ctx=4096,
-                                n_threads=4,
-                                verbose=False
-                            )
-                            print("Model loaded successfully")
-                        
-                        llm = modify_annotations._gguf_model_cache[model_key]
-                        
-                        # Create a combined prompt with image info
-                        full_prompt = f"{prompt}\n\nImage data (base64): {image_base64[:100]}..."
-                        
-                        # Generate response
-                        response = llm(
-                            full_prompt,
-                            max_tokens=2000,
-                            temperature=0.7,
-                            stop=["\n\n"]
-                        )
-                        content = response['choices'][0]['text']
-                    except ImportError:
-                        raise HTTPException(status_code=500, detail="llama-cpp-python is required for GGUF models. Install with: pip install llama-cpp-python")
-                    except Exception as e:
-                        print(f"Error with GGUF model: {str(e)}")
-                        content = '{"annotations": [], "changes": []}'
-                        
-                elif request.api_provider == "openai":
-                    headers = {
-                        "Authorization": f"Bearer {request.api_key}",
-                        "Content-Type": "application/json"
-                    }
-                    payload = {
-                        "model": request.model,
-                        "messages": [
-                            {
-                                "role": "user",
-                                "content": [
-                                    {"type": "text", "text": prompt},
-                                    {
-                                        "type": "image_url",
-                                        "image_url": {
-                                            "url": f"data:image/jpeg;base64,{image_base64}"
-                                        }
-                                    }
-                                ]
-                            }
-                        ],
-                        "max_tokens": 2000
-                    }
-                    response = requests.post(
-                        "https://api.openai.com/v1/chat/completions",
-                        headers=headers,
-                        json=payload,
-                        timeout=120
-                    )
-                    response.raise_for_status()
-                    llm_response = response.json()
-                    content = llm_response['choices'][0]['message']['content']
+                if request.api_provider in ("gguf", "openai", "custom"):
+                    content = _call_vision_llm(request, prompt, image_base64, "modify_annotations", modify_annotations, 2000, 120,
+                                               results)
                 else:
                     content = '{"annotations": [], "changes": []}'
                 
@@ -1569,36 +2430,30 @@ Use pixel coordinates (not normalized)."""
         raise HTTPException(status_code=500, detail=f"Error in vision LLM modification: {str(e)}")
 
 if __name__ == "__main__":
+    import importlib.util
     import uvicorn
-    import sys
-    import os
-    import io
-    
-    # Fix encoding for Windows console (cp1252 doesn't support Unicode)
-    # Force UTF-8 encoding for stdout/stderr
-    if sys.platform == 'win32':
-        if sys.stdout.encoding != 'utf-8':
-            sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
-        if sys.stderr.encoding != 'utf-8':
-            sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', errors='replace')
     
-    # Verify we can run this
-    print("Starting backend...")
-    print(f"Python version: {sys.version}")
-    print(f"Python executable: {sys.executable}")
-    print(f"Working directory: {os.getcwd()}")
-    print(f"Script location: {__file__}")
-    print(f"PYTHONPATH: {os.environ.get('PYTHONPATH', 'Not set')}")
+    print(f"Starting backend (Python {sys.version.split()[0]}, {sys.executable})")
     
-    # Check if required modules are available
-    try:
-        import fastapi
-        import uvicorn
-        import PIL
-        print("[OK] All required modules are available")
-    except ImportError as e:
-        print(f"[ERROR] Missing required module: {e}")
+    # Check required modules without importing them (PIL is loaded on first use)
+    missing = [name for name in ("fastapi", "uvicorn", "PIL") if importlib.util.find_spec(name) is None]
+    if missing:
+        print(f"[ERROR] Missing required module: {', '.join(missing)}")
         print("Please install dependencies: pip install -r requirements.txt")
         sys.exit(1)
     
-    uvicorn.run(app, host="127.0.0.1", port=8000)
+    import argparse
+    parser = argparse.ArgumentParser(description="Lama Worlds Annotation Studio backend")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=shared_state.worker_count(),
+                        help="Worker processes (default: LAMA_WORKERS or 1)")
+    args, _ = parser.parse_known_args()
+    
+    if args.workers > 1:
+        # Workers import the app by name and pick up multi-worker mode from the environment
+        os.environ["LAMA_WORKERS"] = str(args.workers)
+        print(f"Multi-worker mode: {args.workers} workers, shared state in {shared_state.state_dir()}")
+        uvicorn.run("main:app", host=args.host, port=args.port, workers=args.workers, app_dir=_backend_dir)
+    else:
+        uvicorn.run(app, host=args.host, port=args.port)
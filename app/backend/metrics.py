@@ -0,0 +1,268 @@
+"""
+In-process metrics for the backend, exposed in Prometheus text format.
+
+Counters and histograms are plain Python objects guarded by a lock, so they
+are cheap enough to update on every request and inside hot loops. The
+timing middleware records per-route latency and in-flight requests; the
+costly internals (glob walks, image opens, label parses, bytes written,
+LLM calls, caches) are counted where they happen.
+"""
+import glob as _glob
+import threading
+import time
+
+# Latency buckets in seconds, from a cached annotation load to a full export
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = []
+    for name, value in pairs:
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        escaped.append(f'{name}="{value}"')
+    return "{" + ",".join(escaped) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type_name = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {labels}")
+        return tuple(str(v) for v in labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def inc(self, *labels, amount=1):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, *labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def inc(self, *labels, amount=1):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels, value):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def get(self, *labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, *labels, value):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["counts"][i] += 1
+                    break
+            state["sum"] += value
+            state["count"] += 1
+
+    def get(self, *labels):
+        """Return (count, sum) for a label set."""
+        state = self._values.get(self._key(labels))
+        return (state["count"], state["sum"]) if state else (0, 0.0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((k, {"counts": list(v["counts"]), "sum": v["sum"], "count": v["count"]})
+                           for k, v in self._values.items())
+        for labels, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state["counts"]):
+                cumulative += count
+                le = _format_labels(self.labelnames, labels, ("le", _format_value(float(bound))))
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            le = _format_labels(self.labelnames, labels, ("le", "+Inf"))
+            lines.append(f"{self.name}_bucket{le} {state['count']}")
+            label_str = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_str} {_format_value(state['sum'])}")
+            lines.append(f"{self.name}_count{label_str} {state['count']}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def clear(self):
+        for metric in self._metrics:
+            metric.clear()
+
+
+REGISTRY = Registry()
+
+# HTTP layer
+HTTP_REQUEST_DURATION = REGISTRY.register(Histogram(
+    "lama_http_request_duration_seconds", "Request latency by route",
+    ("method", "route", "status")))
+HTTP_REQUESTS_IN_FLIGHT = REGISTRY.register(Gauge(
+    "lama_http_requests_in_flight", "Requests currently being handled by route",
+    ("route",)))
+
+# Costly internals
+GLOB_WALKS = REGISTRY.register(Counter(
+    "lama_glob_walks_total", "Directory glob walks", ("caller",)))
+GLOB_WALK_SECONDS = REGISTRY.register(Counter(
+    "lama_glob_walk_seconds_total", "Time spent in directory glob walks", ("caller",)))
+GLOB_FILES = REGISTRY.register(Counter(
+    "lama_glob_files_total", "Files returned by directory glob walks", ("caller",)))
+IMAGE_OPENS = REGISTRY.register(Counter(
+    "lama_image_opens_total", "Images opened with PIL", ("caller",)))
+LABEL_PARSES = REGISTRY.register(Counter(
+    "lama_label_parses_total", "YOLO label files parsed"))
+LABEL_LINES = REGISTRY.register(Counter(
+    "lama_label_lines_total", "YOLO label lines read"))
+BYTES_WRITTEN = REGISTRY.register(Counter(
+    "lama_bytes_written_total", "Bytes written to disk", ("kind",)))
+LLM_CALL_DURATION = REGISTRY.register(Histogram(
+    "lama_llm_call_duration_seconds", "Vision LLM call latency", ("provider", "endpoint")))
+LLM_RETRIES = REGISTRY.register(Counter(
+    "lama_llm_retries_total", "Vision LLM calls retried after a rate limit or server error",
+    ("provider", "endpoint", "reason")))
+CACHE_REQUESTS = REGISTRY.register(Counter(
+    "lama_cache_requests_total", "Cache lookups by result (hit/miss)", ("cache", "result")))
+
+
+def counted_glob(pattern, caller, recursive=False):
+    """glob.glob that records walk count, duration and result size."""
+    start = time.perf_counter()
+    found = _glob.glob(pattern, recursive=recursive)
+    GLOB_WALKS.inc(caller)
+    GLOB_WALK_SECONDS.inc(caller, amount=time.perf_counter() - start)
+    GLOB_FILES.inc(caller, amount=len(found))
+    return found
+
+
+def cache_lookup(cache_name, hit):
+    CACHE_REQUESTS.inc(cache_name, "hit" if hit else "miss")
+
+
+class TimingMiddleware:
+    """
+    ASGI middleware recording latency and in-flight requests per route.
+
+    Routes are labelled by their path template ("/project_jobs/{job_id}"),
+    resolved like the router does; paths that match no route are grouped
+    under "unmatched" so scanners cannot blow up cardinality.
+    """
+
+    def __init__(self, app, routes=None):
+        self.app = app
+        self.routes = routes
+        self._static_paths = None
+        self._param_routes = None
+
+    def _route_label(self, scope):
+        if self._static_paths is None:
+            # Routes are all registered by the time the first request arrives
+            routes = list(self.routes()) if self.routes else []
+            self._param_routes = [r for r in routes if getattr(r, "param_convertors", None)]
+            self._static_paths = {r.path for r in routes if r not in self._param_routes and hasattr(r, "path")}
+        path = scope.get("path", "")
+        if path in self._static_paths:
+            return path
+        from starlette.routing import Match
+        partial = None
+        for route in self._param_routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return route.path
+            if match == Match.PARTIAL and partial is None:
+                partial = route.path
+        return partial or "unmatched"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        route = self._route_label(scope)
+        status_holder = {"status": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status_holder["status"] = message["status"]
+            await send(message)
+
+        HTTP_REQUESTS_IN_FLIGHT.inc(route)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_REQUESTS_IN_FLIGHT.dec(route)
+            HTTP_REQUEST_DURATION.observe(scope.get("method", ""), route, status_holder["status"],
+                                          value=time.perf_counter() - start)
+
+
+def render():
+    return REGISTRY.render()
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 
 class DatasetPath(BaseModel):
     path: str
@@ -14,9 +14,30 @@ class BoundingBox(BaseModel):
     confidence: Optional[float] = 1.0
 
 class AnnotationData(BaseModel):
-    image_name: str
+    image_name: Optional[str] = None
     boxes: List[BoundingBox]
     dataset_path: str
+    image_id: Optional[int] = None  # stable id from load_dataset, instead of image_name
+    base_version: Optional[str] = None
+
+class BoxPatch(BaseModel):
+    op: str  # "add", "update" or "delete"
+    id: Optional[str] = None
+    box: Optional[BoundingBox] = None
+
+class HistoryRequest(BaseModel):
+    dataset_path: str
+    image_name: Optional[str] = None
+    image_id: Optional[int] = None
+    rev: Optional[int] = None
+    base_version: Optional[str] = None
+
+class AnnotationPatch(BaseModel):
+    image_name: Optional[str] = None
+    dataset_path: str
+    image_id: Optional[int] = None
+    ops: List[BoxPatch]
+    base_version: Optional[str] = None
 
 class ClassItem(BaseModel):
     id: int
@@ -27,15 +48,110 @@ class ClassUpdate(BaseModel):
     classes: List[ClassItem]
     dataset_path: str
 
+class ClassOperationRequest(BaseModel):
+    dataset_path: str
+    operation: str  # "rename", "merge", "delete" or "reorder"
+    class_ids: Optional[List[int]] = None
+    target_id: Optional[int] = None
+    name: Optional[str] = None
+    order: Optional[List[int]] = None
+    dry_run: bool = False
+    workers: Optional[int] = None
+
+class SplitDatasetRequest(BaseModel):
+    dataset_path: str
+    train: float = 0.8
+    val: float = 0.2
+    test: float = 0.0
+    seed: int = 0
+    group_near_duplicates: bool = False
+    max_distance: int = 3
+    reshuffle: bool = False
+
 class MergeDatasetsRequest(BaseModel):
     dataset_paths: List[str]
     output_path: str
     merge_classes: bool = True
     rename_conflicting_images: bool = True
+    dedupe_near_duplicates: bool = False
+    dedupe_max_distance: int = 3
+    workers: Optional[int] = None  # threads copying images (default: serial)
 
 class ExportProjectRequest(BaseModel):
     dataset_path: str
-    output_path: str
+    output_path: str  # folder, or a .zip / .tar archive path
+    background: bool = False
 
 class ImportProjectRequest(BaseModel):
-    project_path: str
+    project_path: str  # folder, or a .zip / .tar archive
+    extract_path: Optional[str] = None
+    background: bool = False
+
+class AnnotationStoreRequest(BaseModel):
+    dataset_path: str
+    output_dir: Optional[str] = None
+    remove_label_files: bool = False
+    drop_store: bool = False
+
+class NearDuplicatesRequest(BaseModel):
+    dataset_path: str
+    image_path: Optional[str] = None
+    max_distance: int = 4
+    workers: Optional[int] = None
+
+class BoxAuditRequest(BaseModel):
+    dataset_path: str
+    duplicate_iou: float = 0.9
+    conflict_iou: float = 0.7
+    min_area: float = 1e-5
+    bounds_tolerance: float = 1e-3
+    issue_types: Optional[List[str]] = None
+    page: int = 0
+    page_size: int = 500
+    workers: Optional[int] = None
+    audit_id: Optional[str] = None
+
+class SearchRequest(BaseModel):
+    dataset_path: str
+    query: Optional[str] = None  # words matched as prefixes in names, classes, tags and comments
+    class_id: Optional[int] = None
+    min_area: Optional[float] = None  # box area in pixels
+    max_area: Optional[float] = None
+    min_aspect: Optional[float] = None  # box width / height
+    max_aspect: Optional[float] = None
+    min_boxes: Optional[int] = None
+    max_boxes: Optional[int] = None
+    annotated: Optional[bool] = None
+    tag: Optional[str] = None
+    page: int = 0
+    page_size: int = 500
+    refresh: bool = False  # restat the whole dataset (picks up changes made outside the app)
+
+class SearchMetadataRequest(BaseModel):
+    dataset_path: str
+    tags: Dict[str, List[str]] = {}  # image name or path -> tags
+    comments: Dict[str, List[str]] = {}  # image name or path -> comment texts
+
+class NextImageRequest(BaseModel):
+    dataset_path: str
+    order: str = "unannotated"  # unannotated, low_confidence, rare_class, oldest_edit
+    after: Optional[str] = None  # current image (path or name); ignored when cursor is set
+    cursor: Optional[List[Any]] = None  # cursor of the previous response
+    count: int = 1
+    wrap: bool = True  # start over from the top at the end of the queue
+
+class LintRequest(BaseModel):
+    dataset_path: str
+    codes: Optional[List[str]] = None  # only report these diagnostic codes
+    min_severity: str = "warning"  # "warning" or "error"
+    fix: bool = False  # rewrite files with the fixable problems repaired
+    fix_codes: Optional[List[str]] = None  # default: everything except unknown_class
+    page: int = 0
+    page_size: int = 500
+    workers: Optional[int] = None
+
+class VerifyImagesRequest(BaseModel):
+    dataset_path: str
+    workers: Optional[int] = None
+    recheck: bool = False  # verify again even if unchanged since the last pass
+    cached_only: bool = False  # only list images already known to be bad
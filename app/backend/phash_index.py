@@ -0,0 +1,319 @@
+"""
+Perceptual-hash near-duplicate index.
+
+Each image gets a 64-bit difference hash (dHash) computed with NumPy from a
+9x8 grayscale thumbnail, so re-encoded, resized or renamed copies of an
+image end up a few bits apart. Hashes are cached in the dataset index keyed
+by (size, mtime) and searched with multi-index hashing: the 64 bits are
+split into chunks and, by the pigeonhole principle, any hash within Hamming
+distance r of a query matches at least one chunk within r // chunks bits.
+Each chunk is a sorted array, so a query costs a few binary searches
+instead of a scan over the whole dataset.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import combinations
+
+import numpy as np
+
+try:
+    from backend import dataset_index, metrics
+except ImportError:
+    import dataset_index
+    import metrics
+
+HASH_BITS = 64
+QUERY_CHUNKS = 4  # 16-bit chunks for single-image queries
+MAX_DISTANCE = 11
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS phash (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    hash INTEGER NOT NULL
+);
+"""
+
+# Cached in-memory indexes: dataset key -> (signature of hash table, HashIndex)
+_memory_indexes = {}
+
+_POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def popcount(values):
+    """Number of set bits of each uint64 in an array."""
+    values = np.ascontiguousarray(values, dtype=np.uint64)
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values).astype(np.int64)
+    return _POPCOUNT_TABLE[values.view(np.uint8).reshape(-1, 8)].sum(axis=1).astype(np.int64)
+
+
+def dhash(image_path):
+    """64-bit difference hash of an image."""
+    from PIL import Image
+
+    metrics.IMAGE_OPENS.inc("phash")
+    with Image.open(image_path) as img:
+        # JPEG draft decoding at reduced scale makes hashing large photos cheap
+        img.draft("L", (64, 64))
+        pixels = np.asarray(img.convert("L").resize((9, 8), Image.BILINEAR), dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int(np.packbits(bits).view(">u8")[0])
+
+
+def _to_signed(value):
+    # SQLite integers are signed 64-bit
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def _to_unsigned(value):
+    return value + (1 << 64) if value < 0 else value
+
+
+def _chunk_bounds(num_chunks):
+    """Split 64 bits into num_chunks contiguous (shift, width) ranges."""
+    bounds = []
+    shift = 0
+    for i in range(num_chunks):
+        width = HASH_BITS // num_chunks + (1 if i < HASH_BITS % num_chunks else 0)
+        bounds.append((shift, width))
+        shift += width
+    return bounds
+
+
+@lru_cache(maxsize=None)
+def _flip_masks(width, max_bits):
+    """All masks of at most max_bits set bits within a chunk of width bits."""
+    masks = [0]
+    for n in range(1, max_bits + 1):
+        for bits in combinations(range(width), n):
+            mask = 0
+            for b in bits:
+                mask |= 1 << b
+            masks.append(mask)
+    return tuple(masks)
+
+
+def _bucket_pairs(bucket, max_vectorized=1024):
+    """Index arrays (a, b) of all pairs in a bucket, row by row for huge buckets to bound memory."""
+    n = len(bucket)
+    if n <= max_vectorized:
+        left, right = np.triu_indices(n, k=1)
+        yield bucket[left], bucket[right]
+        return
+    for row in range(n - 1):
+        yield np.full(n - row - 1, bucket[row]), bucket[row + 1:]
+
+
+def near_pairs(hashes, max_distance=3, small_bucket=64):
+    """
+    Every pair (i, j, distance) of hashes with i < j within max_distance.
+
+    Uses max_distance + 1 chunks so each near pair shares at least one
+    chunk exactly, then compares pairs inside each bucket only. Small
+    buckets are compared for the whole dataset at once by offset; the
+    rare huge buckets (e.g. many blank frames) are handled one by one.
+    """
+    n = len(hashes)
+    if n < 2:
+        return []
+    found_a, found_b, found_d = [], [], []
+
+    def collect(a, b):
+        distances = popcount(hashes[a] ^ hashes[b])
+        close = distances <= max_distance
+        if close.any():
+            found_a.append(a[close])
+            found_b.append(b[close])
+            found_d.append(distances[close])
+
+    for shift, width in _chunk_bounds(min(max_distance + 1, HASH_BITS)):
+        values = ((hashes >> np.uint64(shift)) & np.uint64((1 << width) - 1)).astype(np.int64)
+        order = np.argsort(values, kind="stable")
+        sorted_values = values[order]
+        bounds = np.concatenate(([0], np.flatnonzero(np.diff(sorted_values)) + 1, [n]))
+        sizes = np.diff(bounds)
+        in_big_bucket = np.repeat(sizes > small_bucket, sizes)
+
+        for offset in range(1, min(small_bucket, int(sizes.max()))):
+            same = (sorted_values[offset:] == sorted_values[:-offset]) & ~in_big_bucket[:-offset]
+            positions = np.flatnonzero(same)
+            if len(positions) == 0:
+                break
+            collect(order[positions], order[positions + offset])
+
+        for start, size in zip(bounds[:-1][sizes > small_bucket], sizes[sizes > small_bucket]):
+            for a, b in _bucket_pairs(order[start:start + size]):
+                collect(a, b)
+
+    if not found_a:
+        return []
+    a = np.concatenate(found_a)
+    b = np.concatenate(found_b)
+    d = np.concatenate(found_d)
+    low, high = np.minimum(a, b), np.maximum(a, b)
+    # The same pair can share several chunks; keep it once
+    _, unique = np.unique(low * n + high, return_index=True)
+    return [(int(low[k]), int(high[k]), int(d[k])) for k in unique]
+
+
+class HashIndex:
+    """Multi-index hash over an array of 64-bit hashes."""
+
+    def __init__(self, paths, hashes, num_chunks=QUERY_CHUNKS):
+        self.paths = list(paths)
+        self.hashes = np.asarray(hashes, dtype=np.uint64)
+        self.chunks = []
+        for shift, width in _chunk_bounds(num_chunks):
+            values = ((self.hashes >> np.uint64(shift)) & np.uint64((1 << width) - 1)).astype(np.int64)
+            order = np.argsort(values, kind="stable")
+            self.chunks.append((shift, width, values[order], order))
+
+    def __len__(self):
+        return len(self.paths)
+
+    def query(self, value, max_distance=4):
+        """Indices and distances of hashes within max_distance of value."""
+        if len(self.paths) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        per_chunk = max_distance // len(self.chunks)
+        candidates = []
+        for shift, width, sorted_values, order in self.chunks:
+            chunk = (value >> shift) & ((1 << width) - 1)
+            keys = np.bitwise_xor(np.array(_flip_masks(width, per_chunk), dtype=np.int64), chunk)
+            lows = np.searchsorted(sorted_values, keys, side="left")
+            highs = np.searchsorted(sorted_values, keys, side="right")
+            for lo, hi in zip(lows[highs > lows], highs[highs > lows]):
+                candidates.append(order[lo:hi])
+        if not candidates:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        candidates = np.unique(np.concatenate(candidates))
+        distances = popcount(self.hashes[candidates] ^ np.uint64(value))
+        keep = distances <= max_distance
+        return candidates[keep], distances[keep]
+
+    def duplicate_groups(self, max_distance=3):
+        """
+        Groups of image indices (size >= 2) connected by near-duplicate links.
+
+        Identical hashes are collapsed first, so a folder of thousands of
+        identical frames costs one entry instead of a quadratic pair list.
+        """
+        unique_hashes, inverse = np.unique(self.hashes, return_inverse=True)
+        pairs = near_pairs(unique_hashes, max_distance)
+
+        parent = {}
+
+        def find(i):
+            while parent.setdefault(i, i) != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        for i, j, _ in pairs:
+            ri, rj = find(i), find(j)
+            if ri != rj:
+                parent[max(ri, rj)] = min(ri, rj)
+
+        # Only images sharing a hash or linked by a pair can be in a group
+        inverse = inverse.ravel()
+        roots = np.arange(len(unique_hashes))
+        for hash_id in parent:
+            roots[hash_id] = find(hash_id)
+        involved = np.bincount(inverse, minlength=len(unique_hashes)) > 1
+        involved[list(parent)] = True
+        images = np.flatnonzero(involved[inverse])
+        image_roots = roots[inverse[images]]
+        order = np.argsort(image_roots, kind="stable")
+        images, image_roots = images[order], image_roots[order]
+        splits = np.flatnonzero(np.diff(image_roots)) + 1
+        groups = [group.tolist() for group in np.split(images, splits) if len(group) > 1]
+        return groups, len(pairs)
+
+
+class DynamicHashSet:
+    """Incrementally built near-duplicate set, used while merging datasets."""
+
+    def __init__(self, max_distance=3, num_chunks=QUERY_CHUNKS):
+        self.max_distance = max_distance
+        self.bounds = _chunk_bounds(num_chunks)
+        self.tables = [dict() for _ in self.bounds]
+        self.masks = [_flip_masks(width, max_distance // num_chunks) for _, width in self.bounds]
+
+    def find(self, value):
+        """A stored hash within max_distance of value, or None."""
+        for (shift, width), table, masks in zip(self.bounds, self.tables, self.masks):
+            chunk = (value >> shift) & ((1 << width) - 1)
+            for mask in masks:
+                for other in table.get(chunk ^ mask, ()):
+                    if bin(other ^ value).count("1") <= self.max_distance:
+                        return other
+        return None
+
+    def add(self, value):
+        for (shift, width), table in zip(self.bounds, self.tables):
+            table.setdefault((value >> shift) & ((1 << width) - 1), []).append(value)
+
+
+def update_hashes(dataset_path, image_paths, workers=None):
+    """
+    Hash new or changed images and return {path: hash} for all image_paths.
+
+    Unchanged images are served from the dataset index; hashing runs on a
+    thread pool since PIL releases the GIL while decoding.
+    """
+    index = dataset_index.get_index(dataset_path)
+    index.ensure_schema("phash", _SCHEMA)
+    cached = {path: (size, mtime, _to_unsigned(h))
+              for path, size, mtime, h in index.execute("SELECT path, size, mtime, hash FROM phash")}
+
+    result = {}
+    todo = []
+    for path in image_paths:
+        try:
+            size, mtime = dataset_index.file_signature(path)
+        except OSError:
+            continue
+        entry = cached.get(path)
+        if entry and entry[0] == size and entry[1] == mtime:
+            result[path] = entry[2]
+        else:
+            todo.append((path, size, mtime))
+
+    def _hash(item):
+        try:
+            return item, dhash(item[0])
+        except Exception as e:
+            print(f"Warning: Could not hash {item[0]}: {e}")
+            return item, None
+
+    rows = []
+    if todo:
+        with ThreadPoolExecutor(max_workers=workers or min(32, (os.cpu_count() or 1) * 2)) as pool:
+            for (path, size, mtime), value in pool.map(_hash, todo):
+                if value is None:
+                    continue
+                result[path] = value
+                rows.append((path, size, mtime, _to_signed(value)))
+        index.executemany(
+            "INSERT OR REPLACE INTO phash (path, size, mtime, hash) VALUES (?, ?, ?, ?)", rows
+        )
+    return result, len(rows)
+
+
+def build_index(dataset_path, image_paths, workers=None):
+    """Up-to-date HashIndex for a dataset (rebuilt only when hashes changed)."""
+    hashes, updated = update_hashes(dataset_path, image_paths, workers=workers)
+    key = os.path.normcase(os.path.abspath(dataset_path))
+    paths = sorted(hashes)
+    signature = (len(paths), hash(tuple(paths)), updated)
+    cached = _memory_indexes.get(key)
+    if cached and cached[0] == signature and updated == 0:
+        metrics.cache_lookup("phash_index", True)
+        return cached[1], updated
+    metrics.cache_lookup("phash_index", False)
+    hash_index = HashIndex(paths, [hashes[p] for p in paths])
+    _memory_indexes[key] = (signature, hash_index)
+    return hash_index, updated
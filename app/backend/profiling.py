@@ -0,0 +1,259 @@
+"""
+On-demand request profiling with speedscope output.
+
+Profiling is opt-in through the LAMA_PROFILE environment variable:
+
+- unset / "off": the middleware is not installed at all (zero overhead)
+- "header": requests sent with "X-Lama-Profile: 1" are profiled
+- "all": every request is profiled
+
+A sampling profiler walks the stacks of the threads running the profiled
+request (sync routes run in the threadpool, not on the event loop) and writes
+a speedscope JSON file to LAMA_PROFILE_DIR. Open it at https://www.speedscope.app
+to get a flamegraph of where the request spent its time.
+"""
+import asyncio
+import contextvars
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+PROFILE_HEADER = b"x-lama-profile"
+RESULT_HEADER = b"x-lama-profile-file"
+
+# Sampler of the request being handled; threadpool workers see it in the
+# context they copied from the request
+_active_sampler = contextvars.ContextVar("lama_profile_sampler", default=None)
+
+
+def profile_mode():
+    mode = os.environ.get("LAMA_PROFILE", "off").strip().lower()
+    return mode if mode in ("header", "all") else "off"
+
+
+def profile_dir():
+    path = os.environ.get("LAMA_PROFILE_DIR") or os.path.join(tempfile.gettempdir(), "lama_profiles")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def max_profiles():
+    try:
+        return max(1, int(os.environ.get("LAMA_PROFILE_KEEP", "50")))
+    except ValueError:
+        return 50
+
+
+class StackSampler:
+    """
+    Samples the stacks of the threads running one request at a fixed interval:
+    the event loop thread while the request's task is the one running on it,
+    and threadpool workers running in the request's context. Other requests
+    handled at the same time are left out.
+    """
+
+    def __init__(self, interval=0.001):
+        self.interval = interval
+        self.samples = {}  # tuple of frame keys (root first) -> count
+        self._stop = threading.Event()
+        self._thread = None
+        self._loop = None
+        self._loop_thread = None
+        self._task = None
+
+    def _owns_worker(self, frame):
+        """Whether frame is the run loop of an anyio worker executing this request."""
+        code = frame.f_code
+        if code.co_name != "run" or "anyio" not in code.co_filename:
+            return False
+        # The worker keeps the context copied from the request in a local
+        context = frame.f_locals.get("context")
+        return isinstance(context, contextvars.Context) and context.get(_active_sampler) is self
+
+    def _sample(self):
+        own_id = threading.get_ident()
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id:
+                continue
+            owned = thread_id == self._loop_thread
+            if owned and asyncio.current_task(self._loop) is not self._task:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                if not owned:
+                    owned = self._owns_worker(frame)
+                stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+                frame = frame.f_back
+            if owned:
+                key = tuple(reversed(stack))
+                self.samples[key] = self.samples.get(key, 0) + 1
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._sample()
+            self._stop.wait(self.interval)
+
+    def start(self):
+        """Start sampling; called from the request's task on the event loop."""
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._task = asyncio.current_task()
+        self._thread = threading.Thread(target=self._run, name="lama-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+def to_speedscope(samples, name, interval):
+    """Convert sampled stacks to a speedscope 'sampled' profile."""
+    frames = []
+    frame_index = {}
+    sample_list = []
+    weights = []
+    for stack, count in samples.items():
+        indices = []
+        for func, filename, line in stack:
+            key = (func, filename, line)
+            if key not in frame_index:
+                frame_index[key] = len(frames)
+                frames.append({"name": func, "file": filename, "line": line})
+            indices.append(frame_index[key])
+        sample_list.append(indices)
+        weights.append(count * interval)
+    total = sum(weights)
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "shared": {"frames": frames},
+        "profiles": [{
+            "type": "sampled",
+            "name": name,
+            "unit": "seconds",
+            "startValue": 0,
+            "endValue": total,
+            "samples": sample_list,
+            "weights": weights,
+        }],
+        "name": name,
+        "exporter": "Lama Worlds Annotation Studio",
+    }
+
+
+def _prune(directory):
+    files = sorted(
+        (f for f in os.listdir(directory) if f.endswith(".speedscope.json")),
+        key=lambda f: os.path.getmtime(os.path.join(directory, f)),
+    )
+    for old in files[:-max_profiles()]:
+        try:
+            os.remove(os.path.join(directory, old))
+        except OSError:
+            pass
+
+
+def profile_filename(path):
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    route = path.strip("/").replace("/", "_") or "root"
+    # Requests to the same route within a millisecond must not share a file
+    return f"{stamp}-{int(time.time() * 1000) % 1000:03d}-{route}-{uuid.uuid4().hex[:8]}.speedscope.json"
+
+
+def write_profile(filename, sampler, method, path, status, duration):
+    directory = profile_dir()
+    profile = to_speedscope(sampler.samples, f"{method} {path}", sampler.interval)
+    profile["meta"] = {
+        "method": method,
+        "path": path,
+        "status": status,
+        "duration": duration,
+        "samples": sum(sampler.samples.values()),
+        "created_at": time.time(),
+    }
+    with open(os.path.join(directory, filename), "w", encoding="utf-8") as f:
+        json.dump(profile, f)
+    _prune(directory)
+    return filename
+
+
+def list_profiles(limit=50):
+    """Most recent profiles first, with their request metadata."""
+    directory = profile_dir()
+    files = sorted(
+        (f for f in os.listdir(directory) if f.endswith(".speedscope.json")),
+        key=lambda f: os.path.getmtime(os.path.join(directory, f)),
+        reverse=True,
+    )[:limit]
+    profiles = []
+    for filename in files:
+        full_path = os.path.join(directory, filename)
+        try:
+            with open(full_path, "r", encoding="utf-8") as f:
+                meta = json.load(f).get("meta", {})
+        except (OSError, ValueError):
+            meta = {}
+        profiles.append({**meta, "file": filename, "file_path": full_path, "size": os.path.getsize(full_path)})
+    return profiles
+
+
+def profile_path(filename):
+    """Resolve a profile file name inside the profile directory, or None."""
+    if os.path.basename(filename) != filename or not filename.endswith(".speedscope.json"):
+        return None
+    full_path = os.path.join(profile_dir(), filename)
+    return full_path if os.path.isfile(full_path) else None
+
+
+class ProfilingMiddleware:
+    """ASGI middleware profiling requests selected by LAMA_PROFILE."""
+
+    def __init__(self, app, mode="header", interval=0.001):
+        self.app = app
+        self.mode = mode
+        self.interval = interval
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._wants_profile(scope):
+            await self.app(scope, receive, send)
+            return
+
+        sampler = StackSampler(self.interval)
+        filename = profile_filename(scope.get("path", ""))
+        status_holder = {"status": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status_holder["status"] = message["status"]
+                # Tell the caller where the profile will be written once the request ends
+                message = {**message, "headers": [*message.get("headers", []), (RESULT_HEADER, filename.encode())]}
+            await send(message)
+
+        start = time.perf_counter()
+        token = _active_sampler.set(sampler)
+        sampler.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            sampler.stop()
+            _active_sampler.reset(token)
+            duration = time.perf_counter() - start
+            try:
+                # Serializing a large profile would otherwise stall every request on the loop
+                await asyncio.to_thread(write_profile, filename, sampler, scope.get("method", ""),
+                                        scope.get("path", ""), status_holder["status"], duration)
+            except OSError as e:
+                print(f"Warning: Could not write profile: {e}")
+
+    def _wants_profile(self, scope):
+        if self.mode == "all":
+            return True
+        for name, value in scope.get("headers", ()):
+            if name == PROFILE_HEADER:
+                return value not in (b"", b"0", b"false")
+        return False
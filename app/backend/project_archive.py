@@ -0,0 +1,307 @@
+"""
+Streaming project archives (.zip / .tar).
+
+Export writes images, labels, classes.txt and data.yaml straight into the
+archive, file by file in fixed-size blocks, so memory stays bounded and no
+second copy of the dataset is made on disk. JPEG/PNG files are stored
+as-is (they are already compressed); text files are deflated in zip
+archives. Labels of datasets kept in the annotation store are written from
+the store as <stem>.txt entries.
+
+Import reads the zip central directory (or the tar headers) to validate
+the project without extracting it, then streams the members into the
+destination one at a time, skipping files that are already there with the
+same size, so an interrupted import can simply be run again.
+
+Long transfers can run as background jobs whose progress is polled.
+"""
+import io
+import os
+import tarfile
+import threading
+import time
+import uuid
+import zipfile
+
+try:
+    from backend import annotation_store, shared_state, dataset_session
+except ImportError:
+    import annotation_store
+    import shared_state
+    import dataset_session
+
+ARCHIVE_EXTENSIONS = (".zip", ".tar")
+STORED_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+BLOCK_SIZE = 1024 * 1024
+# Members larger than this need zip64 headers, which must be requested before writing
+ZIP64_THRESHOLD = (1 << 31) - 1
+MAX_JOBS = 32
+# Seconds between progress writes to the shared state (multi-worker mode)
+JOB_FLUSH_INTERVAL = 0.5
+
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+
+def is_archive(path):
+    return path.lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+# Progress jobs
+
+def new_progress():
+    return {"status": "running", "files_done": 0, "files_total": 0, "bytes_done": 0, "bytes_total": 0,
+            "current": None, "started_at": time.time(), "finished_at": None, "result": None, "error": None}
+
+
+def start_job(fn, *args):
+    """Run fn(*args, progress=...) in a thread and return the job id."""
+    job_id = uuid.uuid4().hex
+    progress = new_progress()
+    with _jobs_lock:
+        _jobs[job_id] = progress
+        finished = [k for k, p in _jobs.items() if p["status"] != "running"]
+        for k in finished[:max(0, len(_jobs) - MAX_JOBS)]:
+            del _jobs[k]
+
+    shared = shared_state.multi_worker()
+    done = threading.Event()
+
+    def _run():
+        try:
+            progress["result"] = fn(*args, progress=progress)
+            progress["status"] = "done"
+        except Exception as e:
+            progress["error"] = str(e)
+            progress["status"] = "error"
+        progress["finished_at"] = time.time()
+        done.set()
+
+    def _flush():
+        # Progress is polled through whichever worker gets the request
+        while not done.wait(JOB_FLUSH_INTERVAL):
+            shared_state.put_job(job_id, dict(progress))
+        shared_state.put_job(job_id, dict(progress))
+        shared_state.trim_jobs(MAX_JOBS)
+
+    if shared:
+        shared_state.put_job(job_id, dict(progress))
+        threading.Thread(target=_flush, name=f"project-job-flush-{job_id[:8]}", daemon=True).start()
+    threading.Thread(target=_run, name=f"project-job-{job_id[:8]}", daemon=True).start()
+    return job_id
+
+
+def get_job(job_id):
+    progress = _jobs.get(job_id)
+    if progress is None and shared_state.multi_worker():
+        progress = shared_state.get_job(job_id)
+    return progress
+
+
+# Export
+
+def collect_project_files(dataset_path):
+    """
+    (archive name, source path or None, size) for every file of a project.
+    Entries with a None source are label files generated from the annotation store.
+    """
+    entries = []
+    images_dir = os.path.join(dataset_path, "images")
+    labels_dir = os.path.join(dataset_path, "labels")
+    if os.path.isdir(images_dir):
+        for root, dirs, files in os.walk(images_dir):
+            dirs.sort()
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                arcname = "images/" + os.path.relpath(path, images_dir).replace(os.sep, "/")
+                entries.append((arcname, path, os.path.getsize(path)))
+    else:
+        # Flat structure - images from root
+        for entry in sorted(os.scandir(dataset_path), key=lambda e: e.name):
+            if entry.is_file() and dataset_session.is_image_name(entry.name):
+                entries.append(("images/" + entry.name, entry.path, entry.stat().st_size))
+
+    store = annotation_store.get_store(dataset_path)
+    if store:
+        for stem in store.stems():
+            entries.append((f"labels/{stem}.txt", None, 0))
+    else:
+        source_dir = labels_dir if os.path.isdir(labels_dir) else dataset_path
+        for entry in sorted(os.scandir(source_dir), key=lambda e: e.name):
+            if entry.is_file() and entry.name.endswith(".txt") and entry.name != "classes.txt":
+                entries.append(("labels/" + entry.name, entry.path, entry.stat().st_size))
+
+    for name in sorted(os.listdir(dataset_path)):
+        if name == "classes.txt" or name.lower().endswith((".yaml", ".yml")):
+            path = os.path.join(dataset_path, name)
+            if os.path.isfile(path):
+                entries.append((name, path, os.path.getsize(path)))
+    return entries
+
+
+def _copy_blocks(src, dst, progress):
+    while True:
+        block = src.read(BLOCK_SIZE)
+        if not block:
+            break
+        dst.write(block)
+        progress["bytes_done"] += len(block)
+
+
+def export_archive(dataset_path, archive_path, progress=None):
+    """Stream a project into a .zip or .tar archive. Returns the summary dict."""
+    progress = progress if progress is not None else new_progress()
+    entries = collect_project_files(dataset_path)
+    progress["files_total"] = len(entries)
+    progress["bytes_total"] = sum(size for _, _, size in entries)
+    store = annotation_store.get_store(dataset_path)
+
+    os.makedirs(os.path.dirname(os.path.abspath(archive_path)), exist_ok=True)
+    tmp_path = archive_path + ".part"
+    try:
+        if archive_path.lower().endswith(".zip"):
+            with zipfile.ZipFile(tmp_path, "w", allowZip64=True) as zf:
+                for arcname, path, size in entries:
+                    progress["current"] = arcname
+                    compress = zipfile.ZIP_STORED if arcname.lower().endswith(STORED_EXTENSIONS) else zipfile.ZIP_DEFLATED
+                    if path is None:
+                        content = "".join(line + "\n" for line in store.read_lines(arcname[7:-4]))
+                        zf.writestr(zipfile.ZipInfo(arcname, time.localtime()[:6]), content, compress_type=compress)
+                    else:
+                        info = zipfile.ZipInfo.from_file(path, arcname)
+                        info.compress_type = compress
+                        with open(path, "rb") as src, zf.open(info, "w", force_zip64=size > ZIP64_THRESHOLD) as dst:
+                            _copy_blocks(src, dst, progress)
+                    progress["files_done"] += 1
+        else:
+            with tarfile.open(tmp_path, "w") as tf:
+                for arcname, path, _ in entries:
+                    progress["current"] = arcname
+                    if path is None:
+                        content = "".join(line + "\n" for line in store.read_lines(arcname[7:-4])).encode("utf-8")
+                        info = tarfile.TarInfo(arcname)
+                        info.size = len(content)
+                        info.mtime = time.time()
+                        tf.addfile(info, io.BytesIO(content))
+                    else:
+                        info = tf.gettarinfo(path, arcname)
+                        with open(path, "rb") as src:
+                            tf.addfile(info, ProgressReader(src, progress))
+                    progress["files_done"] += 1
+        os.replace(tmp_path, archive_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    progress["current"] = None
+    return {
+        "output_path": archive_path,
+        "files": progress["files_done"],
+        "bytes": os.path.getsize(archive_path),
+    }
+
+
+class ProgressReader:
+    """File wrapper counting bytes read by tarfile into the progress dict."""
+
+    def __init__(self, fileobj, progress):
+        self.fileobj = fileobj
+        self.progress = progress
+
+    def read(self, size=-1):
+        block = self.fileobj.read(size)
+        self.progress["bytes_done"] += len(block)
+        return block
+
+
+# Import
+
+def _safe_name(name):
+    """Reject absolute paths and parent references in archive member names."""
+    normalized = name.replace("\\", "/")
+    parts = [p for p in normalized.split("/") if p not in ("", ".")]
+    if normalized.startswith("/") or ".." in parts or (parts and ":" in parts[0]):
+        raise ValueError(f"Unsafe path in archive: {name}")
+    return "/".join(parts)
+
+
+def list_archive(archive_path):
+    """(name, size) of every file member, read from the zip central directory or tar headers."""
+    if archive_path.lower().endswith(".zip"):
+        with zipfile.ZipFile(archive_path) as zf:
+            return [(_safe_name(i.filename), i.file_size) for i in zf.infolist() if not i.is_dir()]
+    with tarfile.open(archive_path, "r:*") as tf:
+        return [(_safe_name(m.name), m.size) for m in tf.getmembers() if m.isfile()]
+
+
+def archive_summary(members):
+    names = [name for name, _ in members]
+    # Projects may be wrapped in a single top-level folder
+    prefix = ""
+    tops = {name.split("/", 1)[0] for name in names if "/" in name}
+    if len(tops) == 1 and not any("/" not in name for name in names):
+        prefix = tops.pop() + "/"
+    inner = [name[len(prefix):] for name in names]
+    return {
+        "prefix": prefix,
+        "images": sum(1 for n in inner if dataset_session.is_image_name(n.rsplit("/", 1)[-1])),
+        "labels": sum(1 for n in inner if n.startswith("labels/") and n.endswith(".txt")),
+        "has_classes": "classes.txt" in inner,
+        "files": len(names),
+        "bytes": sum(size for _, size in members),
+    }
+
+
+def import_archive(archive_path, dest_dir, progress=None):
+    """Stream the members of a project archive into dest_dir. Returns the summary dict."""
+    progress = progress if progress is not None else new_progress()
+    members = list_archive(archive_path)
+    summary = archive_summary(members)
+    if summary["images"] == 0:
+        raise ValueError("Archive does not contain images")
+    prefix = summary["prefix"]
+    progress["files_total"] = len(members)
+    progress["bytes_total"] = summary["bytes"]
+    skipped = 0
+
+    def target(name):
+        return os.path.join(dest_dir, *name[len(prefix):].split("/"))
+
+    def extract(name, size, open_member):
+        nonlocal skipped
+        path = target(name)
+        progress["current"] = name
+        if os.path.exists(path) and os.path.getsize(path) == size:
+            skipped += 1
+            progress["bytes_done"] += size
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = path + ".part"
+            with open_member() as src, open(tmp_path, "wb") as dst:
+                _copy_blocks(src, dst, progress)
+            os.replace(tmp_path, path)
+        progress["files_done"] += 1
+
+    if archive_path.lower().endswith(".zip"):
+        with zipfile.ZipFile(archive_path) as zf:
+            for info in zf.infolist():
+                if not info.is_dir():
+                    extract(_safe_name(info.filename), info.file_size, lambda info=info: zf.open(info))
+    else:
+        # Sequential read: tar members are extracted in archive order in one pass
+        with tarfile.open(archive_path, "r:*") as tf:
+            for member in tf:
+                if member.isfile():
+                    extract(_safe_name(member.name), member.size, lambda member=member: tf.extractfile(member))
+
+    progress["current"] = None
+    return {"dataset_path": dest_dir, "skipped_existing": skipped, **summary}
+
+
+def default_import_dir(archive_path):
+    base = os.path.basename(archive_path)
+    for ext in ARCHIVE_EXTENSIONS:
+        if base.lower().endswith(ext):
+            base = base[:-len(ext)]
+    return os.path.join(os.path.dirname(os.path.abspath(archive_path)), base)
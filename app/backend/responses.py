@@ -0,0 +1,49 @@
+"""
+Fast JSON responses for large listings.
+
+FastJSONResponse encodes with orjson when it is installed and falls back to
+the standard library encoder with compact separators. Listing routes return
+it directly, so FastAPI does not run jsonable_encoder over hundreds of
+thousands of plain strings. Compression is negotiated by the GZip
+middleware in main.py.
+"""
+import json
+import os
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse for payloads made of plain dicts, lists, strings and numbers."""
+
+    def render(self, content):
+        if orjson is not None:
+            return orjson.dumps(content)
+        return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def relative_paths(paths, base_dir):
+    """
+    Paths relative to base_dir, for compact listings that send base_dir once.
+    Paths outside base_dir are kept absolute.
+    """
+    prefix = os.path.join(os.path.abspath(base_dir), "")
+    cut = len(prefix)
+    return [path[cut:] if path.startswith(prefix) else path for path in paths]
+
+
+def listing(key, paths, base_dir, compact, **extra):
+    """
+    Response for a list of image paths. In compact mode the paths are sent
+    relative to "base_dir" (sent once, with the path separator "sep").
+    """
+    if compact:
+        base = os.path.abspath(base_dir)
+        return FastJSONResponse({key: relative_paths(paths, base), "base_dir": base, "sep": os.sep,
+                                 "compact": True, **extra})
+    return FastJSONResponse({key: paths, **extra})
@@ -0,0 +1,668 @@
+"""
+Server-side search over images, boxes, tags and comments.
+
+Every image of a dataset gets one row in the dataset index with its box
+count and size, one row per box with class id, pixel area and aspect ratio
+(B-tree indexed), and one FTS5 row with its file name, the class names of
+its boxes and the tags and comments the UI attached to it. Searches run as
+SQL over these tables and return one page of image ids and names, so the
+frontend never has to load every label to filter.
+
+Rows are keyed by the image (size, mtime) and the label signature; a full
+refresh only restats the images of the dataset session's (recursive)
+listing and re-reads those that changed. Image names are relative to the
+images folder; labels of images in subfolders are read from beside the
+image, where saves write them. Saves mark
+their image dirty so the next search re-indexes just those images.
+
+The same refresh keeps the review queue: one row per image with an indexed
+key for each ordering in QUEUE_ORDERS (unannotated first, lowest mean box
+confidence, rarest class, oldest label edit). next_images() is a keyset
+lookup on one of those indexes, so the next image to work on costs
+O(log n) however large the dataset is. The rarest-class key is the rank of
+the image's least common class (by box count); per-class box totals are
+updated incrementally, and when the class ranking changes only the images
+holding a class whose rank moved are re-ranked.
+"""
+import os
+
+try:
+    from backend import dataset_index, annotation_store, subsystems, metrics, image_ids, dataset_session
+except ImportError:
+    import dataset_index
+    import image_ids
+    import dataset_session
+    import annotation_store
+    import subsystems
+    import metrics
+
+MAX_PAGE_SIZE = 5000
+BULK_BOX_ROWS = 100000
+# Box filters matching more rows than this are checked per image instead of via the index
+SELECTIVE_BOX_ROWS = 20000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS search_images (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    stem TEXT NOT NULL,
+    image_size INTEGER NOT NULL,
+    image_mtime REAL NOT NULL,
+    label_sig TEXT NOT NULL,
+    width INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    box_count INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS search_images_stem ON search_images(stem);
+CREATE INDEX IF NOT EXISTS search_images_boxes ON search_images(box_count);
+CREATE TABLE IF NOT EXISTS search_boxes (
+    image_id INTEGER NOT NULL,
+    idx INTEGER NOT NULL,
+    class_id INTEGER NOT NULL,
+    area REAL NOT NULL,
+    aspect REAL NOT NULL,
+    PRIMARY KEY (image_id, idx)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS search_metadata (
+    stem TEXT PRIMARY KEY,
+    tags TEXT NOT NULL,
+    comments TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS search_tags (
+    tag TEXT NOT NULL,
+    stem TEXT NOT NULL,
+    PRIMARY KEY (tag, stem)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS search_dirty (
+    stem TEXT PRIMARY KEY,
+    claimed INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS search_state (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS search_text USING fts5(name, classes, tags, comments);
+CREATE TABLE IF NOT EXISTS search_queue (
+    image_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    box_count INTEGER NOT NULL,
+    annotated INTEGER NOT NULL,
+    mean_conf REAL,
+    rare_class INTEGER,
+    rare_rank INTEGER,
+    edited_at REAL
+);
+CREATE TABLE IF NOT EXISTS search_class_boxes (
+    class_id INTEGER PRIMARY KEY,
+    boxes INTEGER NOT NULL
+);
+"""
+
+# Review queue orderings: name -> (key column, rows taking part)
+QUEUE_ORDERS = {
+    "unannotated": ("annotated", None),  # every image, unannotated ones first
+    "low_confidence": ("mean_conf", "mean_conf IS NOT NULL"),
+    "rare_class": ("rare_rank", "rare_rank IS NOT NULL"),
+    "oldest_edit": ("edited_at", "edited_at IS NOT NULL"),
+}
+MAX_QUEUE_COUNT = 1000
+
+# Secondary indexes on search_boxes (they also cover image_id, the primary key)
+_BOX_INDEXES = {
+    "search_boxes_class": "class_id, area",
+    "search_boxes_area": "area",
+    "search_boxes_aspect": "aspect",
+}
+_SCHEMA += "".join(f"CREATE INDEX IF NOT EXISTS {name} ON search_boxes({columns});\n"
+                   for name, columns in _BOX_INDEXES.items())
+_SCHEMA += "".join(f"CREATE INDEX IF NOT EXISTS search_queue_{column} ON search_queue({column}, name);\n"
+                   for column, _ in QUEUE_ORDERS.values())
+
+_upgraded = set()  # index files whose search tables were checked for missing columns
+
+
+def _index(dataset_path):
+    index = dataset_index.get_index(dataset_path)
+    index.ensure_schema("search_index", _SCHEMA)
+    if index.path not in _upgraded:
+        with index.lock:
+            columns = [row[1] for row in index.conn.execute("PRAGMA table_info(search_dirty)")]
+            if "claimed" not in columns:
+                # Indexes created before dirty marks were claimed by the refresh
+                index.conn.execute("ALTER TABLE search_dirty ADD COLUMN claimed INTEGER NOT NULL DEFAULT 0")
+        _upgraded.add(index.path)
+    return index
+
+
+def mark_dirty(dataset_path, stem):
+    """
+    Note that an image's labels changed; it is re-indexed before the next
+    search. Marks live in the dataset index, so every worker process sees them.
+    """
+    # A save during a refresh unclaims the mark, so the image is indexed again next time
+    _index(dataset_path).execute(
+        "INSERT INTO search_dirty (stem) VALUES (?) ON CONFLICT(stem) DO UPDATE SET claimed = 0", (stem,)
+    )
+
+
+def invalidate(dataset_path):
+    """Force a full refresh before the next search (after bulk label changes)."""
+    _index(dataset_path).execute("DELETE FROM search_state WHERE key = 'built'")
+
+
+def _layout(dataset_path):
+    """(images_dir, labels_dir) as resolved by the dataset session."""
+    session = dataset_session.get_session(dataset_path)
+    return session.images_dir, session.labels_dir
+
+
+def _class_names(dataset_path):
+    path = os.path.join(dataset_path, "classes.txt")
+    if not os.path.exists(path):
+        return [], ""
+    st = os.stat(path)
+    with open(path, 'r', encoding='utf-8') as f:
+        names = [line.strip() for line in f.readlines()]
+    return names, f"{st.st_size}:{st.st_mtime}"
+
+
+def _read_lines(store, labels_dir, stem):
+    if store:
+        return store.read_lines(stem)
+    path = os.path.join(labels_dir, stem + ".txt")
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read().splitlines()
+    except UnicodeDecodeError:
+        with open(path, 'r', encoding='latin-1') as f:
+            return f.read().splitlines()
+    except FileNotFoundError:
+        return []
+
+
+def _boxes(lines, width, height):
+    """(class_id, pixel area, aspect ratio, confidence) of every valid line."""
+    boxes = []
+    for line in lines:
+        parsed = annotation_store.parse_line(line)
+        if parsed is None:
+            continue
+        class_id, _, _, w, h, conf = parsed
+        w_px, h_px = abs(w) * width, abs(h) * height
+        boxes.append((class_id, w_px * h_px, w_px / h_px if h_px > 0 else 0.0, conf))
+    return boxes
+
+
+def _edited_at(store, label_sig):
+    """Time of the last label save from its signature (store version or file size:mtime_ns)."""
+    if not label_sig:
+        return None
+    try:
+        return float(label_sig) if store else int(label_sig.split(":")[1]) / 1e9
+    except (ValueError, IndexError):
+        return None
+
+
+def _rank_classes(cur, classes_by_image):
+    """
+    Set the rarest-class key of the given images ({image_id: class ids}).
+    When the class ranking (fewest boxes first) changed, the images holding a
+    class whose rank moved are re-ranked too; every other key stays valid.
+    """
+    ranking = [row[0] for row in cur.execute(
+        "SELECT class_id FROM search_class_boxes WHERE boxes > 0 ORDER BY boxes, class_id").fetchall()]
+    rank = {class_id: i for i, class_id in enumerate(ranking)}
+    order = ",".join(map(str, ranking))
+    previous = cur.execute("SELECT value FROM search_state WHERE key = 'rare_order'").fetchall()
+    if previous != [(order,)]:
+        old_ranking = [int(c) for c in previous[0][0].split(",") if c] if previous else []
+        old_rank = {class_id: i for i, class_id in enumerate(old_ranking)}
+        moved = [class_id for class_id in set(rank) | set(old_rank) if rank.get(class_id) != old_rank.get(class_id)]
+        cur.execute("DROP TABLE IF EXISTS temp.queue_rank")
+        cur.execute("CREATE TEMP TABLE queue_rank (class_id INTEGER PRIMARY KEY, rank INTEGER NOT NULL)")
+        cur.executemany("INSERT INTO queue_rank (class_id, rank) VALUES (?, ?)", list(rank.items()))
+        for k in range(0, len(moved), 500):
+            part = moved[k:k + 500]
+            cur.execute("UPDATE search_queue SET (rare_class, rare_rank) = ("
+                        "SELECT r.class_id, r.rank FROM search_boxes b JOIN queue_rank r ON r.class_id = b.class_id "
+                        "WHERE b.image_id = search_queue.image_id ORDER BY r.rank LIMIT 1) "
+                        "WHERE image_id IN (SELECT image_id FROM search_boxes "
+                        f"WHERE class_id IN ({','.join('?' * len(part))}))", part)
+        cur.execute("DROP TABLE temp.queue_rank")
+        cur.execute("INSERT OR REPLACE INTO search_state (key, value) VALUES ('rare_order', ?)", (order,))
+    rows = []
+    for image_id, class_ids in classes_by_image.items():
+        rare = min(class_ids, key=rank.__getitem__) if class_ids else None
+        rows.append((rare, rank[rare] if class_ids else None, image_id))
+    cur.executemany("UPDATE search_queue SET rare_class = ?, rare_rank = ? WHERE image_id = ?", rows)
+
+
+def _text_row(image_id, name, class_ids, names, tags, comments):
+    classes = " ".join(names[c] if 0 <= c < len(names) and names[c] else str(c) for c in sorted(set(class_ids)))
+    return image_id, name, classes, tags, comments
+
+
+def _name(images_dir, path):
+    """Name of an image in the index: its path relative to the images folder."""
+    if not os.path.isabs(path):
+        return path
+    prefix = os.path.join(os.path.abspath(images_dir), "")
+    return path[len(prefix):] if path.startswith(prefix) else os.path.relpath(path, prefix)
+
+
+def _label_signatures(store, labels_dir, stems=None):
+    """{stem: signature} of the labels, from the store versions or label file stats."""
+    if store:
+        if stems is None:
+            return store.versions()
+        return {stem: store.version(stem) for stem in stems}
+    signatures = {}
+    if stems is None:
+        if os.path.isdir(labels_dir):
+            for entry in os.scandir(labels_dir):
+                if entry.name.endswith(".txt") and entry.name != "classes.txt" and entry.is_file():
+                    st = entry.stat()
+                    signatures[entry.name[:-4]] = f"{st.st_size}:{st.st_mtime_ns}"
+        return signatures
+    for stem in stems:
+        signature = _label_signature(os.path.join(labels_dir, stem + ".txt"))
+        if signature:
+            signatures[stem] = signature
+    return signatures
+
+
+def _label_signature(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return ""
+    return f"{st.st_size}:{st.st_mtime_ns}"
+
+
+def _label_dir(images_dir, labels_dir, name):
+    """Folder of an image's label file, as image_ids.label_location resolves it."""
+    folder = os.path.dirname(name)
+    return os.path.join(images_dir, folder) if folder else labels_dir
+
+
+def refresh(dataset_path, stems=None):
+    """
+    Bring the index up to date. With stems, only those images are checked;
+    otherwise the whole dataset is restatted. Returns the number of
+    re-indexed images.
+    """
+    index = _index(dataset_path)
+    images_dir, labels_dir = _layout(dataset_path)
+    store = annotation_store.get_store(dataset_path)
+    names, classes_sig = _class_names(dataset_path)
+
+    if stems is None:
+        cached = index.execute("SELECT id, name, stem, image_size, image_mtime, label_sig, width, height "
+                               "FROM search_images")
+        files = {}
+        prefix = len(os.path.join(os.path.abspath(images_dir), ""))
+        for path in dataset_session.get_session(dataset_path).image_list("search_index"):
+            try:
+                # Listed paths are absolute paths inside images_dir
+                files[path[prefix:]] = dataset_index.file_signature(path)
+            except OSError:
+                pass
+    else:
+        stems = list(stems)
+        cached = []
+        for i in range(0, len(stems), 500):
+            part = stems[i:i + 500]
+            cached.extend(index.execute(
+                "SELECT id, name, stem, image_size, image_mtime, label_sig, width, height FROM search_images "
+                f"WHERE stem IN ({','.join('?' * len(part))})", part
+            ))
+        files = {}
+        for row in cached:
+            try:
+                files[row[1]] = dataset_index.file_signature(os.path.join(images_dir, row[1]))
+            except OSError:
+                pass
+        # Images saved before they were ever indexed, possibly in a subfolder
+        missing = set(stems) - {row[2] for row in cached}
+        if missing:
+            for path in dataset_session.get_session(dataset_path).image_list("search_index"):
+                stem = os.path.splitext(os.path.basename(path))[0]
+                if stem in missing:
+                    missing.discard(stem)
+                    try:
+                        files[_name(images_dir, path)] = dataset_index.file_signature(path)
+                    except OSError:
+                        pass
+    labels = _label_signatures(store, labels_dir, stems)
+
+    by_name = {row[1]: row for row in cached}
+    removed = [row[0] for name, row in by_name.items() if name not in files]
+    changed = []
+    for name, (size, mtime) in sorted(files.items()):
+        stem = os.path.splitext(os.path.basename(name))[0]
+        if store or not os.path.dirname(name):
+            label_sig = labels.get(stem, "")
+        else:
+            label_sig = _label_signature(os.path.join(_label_dir(images_dir, labels_dir, name), stem + ".txt"))
+        row = by_name.get(name)
+        # Dirty images are always re-read: a same-size save can keep the old signature
+        if stems is not None or row is None or row[3] != size or row[4] != mtime or row[5] != label_sig:
+            changed.append((name, stem, size, mtime, label_sig, row))
+
+    image_rows, box_rows, text_rows, queue_rows = [], [], [], []
+    if changed:
+        Image = subsystems.image_module()
+        metadata = _metadata(index, [c[1] for c in changed])
+        # New images get their stable id, so search results can be loaded and saved by id
+        new_names = [name for name, _, _, _, _, row in changed if row is None]
+        assigned = dict(zip(new_names, image_ids.get_registry(dataset_path).assign(
+            [os.path.join(images_dir, name) for name in new_names])))
+        for name, stem, size, mtime, label_sig, row in changed:
+            if row is not None and row[3] == size and row[4] == mtime:
+                width, height = row[6], row[7]
+            else:
+                try:
+                    metrics.IMAGE_OPENS.inc("search_index")
+                    with Image.open(os.path.join(images_dir, name)) as img:
+                        width, height = img.size
+                except Exception:
+                    width, height = 0, 0
+            image_id = row[0] if row is not None else assigned[name]
+            label_lines = _read_lines(store, _label_dir(images_dir, labels_dir, name), stem) if label_sig else []
+            boxes = _boxes(label_lines, width, height)
+            image_rows.append((image_id, name, stem, size, mtime, label_sig, width, height, len(boxes)))
+            box_rows.extend((image_id, idx, class_id, area, aspect)
+                            for idx, (class_id, area, aspect, _) in enumerate(boxes))
+            tags, comments = metadata.get(stem, ("", ""))
+            text_rows.append(_text_row(image_id, name, [b[0] for b in boxes], names, tags, comments))
+            mean_conf = sum(b[3] for b in boxes) / len(boxes) if boxes else None
+            queue_rows.append((image_id, name, len(boxes), int(bool(boxes)), mean_conf,
+                               _edited_at(store, label_sig)))
+
+    full_text_rebuild = index.execute("SELECT value FROM search_state WHERE key = 'classes'") != [(classes_sig,)]
+    if not image_rows and not removed and not full_text_rebuild:
+        return 0
+
+    with index.lock:
+        cur = index.conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            stale = [(image_id,) for image_id in removed] + [(row[0],) for _, _, _, _, _, row in changed if row]
+            if stems is not None:
+                # Box totals per class: the old boxes of re-indexed images are taken out
+                for i in range(0, len(stale), 500):
+                    part = [image_id for image_id, in stale[i:i + 500]]
+                    cur.executemany(
+                        "UPDATE search_class_boxes SET boxes = boxes - ? WHERE class_id = ?",
+                        [(count, class_id) for class_id, count in cur.execute(
+                            "SELECT class_id, COUNT(*) FROM search_boxes "
+                            f"WHERE image_id IN ({','.join('?' * len(part))}) GROUP BY class_id", part).fetchall()])
+            cur.executemany("DELETE FROM search_queue WHERE image_id = ?", stale)
+            cur.executemany("DELETE FROM search_images WHERE id = ?", stale)
+            cur.executemany("DELETE FROM search_boxes WHERE image_id = ?", stale)
+            cur.executemany("DELETE FROM search_text WHERE rowid = ?", stale)
+            cur.executemany("INSERT INTO search_images (id, name, stem, image_size, image_mtime, label_sig, "
+                            "width, height, box_count) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", image_rows)
+            # Large (initial) builds insert first and sort the box indexes once afterwards
+            bulk = len(box_rows) > BULK_BOX_ROWS
+            if bulk:
+                for name in _BOX_INDEXES:
+                    cur.execute(f"DROP INDEX IF EXISTS {name}")
+            cur.executemany("INSERT INTO search_boxes (image_id, idx, class_id, area, aspect) VALUES (?, ?, ?, ?, ?)",
+                            box_rows)
+            if bulk:
+                for name, columns in _BOX_INDEXES.items():
+                    cur.execute(f"CREATE INDEX IF NOT EXISTS {name} ON search_boxes({columns})")
+            cur.executemany("INSERT INTO search_queue (image_id, name, box_count, annotated, mean_conf, edited_at) "
+                            "VALUES (?, ?, ?, ?, ?, ?)", queue_rows)
+            if stems is None:
+                cur.execute("DELETE FROM search_class_boxes")
+                cur.execute("INSERT INTO search_class_boxes (class_id, boxes) "
+                            "SELECT class_id, COUNT(*) FROM search_boxes GROUP BY class_id")
+            else:
+                added = {}
+                for _, _, class_id, _, _ in box_rows:
+                    added[class_id] = added.get(class_id, 0) + 1
+                cur.executemany("INSERT INTO search_class_boxes (class_id, boxes) VALUES (?, ?) "
+                                "ON CONFLICT(class_id) DO UPDATE SET boxes = boxes + excluded.boxes",
+                                list(added.items()))
+            classes_by_image = {}
+            for image_id, _, class_id, _, _ in box_rows:
+                classes_by_image.setdefault(image_id, set()).add(class_id)
+            _rank_classes(cur, {row[0]: classes_by_image.get(row[0], ()) for row in queue_rows})
+            if full_text_rebuild:
+                # Class names changed: the class column of every text row is rebuilt
+                _rebuild_text(cur, names)
+                cur.execute("INSERT OR REPLACE INTO search_state (key, value) VALUES ('classes', ?)",
+                            (classes_sig,))
+            else:
+                cur.executemany("INSERT INTO search_text (rowid, name, classes, tags, comments) "
+                                "VALUES (?, ?, ?, ?, ?)", text_rows)
+            cur.execute("COMMIT")
+        except Exception:
+            cur.execute("ROLLBACK")
+            raise
+    return len(image_rows)
+
+
+def _metadata(index, stems):
+    rows = []
+    for i in range(0, len(stems), 500):
+        part = stems[i:i + 500]
+        rows.extend(index.execute(
+            f"SELECT stem, tags, comments FROM search_metadata WHERE stem IN ({','.join('?' * len(part))})", part
+        ))
+    return {stem: (tags, comments) for stem, tags, comments in rows}
+
+
+def _rebuild_text(cur, names):
+    class_ids = {}
+    for image_id, class_id in cur.execute("SELECT DISTINCT image_id, class_id FROM search_boxes").fetchall():
+        class_ids.setdefault(image_id, []).append(class_id)
+    metadata = {stem: (tags, comments)
+                for stem, tags, comments in cur.execute("SELECT stem, tags, comments FROM search_metadata")}
+    rows = [_text_row(image_id, name, class_ids.get(image_id, []), names, *metadata.get(stem, ("", "")))
+            for image_id, name, stem in cur.execute("SELECT id, name, stem FROM search_images").fetchall()]
+    cur.execute("DELETE FROM search_text")
+    cur.executemany("INSERT INTO search_text (rowid, name, classes, tags, comments) VALUES (?, ?, ?, ?, ?)", rows)
+
+
+def set_metadata(dataset_path, items):
+    """
+    Store the tags and comments of images ({image name or path: {"tags": [...],
+    "comments": [...]}}); they become searchable right away. A missing (None)
+    entry keeps the stored value. Returns the count.
+    """
+    index = _index(dataset_path)
+    names, _ = _class_names(dataset_path)
+    stems = {os.path.splitext(os.path.basename(image))[0]: meta for image, meta in items.items()}
+    existing = _metadata(index, list(stems))
+    meta_rows, tag_rows = [], []
+    for stem, meta in stems.items():
+        old_tags, old_comments = existing.get(stem, ("", ""))
+        if meta.get("tags") is None:
+            tags = old_tags.split("\n") if old_tags else []
+        else:
+            tags = [str(t).strip() for t in meta["tags"] if str(t).strip()]
+        if meta.get("comments") is None:
+            comments = old_comments
+        else:
+            comments = "\n".join(str(c).strip() for c in meta["comments"] if str(c).strip())
+        meta_rows.append((stem, "\n".join(tags), comments))
+        tag_rows.extend((tag, stem) for tag in set(tags))
+
+    with index.lock:
+        cur = index.conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            cur.executemany("DELETE FROM search_tags WHERE stem = ?", [(s,) for s in stems])
+            cur.executemany("INSERT OR REPLACE INTO search_metadata (stem, tags, comments) VALUES (?, ?, ?)",
+                            meta_rows)
+            cur.executemany("INSERT INTO search_tags (tag, stem) VALUES (?, ?)", tag_rows)
+            for stem, tags, comments in meta_rows:
+                for image_id, name in cur.execute("SELECT id, name FROM search_images WHERE stem = ?",
+                                                  (stem,)).fetchall():
+                    class_ids = [row[0] for row in cur.execute(
+                        "SELECT DISTINCT class_id FROM search_boxes WHERE image_id = ?", (image_id,))]
+                    cur.execute("DELETE FROM search_text WHERE rowid = ?", (image_id,))
+                    cur.execute("INSERT INTO search_text (rowid, name, classes, tags, comments) "
+                                "VALUES (?, ?, ?, ?, ?)", _text_row(image_id, name, class_ids, names, tags, comments))
+            cur.execute("COMMIT")
+        except Exception:
+            cur.execute("ROLLBACK")
+            raise
+    return len(meta_rows)
+
+
+def match_expression(query):
+    """FTS5 expression for a free-text query: every word must match as a prefix."""
+    terms = [term.replace('"', '""') for term in query.split()]
+    return " AND ".join(f'"{term}"*' for term in terms)
+
+
+def ensure_fresh(dataset_path, full=False):
+    """Index the dataset on first use (or when full is set), otherwise only the images saved since."""
+    index = _index(dataset_path)
+    with index.lock:
+        # Marks are claimed here and only deleted once the refresh succeeded, so
+        # a failed refresh leaves them for the next call
+        cur = index.conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            stems = {row[0] for row in cur.execute("SELECT stem FROM search_dirty").fetchall()}
+            cur.execute("UPDATE search_dirty SET claimed = 1")
+            cur.execute("COMMIT")
+        except Exception:
+            cur.execute("ROLLBACK")
+            raise
+    built = index.execute("SELECT value FROM search_state WHERE key = 'built'")
+    if built and index.execute("SELECT value FROM search_state WHERE key = 'ids'") != [("image_ids+queue",)]:
+        # Indexes built before images had stable ids or before the review queue are rebuilt once
+        with index.lock:
+            for table in ("search_images", "search_boxes", "search_text", "search_queue", "search_class_boxes"):
+                index.execute(f"DELETE FROM {table}")
+            index.execute("DELETE FROM search_state WHERE key = 'rare_order'")
+        built = []
+    index.execute("INSERT OR REPLACE INTO search_state (key, value) VALUES ('ids', 'image_ids+queue')")
+    if full or not built:
+        count = refresh(dataset_path)
+        index.execute("INSERT OR REPLACE INTO search_state (key, value) VALUES ('built', '1')")
+    elif stems:
+        count = refresh(dataset_path, stems)
+    else:
+        return 0
+    # Marks set again by a save during the refresh were unclaimed and stay
+    index.executemany("DELETE FROM search_dirty WHERE stem = ? AND claimed = 1", [(stem,) for stem in stems])
+    return count
+
+
+def search(dataset_path, query=None, class_id=None, min_area=None, max_area=None, min_aspect=None,
+           max_aspect=None, min_boxes=None, max_boxes=None, annotated=None, tag=None, page=0, page_size=500):
+    """
+    One page of images matching every given filter. Box filters (class, area,
+    aspect) must hold for the same box. Returns {"total", "ids", "names"}.
+    """
+    index = _index(dataset_path)
+    where, params = [], []
+    if query and query.strip():
+        where.append("i.id IN (SELECT rowid FROM search_text WHERE search_text MATCH ?)")
+        params.append(match_expression(query))
+
+    box_where, box_params = [], []
+    for column, op, value in (("class_id", "=", class_id), ("area", ">=", min_area), ("area", "<=", max_area),
+                              ("aspect", ">=", min_aspect), ("aspect", "<=", max_aspect)):
+        if value is not None:
+            box_where.append((column, op))
+            box_params.append(value)
+    if box_where:
+        box_clause = " AND ".join(f"{column} {op} ?" for column, op in box_where)
+        # Selective filters are answered from the box indexes; broad ones stop at the first matching box per image
+        probe = index.execute(
+            f"SELECT COUNT(*) FROM (SELECT 1 FROM search_boxes WHERE {box_clause} LIMIT {SELECTIVE_BOX_ROWS})",
+            box_params
+        )[0][0]
+        if probe < SELECTIVE_BOX_ROWS:
+            where.append(f"i.id IN (SELECT image_id FROM search_boxes WHERE {box_clause})")
+        else:
+            # Unary + keeps the planner on the primary key (image_id) instead of the box indexes
+            per_image = " AND ".join(f"+b.{column} {op} ?" for column, op in box_where)
+            where.append(f"EXISTS (SELECT 1 FROM search_boxes b WHERE b.image_id = i.id AND {per_image})")
+        params.extend(box_params)
+
+    if min_boxes is not None:
+        where.append("i.box_count >= ?")
+        params.append(min_boxes)
+    if max_boxes is not None:
+        where.append("i.box_count <= ?")
+        params.append(max_boxes)
+    if annotated is not None:
+        where.append("i.box_count > 0" if annotated else "i.box_count = 0")
+    if tag:
+        where.append("i.stem IN (SELECT stem FROM search_tags WHERE tag = ?)")
+        params.append(tag)
+
+    clause = f" WHERE {' AND '.join(where)}" if where else ""
+    page_size = max(1, min(page_size, MAX_PAGE_SIZE))
+    total = index.execute(f"SELECT COUNT(*) FROM search_images i{clause}", params)[0][0]
+    rows = index.execute(f"SELECT i.id, i.name FROM search_images i{clause} ORDER BY i.name LIMIT ? OFFSET ?",
+                         params + [page_size, max(0, page) * page_size])
+    return {
+        "total": total,
+        "ids": [row[0] for row in rows],
+        "names": [row[1] for row in rows],
+    }
+
+
+def all_tags(dataset_path):
+    """{tag: image count} over the stored metadata."""
+    return dict(_index(dataset_path).execute("SELECT tag, COUNT(*) FROM search_tags GROUP BY tag ORDER BY tag"))
+
+
+def next_images(dataset_path, order, after=None, cursor=None, count=1, wrap=True):
+    """
+    The next count images of a review queue ordering. The queue continues
+    after cursor ([key, name] returned by the previous call) or, without
+    one, after the image named after (its current key). With wrap, the
+    queue starts over from the top once the end is reached, stopping before
+    the starting point. Returns {"items", "cursor", "wrapped"}.
+    """
+    if order not in QUEUE_ORDERS:
+        raise ValueError(f"Unknown queue order: {order}")
+    column, condition = QUEUE_ORDERS[order]
+    index = _index(dataset_path)
+    count = max(1, min(count, MAX_QUEUE_COUNT))
+    start = None
+    if cursor is not None:
+        start = (cursor[0], cursor[1])
+    elif after:
+        name = _name(_layout(dataset_path)[0], after)
+        row = index.execute(f"SELECT {column} FROM search_queue WHERE name = ?", (name,))
+        if row and row[0][0] is not None:
+            start = (row[0][0], name)
+
+    def fetch(bound, op, limit):
+        where = [condition] if condition else []
+        params = []
+        if bound is not None:
+            where.append(f"({column}, name) {op} (?, ?)")
+            params.extend(bound)
+        clause = f" WHERE {' AND '.join(where)}" if where else ""
+        return index.execute(
+            f"SELECT image_id, name, {column}, box_count, mean_conf, rare_class, edited_at FROM search_queue"
+            f"{clause} ORDER BY {column}, name LIMIT ?", params + [limit])
+
+    rows = fetch(start, ">", count)
+    wrapped = False
+    if wrap and start is not None and len(rows) < count:
+        more = fetch(None, None, count - len(rows))
+        more = [row for row in more if (row[2], row[1]) < start]
+        wrapped = bool(more)
+        rows += more
+    items = [{"id": image_id, "name": name, "key": key, "box_count": box_count, "mean_confidence": mean_conf,
+              "rare_class": rare_class, "edited_at": edited_at}
+             for image_id, name, key, box_count, mean_conf, rare_class, edited_at in rows]
+    return {
+        "items": items,
+        "cursor": [items[-1]["key"], items[-1]["name"]] if items else (list(start) if start else None),
+        "wrapped": wrapped,
+    }
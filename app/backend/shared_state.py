@@ -0,0 +1,172 @@
+"""
+State shared by the worker processes of one server.
+
+With LAMA_WORKERS > 1 uvicorn runs several processes behind one port.
+Dataset-derived caches already live in each dataset's index database
+(SQLite, WAL), which every worker reads and writes consistently. The state
+that used to live only in process memory goes here instead: progress of
+background jobs and cached results addressed by id are kept in a small
+SQLite database in LAMA_STATE_DIR. Read-modify-write cycles on labels also
+take an OS file lock, one of LOCK_STRIPES lock files picked by hashing the
+label path, so two workers never interleave saves of the same image.
+
+With a single worker none of this is used and state stays in memory.
+"""
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+
+LOCK_STRIPES = 256
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS blobs (
+    namespace TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value BLOB NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (namespace, key)
+);
+"""
+
+_conn = None
+_conn_lock = threading.RLock()
+_stripe_locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+_stripe_files = {}
+
+
+def worker_count():
+    try:
+        return max(1, int(os.environ.get("LAMA_WORKERS", "1")))
+    except ValueError:
+        return 1
+
+
+def multi_worker():
+    return worker_count() > 1
+
+
+def state_dir():
+    path = os.environ.get("LAMA_STATE_DIR") or os.path.join(tempfile.gettempdir(), "lama-backend")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _connection():
+    global _conn
+    with _conn_lock:
+        if _conn is None:
+            _conn = sqlite3.connect(os.path.join(state_dir(), "state.db"), check_same_thread=False,
+                                    isolation_level=None, timeout=30)
+            _conn.execute("PRAGMA journal_mode=WAL")
+            _conn.execute("PRAGMA synchronous=NORMAL")
+            _conn.executescript(_SCHEMA)
+        return _conn
+
+
+# Jobs
+
+def put_job(job_id, progress):
+    with _conn_lock:
+        _connection().execute(
+            "INSERT OR REPLACE INTO jobs (id, state, updated_at) VALUES (?, ?, ?)",
+            (job_id, json.dumps(progress, default=str), time.time()),
+        )
+
+
+def get_job(job_id):
+    with _conn_lock:
+        row = _connection().execute("SELECT state FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    return json.loads(row[0]) if row else None
+
+
+def trim_jobs(keep):
+    with _conn_lock:
+        _connection().execute(
+            "DELETE FROM jobs WHERE id NOT IN (SELECT id FROM jobs ORDER BY updated_at DESC LIMIT ?)", (keep,)
+        )
+
+
+# Blobs (JSON values, compressed)
+
+def _json_default(value):
+    # NumPy scalars
+    if hasattr(value, "item"):
+        return value.item()
+    return str(value)
+
+
+def put_value(namespace, key, value, keep):
+    """Store a JSON-serializable value, keeping the newest `keep` values of the namespace."""
+    data = zlib.compress(json.dumps(value, default=_json_default).encode("utf-8"), 1)
+    with _conn_lock:
+        conn = _connection()
+        conn.execute("INSERT OR REPLACE INTO blobs (namespace, key, value, created_at) VALUES (?, ?, ?, ?)",
+                     (namespace, key, data, time.time()))
+        conn.execute(
+            "DELETE FROM blobs WHERE namespace = ? AND key NOT IN "
+            "(SELECT key FROM blobs WHERE namespace = ? ORDER BY created_at DESC LIMIT ?)",
+            (namespace, namespace, keep),
+        )
+
+
+def get_value(namespace, key):
+    with _conn_lock:
+        row = _connection().execute("SELECT value FROM blobs WHERE namespace = ? AND key = ?",
+                                    (namespace, key)).fetchone()
+    return json.loads(zlib.decompress(row[0])) if row else None
+
+
+# Cross-process locks
+
+def _lock_fd(fd):
+    if os.name == 'nt':
+        import msvcrt
+        os.lseek(fd, 0, os.SEEK_SET)
+        while True:
+            try:
+                # LK_LOCK gives up after ~10 seconds; keep waiting like flock does
+                msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                continue
+    import fcntl
+    fcntl.flock(fd, fcntl.LOCK_EX)
+
+
+def _unlock_fd(fd):
+    if os.name == 'nt':
+        import msvcrt
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+        return
+    import fcntl
+    fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+@contextmanager
+def process_lock(key):
+    """Exclusive lock on key across the worker processes (striped over LOCK_STRIPES files)."""
+    stripe = zlib.crc32(key.encode("utf-8")) % LOCK_STRIPES
+    # The thread lock comes first: file locks are held per process, not per thread
+    with _stripe_locks[stripe]:
+        fd = _stripe_files.get(stripe)
+        if fd is None:
+            lock_dir = os.path.join(state_dir(), "locks")
+            os.makedirs(lock_dir, exist_ok=True)
+            fd = _stripe_files[stripe] = os.open(os.path.join(lock_dir, f"{stripe:03d}.lock"),
+                                                 os.O_RDWR | os.O_CREAT)
+        _lock_fd(fd)
+        try:
+            yield
+        finally:
+            _unlock_fd(fd)
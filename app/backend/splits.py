@@ -0,0 +1,173 @@
+"""
+Stratified train/val/test splits written as YOLO image list files.
+
+Images are never copied: each split is a text file in the dataset root
+listing image paths ("./images/..."), referenced from data.yaml. Splits are
+balanced per class with iterative stratification on per-image class
+histograms from the label index, and can keep near-duplicate groups
+together so the same scene never ends up in both train and val.
+
+Assignments are stored in the dataset index. Re-splitting keeps every
+image that is still present in its split and only places new images, so
+splits stay stable across edits unless a reshuffle is requested.
+"""
+import hashlib
+import os
+
+try:
+    from backend import dataset_index, annotation_store, label_index
+except ImportError:
+    import dataset_index
+    import annotation_store
+    import label_index
+
+SPLITS = ("train", "val", "test")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS split_assignment (
+    path TEXT PRIMARY KEY,
+    split TEXT NOT NULL
+);
+"""
+
+
+def _index(dataset_path):
+    index = dataset_index.get_index(dataset_path)
+    index.ensure_schema("splits", _SCHEMA)
+    return index
+
+
+def class_histograms(dataset_path, image_paths, labels_dir):
+    """Per-image {class_id: box count}, from the annotation store or cached label files."""
+    stems = [os.path.splitext(os.path.basename(p))[0] for p in image_paths]
+    store = annotation_store.get_store(dataset_path)
+    if store:
+        data = store.scan()
+        by_stem = {}
+        for image_id, class_id in zip(data["image_id"].tolist(), data["class_id"].tolist()):
+            counts = by_stem.setdefault(data["stems"][image_id], {})
+            counts[class_id] = counts.get(class_id, 0) + 1
+        return [by_stem.get(stem, {}) for stem in stems]
+
+    label_index.refresh(dataset_path, labels_dir)
+    by_path = label_index.histograms(dataset_path)
+    return [by_path.get(os.path.join(labels_dir, stem + ".txt"), {}) for stem in stems]
+
+
+def _stable_key(key, seed):
+    return hashlib.md5(f"{seed}:{key}".encode("utf-8")).hexdigest()
+
+
+def stratify(keys, histograms, ratios, groups=(), previous=None, seed=0):
+    """
+    Assign every image to a split.
+
+    keys: stable image keys (relative paths); histograms: per-image class
+    counts; groups: lists of image indices that must share a split;
+    previous: {key: split} assignments to keep. Returns a list of split
+    names, one per image.
+    """
+    previous = previous or {}
+    splits = [s for s in SPLITS if ratios.get(s, 0) > 0]
+    total_ratio = sum(ratios[s] for s in splits)
+    n = len(keys)
+
+    # Units of images that move together (near-duplicate groups or single images)
+    unit_of = list(range(n))
+    for group in groups:
+        for i in group:
+            unit_of[i] = group[0]
+    units = {}
+    for i in range(n):
+        units.setdefault(unit_of[i], []).append(i)
+
+    class_totals = {}
+    for counts in histograms:
+        for class_id, count in counts.items():
+            class_totals[class_id] = class_totals.get(class_id, 0) + count
+    desired = {s: {c: t * ratios[s] / total_ratio for c, t in class_totals.items()} for s in splits}
+    desired_images = {s: n * ratios[s] / total_ratio for s in splits}
+    current = {s: {} for s in splits}
+    current_images = {s: 0 for s in splits}
+    assignment = [None] * n
+
+    def place(members, unit_counts, split):
+        for i in members:
+            assignment[i] = split
+        current_images[split] += len(members)
+        for class_id, count in unit_counts.items():
+            current[split][class_id] = current[split].get(class_id, 0) + count
+
+    free = []
+    for members in units.values():
+        unit_counts = {}
+        for i in members:
+            for class_id, count in histograms[i].items():
+                unit_counts[class_id] = unit_counts.get(class_id, 0) + count
+        kept = [previous[keys[i]] for i in members if previous.get(keys[i]) in splits]
+        if kept:
+            # A group keeps the split most of its already assigned members are in
+            place(members, unit_counts, max(splits, key=kept.count))
+        else:
+            free.append((members, unit_counts))
+
+    # Rarest classes first, as in iterative stratification; ties in a seeded stable order
+    def order(unit):
+        members, unit_counts = unit
+        rarest = min((class_totals[c] for c in unit_counts), default=float("inf"))
+        return rarest, _stable_key(keys[members[0]], seed)
+
+    for members, unit_counts in sorted(free, key=order):
+        if unit_counts:
+            rarest = min(unit_counts, key=lambda c: (class_totals[c], c))
+            split = max(splits, key=lambda s: (
+                desired[s][rarest] - current[s].get(rarest, 0),
+                desired_images[s] - current_images[s],
+            ))
+        else:
+            split = max(splits, key=lambda s: desired_images[s] - current_images[s])
+        place(members, unit_counts, split)
+    return assignment
+
+
+def load_assignment(dataset_path):
+    return dict(_index(dataset_path).execute("SELECT path, split FROM split_assignment"))
+
+
+def save_assignment(dataset_path, keys, assignment):
+    index = _index(dataset_path)
+    # One transaction, so a failed insert leaves the previous assignment in place
+    with index.lock:
+        cur = index.conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            cur.execute("DELETE FROM split_assignment")
+            cur.executemany("INSERT INTO split_assignment (path, split) VALUES (?, ?)", zip(keys, assignment))
+            cur.execute("COMMIT")
+        except Exception:
+            cur.execute("ROLLBACK")
+            raise
+
+
+def relative_key(dataset_path, image_path):
+    """Image path as written to the list files: "./" + path relative to the dataset root."""
+    return "./" + os.path.relpath(image_path, dataset_path).replace(os.sep, "/")
+
+
+def write_split_files(dataset_path, keys, assignment):
+    """Write <split>.txt list files into the dataset root. Returns {split: file name}."""
+    files = {}
+    for split in SPLITS:
+        lines = [key for key, s in zip(keys, assignment) if s == split]
+        name = f"{split}.txt"
+        path = os.path.join(dataset_path, name)
+        if not lines:
+            if os.path.exists(path):
+                os.remove(path)
+            continue
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write("".join(line + "\n" for line in lines))
+        os.replace(tmp_path, path)
+        files[split] = name
+    return files
@@ -0,0 +1,98 @@
+"""
+Lazy loading of the heavy backend subsystems.
+
+The server must answer its first request as fast as possible, so imaging,
+YAML, export and Vision LLM code is only imported the first time a route
+needs it (or by the background warm-up once the server is listening).
+"""
+import importlib
+import threading
+import time
+
+# name -> candidate module paths (package mode first, then direct execution)
+SUBSYSTEMS = {
+    "imaging": ["PIL.Image"],
+    "yaml": ["yaml"],
+    "exporter": ["backend.exporter", "exporter"],
+    "vision_llm": ["requests"],
+    "vision_mosaic": ["backend.vision_mosaic", "vision_mosaic"],
+    "phash": ["backend.phash_index", "phash_index"],
+    "box_audit": ["backend.box_audit", "box_audit"],
+    "label_lint": ["backend.label_lint", "label_lint"],
+    "class_ops": ["backend.class_ops", "class_ops"],
+    "splits": ["backend.splits", "splits"],
+    "project_archive": ["backend.project_archive", "project_archive"],
+}
+
+# Subsystems worth loading in the background right after startup
+WARMUP_SUBSYSTEMS = ["imaging", "yaml"]
+
+_lock = threading.Lock()
+_modules = {}
+_load_times = {}
+_state = {"ready": False, "started_at": time.time(), "ready_at": None}
+
+
+def load(name):
+    """Return the module for a subsystem, importing it on first use."""
+    module = _modules.get(name)
+    if module is not None:
+        return module
+
+    with _lock:
+        module = _modules.get(name)
+        if module is not None:
+            return module
+
+        start = time.perf_counter()
+        last_error = None
+        for module_path in SUBSYSTEMS[name]:
+            try:
+                module = importlib.import_module(module_path)
+                break
+            except ImportError as e:
+                last_error = e
+        if module is None:
+            raise last_error
+
+        _load_times[name] = time.perf_counter() - start
+        _modules[name] = module
+        return module
+
+
+def image_module():
+    """Shortcut for PIL.Image, the most used lazy subsystem."""
+    return load("imaging")
+
+
+def warm_up(names=None):
+    """Import the given subsystems in a daemon thread, then mark the backend ready."""
+    names = WARMUP_SUBSYSTEMS if names is None else names
+
+    def _run():
+        for name in names:
+            try:
+                load(name)
+            except ImportError as e:
+                print(f"Warning: Could not preload {name}: {e}")
+        _state["ready"] = True
+        _state["ready_at"] = time.time()
+
+    thread = threading.Thread(target=_run, name="subsystem-warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+def status():
+    """Readiness summary for the root endpoint."""
+    return {
+        "ready": _state["ready"],
+        "uptime": round(time.time() - _state["started_at"], 3),
+        "subsystems": {
+            name: {
+                "loaded": name in _modules,
+                "load_ms": round(_load_times[name] * 1000, 2) if name in _load_times else None,
+            }
+            for name in SUBSYSTEMS
+        },
+    }
@@ -0,0 +1,162 @@
+"""
+Mosaic batching for the Vision LLM routes.
+
+Instead of one provider request per image, up to N images are downscaled
+into the tiles of one grid image. Every tile has a numbered header strip
+above the picture, and the model is asked for one result per tile number
+with coordinates relative to that tile's picture. Results are then mapped
+back to each source image: tile-normalized coordinates -> tile pixels ->
+minus letterbox padding -> divided by the downscale factor -> clipped to
+the source size.
+
+More tiles per request means fewer requests (about N times fewer for a
+dataset) but less detail per image, so the tile count and tile size trade
+accuracy for throughput.
+"""
+import io
+import json
+import math
+import re
+
+try:
+    from backend import subsystems, metrics
+except ImportError:
+    import subsystems
+    import metrics
+
+DEFAULT_TILE_SIZE = 512
+MAX_TILES = 16
+BACKGROUND = (114, 114, 114)
+GUTTER = 4
+
+
+class Tile:
+    """Placement of one source image inside a mosaic."""
+
+    __slots__ = ("number", "path", "src_w", "src_h", "scale", "pad_x", "pad_y", "size")
+
+    def __init__(self, number, path, src_w, src_h, size):
+        self.number = number
+        self.path = path
+        self.src_w = src_w
+        self.src_h = src_h
+        self.size = size
+        self.scale = min(size / max(src_w, src_h), 1.0)
+        self.pad_x = (size - round(src_w * self.scale)) // 2
+        self.pad_y = (size - round(src_h * self.scale)) // 2
+
+    def to_source(self, x_center, y_center, width, height):
+        """
+        Pixel box {x, y, width, height} in the source image of a box given in
+        coordinates normalized to the tile picture, or None if it lies in the padding.
+        """
+        x1 = ((x_center - width / 2) * self.size - self.pad_x) / self.scale
+        y1 = ((y_center - height / 2) * self.size - self.pad_y) / self.scale
+        x2 = ((x_center + width / 2) * self.size - self.pad_x) / self.scale
+        y2 = ((y_center + height / 2) * self.size - self.pad_y) / self.scale
+        x1, y1 = max(0.0, x1), max(0.0, y1)
+        x2, y2 = min(float(self.src_w), x2), min(float(self.src_h), y2)
+        if x2 <= x1 or y2 <= y1:
+            return None
+        return {"x": x1, "y": y1, "width": x2 - x1, "height": y2 - y1}
+
+
+def grid_shape(count):
+    """(columns, rows) of the most square grid holding count tiles."""
+    columns = math.ceil(math.sqrt(count))
+    return columns, math.ceil(count / columns)
+
+
+def build_mosaic(image_paths, tile_size=DEFAULT_TILE_SIZE, quality=85):
+    """
+    JPEG bytes of a numbered grid of the images and their Tiles. Images that
+    cannot be opened are left out (returned as the third item).
+    """
+    Image = subsystems.image_module()
+    from PIL import ImageDraw, ImageFont
+
+    pictures, tiles, failed = [], [], []
+    for path in image_paths:
+        try:
+            metrics.IMAGE_OPENS.inc("vision_mosaic")
+            with Image.open(path) as img:
+                src_w, src_h = img.size
+                tile = Tile(len(tiles) + 1, path, src_w, src_h, tile_size)
+                target = (max(1, round(src_w * tile.scale)), max(1, round(src_h * tile.scale)))
+                # JPEG draft decoding at reduced scale skips most of the decode work
+                img.draft("RGB", target)
+                picture = img.convert("RGB")
+            if picture.size != target:
+                picture = picture.resize(target, Image.BILINEAR)
+        except Exception as e:
+            failed.append((path, str(e)))
+            continue
+        pictures.append(picture)
+        tiles.append(tile)
+    if not tiles:
+        return None, [], failed
+
+    header = max(16, tile_size // 12)
+    try:
+        font = ImageFont.load_default(size=int(header * 0.8))
+    except TypeError:
+        # Pillow < 10.1: fixed-size bitmap font
+        font = ImageFont.load_default()
+    columns, rows = grid_shape(len(tiles))
+    cell_w, cell_h = tile_size + GUTTER, header + tile_size + GUTTER
+    mosaic = Image.new("RGB", (columns * cell_w - GUTTER, rows * cell_h - GUTTER), (0, 0, 0))
+    draw = ImageDraw.Draw(mosaic)
+    for tile, picture in zip(tiles, pictures):
+        row, column = divmod(tile.number - 1, columns)
+        left, top = column * cell_w, row * cell_h
+        draw.rectangle([left, top, left + tile_size - 1, top + header - 1], fill=(255, 255, 255))
+        draw.text((left + 4, top + 1), f"Tile {tile.number}", fill=(0, 0, 0), font=font)
+        mosaic.paste(Image.new("RGB", (tile_size, tile_size), BACKGROUND), (left, top + header))
+        mosaic.paste(picture, (left + tile.pad_x, top + header + tile.pad_y))
+
+    buffer = io.BytesIO()
+    mosaic.save(buffer, "JPEG", quality=quality)
+    return buffer.getvalue(), tiles, failed
+
+
+def mosaic_prompt(tiles, task_prompt, result_example):
+    """Prompt asking for one result per tile, each shaped like result_example."""
+    columns, rows = grid_shape(len(tiles))
+    example = json.dumps({"tiles": [{"tile": 1, **result_example}]}, indent=4)
+    return f"""This image is a grid of {len(tiles)} separate pictures ({columns} columns x {rows} rows), \
+numbered left to right, top to bottom. Each picture sits below a white strip reading "Tile <n>". \
+Treat every tile as an independent image; gray borders are padding, not content.
+
+For EACH tile: {task_prompt}
+Coordinates are normalized (0-1) to that tile's picture (below its strip), never to the whole grid.
+
+Respond in JSON format with one entry per tile number:
+{example}"""
+
+
+def parse_tile_results(content, tile_count):
+    """{tile number: result dict} from a model response (missing tiles are left out)."""
+    match = re.search(r'\{.*\}', content or "", re.DOTALL)
+    if not match:
+        return {}
+    try:
+        data = json.loads(match.group())
+    except ValueError:
+        return {}
+    entries = data.get("tiles", []) if isinstance(data, dict) else data
+    results = {}
+    for entry in entries if isinstance(entries, list) else []:
+        if not isinstance(entry, dict):
+            continue
+        try:
+            number = int(entry.get("tile"))
+        except (TypeError, ValueError):
+            continue
+        if 1 <= number <= tile_count:
+            results[number] = entry
+    return results
+
+
+def batches(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
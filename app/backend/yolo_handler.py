@@ -1,5 +1,10 @@
 import os
 
+try:
+    from backend import metrics
+except ImportError:
+    import metrics
+
 def parse_yolo_file(file_path):
     boxes = []
     if not os.path.exists(file_path):
@@ -12,7 +17,11 @@ def parse_yolo_file(file_path):
         # Fallback to latin-1 if UTF-8 fails
         with open(file_path, 'r', encoding='latin-1') as f:
             lines = f.readlines()
-        
+    
+    metrics.LABEL_PARSES.inc()
+    metrics.LABEL_LINES.inc(amount=len(lines))
+    
+    skipped = []
     for i, line in enumerate(lines):
         parts = line.strip().split()
         if len(parts) >= 5:
@@ -42,9 +51,13 @@ def parse_yolo_file(file_path):
                     "confidence": conf
                 })
             except (ValueError, IndexError) as e:
-                # Skip invalid lines
-                print(f"Warning: Skipping invalid line {i+1} in {file_path}: {line.strip()}")
+                # Skip invalid lines (reported line by line by /lint_labels)
+                skipped.append(i + 1)
                 continue
+        elif parts:
+            skipped.append(i + 1)
+    if skipped:
+        print(f"Warning: Skipped {len(skipped)} invalid line(s) in {file_path} (first: line {skipped[0]})")
     return boxes
 
 def save_yolo_file(file_path, boxes):
@@ -59,5 +72,7 @@ def save_yolo_file(file_path, boxes):
             line = f"{box['class_id']} {box['x']} {box['y']} {box['width']} {box['height']}\n"
         lines.append(line)
         
+    content = "".join(lines)
     with open(file_path, 'w') as f:
-        f.writelines(lines)
+        f.write(content)
+    metrics.BYTES_WRITTEN.inc("labels", amount=len(content))
@@ -0,0 +1 @@
+# Benchmarks for Lama Worlds Annotation Studio backend
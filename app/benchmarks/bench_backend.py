@@ -0,0 +1,264 @@
+"""
+Benchmark the backend hot paths on a synthetic YOLO dataset.
+
+Every endpoint is driven in-process through FastAPI's TestClient, so the
+numbers include routing and JSON encoding but no network. Run from app/:
+
+    python -m benchmarks.bench_backend --images 10000 --labels dense
+    python -m benchmarks.bench_backend --images 10000 --save-baseline main
+    python -m benchmarks.bench_backend --images 10000 --compare main
+
+Generated datasets can be kept with --dataset-dir so large scales (1M
+images) only pay the generation cost once.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+_app_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _app_dir not in sys.path:
+    sys.path.insert(0, _app_dir)
+
+from benchmarks.synthetic_dataset import generate_dataset, LABEL_PROFILES
+
+BASELINES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of floats."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def _time_calls(call, args_list):
+    """Run call(*args) for each args tuple and return per-call latencies in seconds."""
+    latencies = []
+    for args in args_list:
+        start = time.perf_counter()
+        response = call(*args)
+        latencies.append(time.perf_counter() - start)
+        if response.status_code != 200:
+            raise RuntimeError(f"Request failed ({response.status_code}): {response.text[:200]}")
+    return latencies
+
+
+def _summarize(name, latencies, items_per_call):
+    total = sum(latencies)
+    return {
+        "name": name,
+        "calls": len(latencies),
+        "items_per_call": items_per_call,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "mean_ms": statistics.mean(latencies) * 1000 if latencies else 0.0,
+        "ops_per_sec": len(latencies) / total if total > 0 else 0.0,
+        "items_per_sec": len(latencies) * items_per_call / total if total > 0 else 0.0,
+    }
+
+
+def run_benchmarks(client, dataset, samples=200, repeat=3, only=None, seed=0):
+    """Run every benchmark case against an already generated dataset."""
+    rng = random.Random(seed)
+    path = dataset["path"]
+    num_images = dataset["images"]
+    results = []
+
+    def enabled(name):
+        return not only or name in only
+
+    listing = client.post("/load_dataset", json={"path": path}).json()
+    images = listing["images"]
+    sample = [images[rng.randrange(len(images))] for _ in range(min(samples, len(images)))]
+
+    if enabled("load_dataset"):
+        latencies = _time_calls(
+            lambda: client.post("/load_dataset", json={"path": path}),
+            [()] * repeat,
+        )
+        results.append(_summarize("load_dataset", latencies, num_images))
+
+    if enabled("load_annotation"):
+        latencies = _time_calls(
+            lambda img: client.post("/load_annotation", json={"dataset_path": path, "image_path": img}),
+            [(img,) for img in sample],
+        )
+        results.append(_summarize("load_annotation", latencies, 1))
+
+    if enabled("save_annotation"):
+        payloads = []
+        for img in sample:
+            boxes = client.post("/load_annotation", json={"dataset_path": path, "image_path": img}).json()["boxes"]
+            if not boxes:
+                boxes = [{"id": "bench_0", "class_id": 0, "x": 10, "y": 10, "width": 50, "height": 40}]
+            payloads.append(({"dataset_path": path, "image_name": img, "boxes": boxes},))
+        latencies = _time_calls(lambda body: client.post("/save_annotation", json=body), payloads)
+        results.append(_summarize("save_annotation", latencies, 1))
+
+    if enabled("get_annotated_images"):
+        latencies = _time_calls(
+            lambda: client.post("/get_annotated_images", json={"dataset_path": path}),
+            [()] * repeat,
+        )
+        results.append(_summarize("get_annotated_images", latencies, num_images))
+
+    if enabled("get_annotated_images_by_class"):
+        latencies = _time_calls(
+            lambda: client.post("/get_annotated_images", json={"dataset_path": path, "class_id": 0}),
+            [()] * repeat,
+        )
+        results.append(_summarize("get_annotated_images_by_class", latencies, num_images))
+
+    for fmt in ("coco", "voc"):
+        name = f"export_{fmt}"
+        if enabled(name):
+            latencies = _time_calls(
+                lambda: client.post("/export", json={"dataset_path": path, "format": fmt}),
+                [()] * repeat,
+            )
+            results.append(_summarize(name, latencies, num_images))
+
+    if enabled("merge_datasets"):
+        output_root = tempfile.mkdtemp(prefix="lama_bench_merge_")
+        try:
+            def merge(i):
+                return client.post("/merge_datasets", json={
+                    "dataset_paths": [path, path],
+                    "output_path": os.path.join(output_root, f"merged_{i}"),
+                })
+            latencies = _time_calls(merge, [(i,) for i in range(repeat)])
+            results.append(_summarize("merge_datasets", latencies, num_images * 2))
+        finally:
+            shutil.rmtree(output_root, ignore_errors=True)
+
+    return results
+
+
+def print_results(results, baseline=None):
+    header = f"{'benchmark':<32}{'calls':>7}{'p50 ms':>12}{'p99 ms':>12}{'ops/s':>12}{'items/s':>14}"
+    if baseline:
+        header += f"{'p50 vs base':>14}"
+    print(header)
+    print("-" * len(header))
+    for res in results:
+        line = (f"{res['name']:<32}{res['calls']:>7}{res['p50_ms']:>12.2f}{res['p99_ms']:>12.2f}"
+                f"{res['ops_per_sec']:>12.1f}{res['items_per_sec']:>14.0f}")
+        if baseline:
+            base = baseline.get(res["name"])
+            if base and base["p50_ms"] > 0:
+                line += f"{(res['p50_ms'] / base['p50_ms'] - 1) * 100:>+13.1f}%"
+            else:
+                line += f"{'n/a':>14}"
+        print(line)
+
+
+def save_baseline(name, dataset, results):
+    os.makedirs(BASELINES_DIR, exist_ok=True)
+    path = os.path.join(BASELINES_DIR, f"{name}.json")
+    payload = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "dataset": {k: v for k, v in dataset.items() if k != "path"},
+        "results": {res["name"]: res for res in results},
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, indent=2)
+    return path
+
+
+def load_baseline(name):
+    path = os.path.join(BASELINES_DIR, f"{name}.json")
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def find_regressions(results, baseline, tolerance):
+    """Benchmarks whose p50 grew by more than tolerance (0.2 = +20%) over the baseline."""
+    regressions = []
+    for res in results:
+        base = baseline.get(res["name"])
+        if base and base["p50_ms"] > 0 and res["p50_ms"] > base["p50_ms"] * (1 + tolerance):
+            regressions.append(res["name"])
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark Lama Worlds backend hot paths")
+    parser.add_argument("--images", type=int, default=1000, help="Number of synthetic images (1k to 1M)")
+    parser.add_argument("--labels", choices=sorted(LABEL_PROFILES), default="sparse", help="Label density profile")
+    parser.add_argument("--classes", type=int, default=10, help="Number of classes")
+    parser.add_argument("--nested", type=int, default=0, help="Spread images over N sub-folders of images/")
+    parser.add_argument("--samples", type=int, default=200, help="Per-image requests for load/save benchmarks")
+    parser.add_argument("--repeat", type=int, default=3, help="Repetitions for dataset-wide benchmarks")
+    parser.add_argument("--only", nargs="*", help="Only run these benchmarks")
+    parser.add_argument("--dataset-dir", help="Generate into (or reuse) this directory instead of a temp dir")
+    parser.add_argument("--save-baseline", metavar="NAME", help="Save results as a named baseline")
+    parser.add_argument("--compare", metavar="NAME", help="Compare against a named baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed p50 regression vs baseline (0.2 = 20%%)")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    from fastapi.testclient import TestClient
+    from backend.main import app
+
+    temp_dir = None
+    dataset_dir = args.dataset_dir
+    if not dataset_dir:
+        temp_dir = tempfile.mkdtemp(prefix="lama_bench_")
+        dataset_dir = os.path.join(temp_dir, "dataset")
+
+    try:
+        marker = os.path.join(dataset_dir, "bench_dataset.json")
+        if os.path.exists(marker):
+            with open(marker, "r", encoding="utf-8") as f:
+                dataset = json.load(f)
+            dataset["path"] = dataset_dir
+            print(f"Reusing dataset at {dataset_dir} ({dataset['images']} images)", file=sys.stderr)
+        else:
+            start = time.perf_counter()
+            dataset = generate_dataset(dataset_dir, num_images=args.images, labels=args.labels,
+                                       num_classes=args.classes, nested_dirs=args.nested, seed=args.seed)
+            with open(marker, "w", encoding="utf-8") as f:
+                json.dump(dataset, f)
+            print(f"Generated {dataset['images']} images / {dataset['boxes']} boxes "
+                  f"in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+        with TestClient(app) as client:
+            results = run_benchmarks(client, dataset, samples=args.samples, repeat=args.repeat,
+                                     only=args.only, seed=args.seed)
+
+        baseline = load_baseline(args.compare)["results"] if args.compare else None
+
+        if args.json:
+            print(json.dumps({"dataset": dataset, "results": results}, indent=2))
+        else:
+            print_results(results, baseline)
+
+        if args.save_baseline:
+            path = save_baseline(args.save_baseline, dataset, results)
+            print(f"Baseline saved to {path}", file=sys.stderr)
+
+        if baseline:
+            regressions = find_regressions(results, baseline, args.tolerance)
+            if regressions:
+                print(f"Regressions over {args.tolerance:.0%}: {', '.join(regressions)}", file=sys.stderr)
+                return 1
+        return 0
+    finally:
+        if temp_dir:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
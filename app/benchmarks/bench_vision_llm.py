@@ -0,0 +1,176 @@
+"""
+Benchmark the Vision LLM routes against the local mock provider.
+
+verify_all, annotate_all and modify_annotations are driven in-process
+through FastAPI's TestClient, in batches like the frontend sends them, with
+the provider replaced by benchmarks.mock_llm_server. No network or API key
+is needed, so concurrency, batching and retry changes can be measured
+offline. Run from app/:
+
+    python -m benchmarks.bench_vision_llm --images 200 --latency 0.2
+    python -m benchmarks.bench_vision_llm --latency 0.2 --concurrency 4 --mosaic-tiles 4
+    python -m benchmarks.bench_vision_llm --error-rate 0.05 --rate-limit-every 20 --retry-after 0.1
+
+Results list images/s, p50/p99 latency per batch and per provider call, and
+how many provider answers were rate limits or errors, how many of those
+were retried and how many calls failed for good. Call
+latency is measured by the mock (request received to answer sent).
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+_app_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if _app_dir not in sys.path:
+    sys.path.insert(0, _app_dir)
+
+from benchmarks.bench_backend import percentile
+from benchmarks.mock_llm_server import MockLLMServer, add_server_arguments, load_responses
+from benchmarks.synthetic_dataset import generate_dataset
+
+ROUTES = {
+    "verify": "/vision_llm/verify_all",
+    "annotate": "/vision_llm/annotate_all",
+    "modify": "/vision_llm/modify_annotations",
+}
+
+
+def _request_annotations(images):
+    """One existing box per image, as the frontend sends them for verify/modify."""
+    return [{"image_name": os.path.basename(img), "class_id": 0, "x": 10, "y": 10, "width": 50, "height": 40}
+            for img in images]
+
+
+def run_route(client, server, mode, dataset_path, images, classes, batch_size, concurrency, mosaic_tiles):
+    """Send images to one route in batches; returns the summary dict."""
+    batches = [images[i:i + batch_size] for i in range(0, len(images), batch_size)]
+    annotations = _request_annotations(images) if mode != "annotate" else []
+
+    def send(batch):
+        body = {
+            "images": batch,
+            "annotations": annotations,
+            "classes": classes,
+            "dataset_path": dataset_path,
+            "api_provider": "custom",
+            "api_endpoint": server.url,
+            "model": "mock-vision",
+            "confidence_threshold": 0.5,
+            "mode": mode,
+            "mosaic_tiles": mosaic_tiles if mode != "modify" else 1,
+        }
+        start = time.perf_counter()
+        response = client.post(ROUTES[mode], json=body)
+        elapsed = time.perf_counter() - start
+        if response.status_code != 200:
+            raise RuntimeError(f"{ROUTES[mode]} failed ({response.status_code}): {response.text[:200]}")
+        return elapsed, response.json()
+
+    server.reset_stats()
+    start = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            outcomes = list(pool.map(send, batches))
+    else:
+        outcomes = [send(batch) for batch in batches]
+    total = time.perf_counter() - start
+
+    latencies = [elapsed for elapsed, _ in outcomes]
+    stats = server.stats
+    rate_limited = stats["status"].get("429", 0)
+    server_errors = stats["status"].get("500", 0)
+    retries = sum(body.get("llm_retries", 0) for _, body in outcomes)
+    return {
+        "name": mode if mosaic_tiles <= 1 or mode == "modify" else f"{mode}_mosaic{mosaic_tiles}",
+        "images": len(images),
+        "batches": len(batches),
+        "seconds": total,
+        "images_per_sec": len(images) / total if total > 0 else 0.0,
+        "batch_p50_ms": percentile(latencies, 50) * 1000,
+        "batch_p99_ms": percentile(latencies, 99) * 1000,
+        "call_p50_ms": percentile(stats["latencies"], 50) * 1000,
+        "call_p99_ms": percentile(stats["latencies"], 99) * 1000,
+        "provider_calls": stats["requests"],
+        "rate_limited": rate_limited,
+        "server_errors": server_errors,
+        "retries": retries,
+        # Every failed provider answer is either retried or given up on
+        "failed_calls": rate_limited + server_errors - retries,
+        "skipped_corrupt": sum(len(body.get("skipped_corrupt", [])) for _, body in outcomes),
+    }
+
+
+def print_results(results):
+    header = (f"{'route':<20}{'images':>8}{'img/s':>9}{'batch p50':>11}{'batch p99':>11}"
+              f"{'call p50':>10}{'call p99':>10}{'calls':>7}{'429':>6}{'5xx':>6}{'retries':>9}{'failed':>8}")
+    print(header)
+    print("-" * len(header))
+    for res in results:
+        print(f"{res['name']:<20}{res['images']:>8}{res['images_per_sec']:>9.1f}{res['batch_p50_ms']:>11.0f}"
+              f"{res['batch_p99_ms']:>11.0f}{res['call_p50_ms']:>10.0f}{res['call_p99_ms']:>10.0f}"
+              f"{res['provider_calls']:>7}{res['rate_limited']:>6}{res['server_errors']:>6}"
+              f"{res['retries']:>9}{res['failed_calls']:>8}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Vision LLM routes against a local mock provider")
+    parser.add_argument("--images", type=int, default=100, help="Number of synthetic images")
+    parser.add_argument("--classes", type=int, default=5, help="Number of classes")
+    parser.add_argument("--routes", nargs="*", choices=sorted(ROUTES), default=["verify", "annotate", "modify"])
+    parser.add_argument("--batch-size", type=int, default=10, help="Images per backend request (frontend: 10)")
+    parser.add_argument("--concurrency", type=int, default=1, help="Backend requests in flight")
+    parser.add_argument("--mosaic-tiles", type=int, default=1, help="Images per provider call for verify/annotate")
+    parser.add_argument("--retry-backoff", type=float, default=None,
+                        help="Override the backend's base retry backoff in seconds (used without Retry-After)")
+    parser.add_argument("--dataset-dir", help="Generate into (or reuse) this directory instead of a temp dir")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    parser.add_argument("--seed", type=int, default=0)
+    add_server_arguments(parser)
+    args = parser.parse_args(argv)
+
+    from fastapi.testclient import TestClient
+    from backend import main as backend
+
+    if args.retry_backoff is not None:
+        backend.LLM_RETRY_BACKOFF = args.retry_backoff
+
+    temp_dir = None
+    dataset_dir = args.dataset_dir
+    if not dataset_dir:
+        temp_dir = tempfile.mkdtemp(prefix="lama_bench_llm_")
+        dataset_dir = os.path.join(temp_dir, "dataset")
+    try:
+        if not os.path.isdir(os.path.join(dataset_dir, "images")):
+            generate_dataset(dataset_dir, num_images=args.images, labels="sparse",
+                             num_classes=args.classes, seed=args.seed)
+        images_dir = os.path.join(dataset_dir, "images")
+        images = sorted(os.path.join(images_dir, name) for name in os.listdir(images_dir))[:args.images]
+        classes = [{"id": i, "name": f"class_{i}"} for i in range(args.classes)]
+
+        server = MockLLMServer(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                               rate_limit_every=args.rate_limit_every, rate_limit_burst=args.rate_limit_burst,
+                               retry_after=args.retry_after, num_classes=args.classes, seed=args.seed,
+                               responses=load_responses(args.responses) if args.responses else None)
+        results = []
+        with server, TestClient(backend.app) as client:
+            for mode in args.routes:
+                results.append(run_route(client, server, mode, dataset_dir, images, classes, args.batch_size,
+                                         args.concurrency, args.mosaic_tiles))
+
+        if args.json:
+            print(json.dumps({"images": len(images), "results": results}, indent=2))
+        else:
+            print_results(results)
+        return 0
+    finally:
+        if temp_dir:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,274 @@
+"""
+Local OpenAI-compatible mock of a Vision LLM provider.
+
+Answers POST /v1/chat/completions with canned JSON shaped like the answers
+the backend asks for (verify, annotate, modify, and mosaic grids of those),
+so the Vision LLM routes can be exercised and timed without network access
+or an API key. Point the backend at it with api_provider "custom" (or
+"openai") and api_endpoint http://127.0.0.1:<port>/v1/chat/completions.
+
+Provider behaviour is configurable:
+- latency: seconds per request, plus uniform jitter
+- error_rate: fraction of requests answered with a 500
+- rate_limit_every / rate_limit_burst: every N requests, the next K requests
+  get a 429 with Retry-After (like a provider's per-minute quota running out)
+- responses: a JSON file of {mode: answer object} replacing the canned answers
+
+GET /stats returns request counts by status and mode and the handling time
+of every request; POST /stats/reset clears them.
+
+    python -m benchmarks.mock_llm_server --port 8089 --latency 0.5 --rate-limit-every 50
+"""
+import argparse
+import json
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MODES = ("verify", "annotate", "modify")
+
+
+def detect_mode(prompt):
+    """(mode, tile count or 0) of a backend Vision LLM prompt."""
+    grid = re.search(r"grid of (\d+) separate pictures", prompt)
+    tiles = int(grid.group(1)) if grid else 0
+    if "Review and improve" in prompt:
+        return "modify", tiles
+    if "verify the annotations" in prompt:
+        return "verify", tiles
+    return "annotate", tiles
+
+
+def canned_answer(mode, rng, num_classes=1):
+    """Plausible answer object for one image."""
+    if mode == "verify":
+        return {
+            "confidence": round(rng.uniform(0.6, 0.95), 2),
+            "issues": [] if rng.random() < 0.7 else ["Box too loose"],
+            "suggestions": [],
+            "overall_quality": "good",
+        }
+    annotations = []
+    for _ in range(rng.randint(1, 4)):
+        w, h = rng.uniform(0.05, 0.4), rng.uniform(0.05, 0.4)
+        box = {"class_id": rng.randrange(num_classes), "confidence": round(rng.uniform(0.5, 0.99), 2)}
+        if mode == "annotate":
+            box.update(x_center=rng.uniform(w / 2, 1 - w / 2), y_center=rng.uniform(h / 2, 1 - h / 2),
+                       width=w, height=h)
+        else:
+            box.update(x=rng.uniform(0, 300), y=rng.uniform(0, 200), width=w * 640, height=h * 480)
+        annotations.append(box)
+    if mode == "modify":
+        return {"annotations": annotations, "changes": ["Tightened box"]}
+    return {"annotations": annotations}
+
+
+class MockLLMServer:
+    """
+    Threaded mock provider; usable as a context manager that serves on a
+    background thread:
+
+        with MockLLMServer(latency=0.2, error_rate=0.05) as server:
+            ... api_endpoint=server.url ...
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, jitter=0.0, error_rate=0.0,
+                 rate_limit_every=0, rate_limit_burst=0, retry_after=1.0, responses=None,
+                 num_classes=1, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_every = rate_limit_every
+        self.rate_limit_burst = rate_limit_burst
+        self.retry_after = retry_after
+        self.responses = responses or {}
+        self.num_classes = num_classes
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._burst_left = 0
+        self.reset_stats()
+        self._httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1/chat/completions"
+
+    def reset_stats(self):
+        with self._lock:
+            self.stats = {"requests": 0, "status": {}, "modes": {}, "images": 0, "latencies": []}
+            self._counter = 0
+
+    def _record(self, status, started, mode=None, images=0):
+        with self._lock:
+            self.stats["requests"] += 1
+            self.stats["status"][str(status)] = self.stats["status"].get(str(status), 0) + 1
+            if mode:
+                self.stats["modes"][mode] = self.stats["modes"].get(mode, 0) + 1
+            self.stats["images"] += images
+            self.stats["latencies"].append(time.perf_counter() - started)
+
+    def _decide(self):
+        """Status code of the next request and the delay to apply before answering."""
+        with self._lock:
+            self._counter += 1
+            if self.rate_limit_every and self._counter % self.rate_limit_every == 0:
+                self._burst_left = self.rate_limit_burst
+            if self._burst_left > 0:
+                self._burst_left -= 1
+                return 429, 0.0
+            status = 500 if self._rng.random() < self.error_rate else 200
+            delay = max(0.0, self.latency + self._rng.uniform(-self.jitter, self.jitter))
+            return status, delay
+
+    def answer(self, prompt):
+        """Message content for a prompt: fenced JSON like real models tend to return."""
+        mode, tiles = detect_mode(prompt)
+        with self._lock:
+            if mode in self.responses:
+                answers = [dict(self.responses[mode]) for _ in range(max(tiles, 1))]
+            else:
+                answers = [canned_answer(mode, self._rng, self.num_classes) for _ in range(max(tiles, 1))]
+        body = {"tiles": [{"tile": i, **a} for i, a in enumerate(answers, 1)]} if tiles else answers[0]
+        return mode, max(tiles, 1), "```json\n" + json.dumps(body) + "\n```"
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status, payload, headers=None):
+                body = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path.rstrip("/") == "/stats":
+                    with server._lock:
+                        self._send(200, server.stats)
+                else:
+                    self._send(404, {"error": {"message": "Not found"}})
+
+            def do_POST(self):
+                started = time.perf_counter()
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length)
+                if self.path.rstrip("/") == "/stats/reset":
+                    server.reset_stats()
+                    self._send(200, {"status": "success"})
+                    return
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self._send(404, {"error": {"message": "Not found"}})
+                    return
+                try:
+                    content = json.loads(raw)["messages"][0]["content"]
+                    prompt = next(part["text"] for part in content if part.get("type") == "text")
+                except (ValueError, KeyError, IndexError, TypeError, StopIteration):
+                    server._record(400, started)
+                    self._send(400, {"error": {"message": "Expected an OpenAI chat completions request"}})
+                    return
+
+                status, delay = server._decide()
+                if status == 429:
+                    server._record(429, started)
+                    self._send(429, {"error": {"message": "Rate limit reached", "type": "rate_limit"}},
+                               {"Retry-After": f"{server.retry_after:g}"})
+                    return
+                time.sleep(delay)
+                if status == 500:
+                    server._record(500, started)
+                    self._send(500, {"error": {"message": "Injected server error", "type": "server_error"}})
+                    return
+                mode, images, message = server.answer(prompt)
+                server._record(200, started, mode, images)
+                self._send(200, {
+                    "id": f"mock-{server.stats['requests']}",
+                    "object": "chat.completion",
+                    "model": "mock-vision",
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": message}}],
+                })
+
+        return Handler
+
+    def serve_forever(self):
+        self._httpd.serve_forever()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread:
+            self._httpd.shutdown()
+            self._thread.join()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def load_responses(path):
+    """{mode: answer object} from a JSON file, keeping only known modes."""
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    unknown = set(data) - set(MODES)
+    if unknown:
+        raise ValueError(f"Unknown modes in {path}: {', '.join(sorted(unknown))} (expected {', '.join(MODES)})")
+    return data
+
+
+def add_server_arguments(parser):
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds per request")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Uniform +/- jitter on the latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with a 500")
+    parser.add_argument("--rate-limit-every", type=int, default=0, help="Start a 429 burst every N requests (0 = never)")
+    parser.add_argument("--rate-limit-burst", type=int, default=3, help="429 responses per burst")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with 429s")
+    parser.add_argument("--responses", help="JSON file of {verify|annotate|modify: answer} replacing canned answers")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="OpenAI-compatible mock Vision LLM provider")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--classes", type=int, default=1, help="Class ids used in canned boxes")
+    parser.add_argument("--seed", type=int, default=0)
+    add_server_arguments(parser)
+    args = parser.parse_args(argv)
+
+    server = MockLLMServer(args.host, args.port, latency=args.latency, jitter=args.jitter,
+                           error_rate=args.error_rate, rate_limit_every=args.rate_limit_every,
+                           rate_limit_burst=args.rate_limit_burst, retry_after=args.retry_after,
+                           responses=load_responses(args.responses) if args.responses else None,
+                           num_classes=args.classes, seed=args.seed)
+    print(f"Mock Vision LLM listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,104 @@
+"""
+Synthetic YOLO dataset generator for the backend benchmarks.
+
+Images are tiny pre-encoded JPEGs written byte-for-byte, so generating
+hundreds of thousands of files is bounded by the filesystem, not by PIL.
+"""
+import io
+import os
+import random
+
+# Profiles: (fraction of images with a label file, min boxes, max boxes)
+LABEL_PROFILES = {
+    "dense": (1.0, 20, 60),
+    "sparse": (0.2, 1, 3),
+    "empty": (0.0, 0, 0),
+}
+
+IMAGE_SIZES = [(640, 480), (1280, 720), (320, 320)]
+
+
+def _encoded_images():
+    """Encode one small solid-colour JPEG per size in IMAGE_SIZES."""
+    from PIL import Image
+
+    blobs = []
+    for i, size in enumerate(IMAGE_SIZES):
+        buf = io.BytesIO()
+        Image.new("RGB", size, (40 * i, 80, 160)).save(buf, format="JPEG", quality=50)
+        blobs.append(buf.getvalue())
+    return blobs
+
+
+def _label_lines(rng, num_classes, min_boxes, max_boxes):
+    lines = []
+    for _ in range(rng.randint(min_boxes, max_boxes)):
+        w = rng.uniform(0.02, 0.4)
+        h = rng.uniform(0.02, 0.4)
+        x = rng.uniform(w / 2, 1 - w / 2)
+        y = rng.uniform(h / 2, 1 - h / 2)
+        cls = rng.randrange(num_classes)
+        if rng.random() < 0.3:
+            lines.append(f"{cls} {x:.6f} {y:.6f} {w:.6f} {h:.6f} {rng.uniform(0.2, 1.0):.4f}\n")
+        else:
+            lines.append(f"{cls} {x:.6f} {y:.6f} {w:.6f} {h:.6f}\n")
+    return lines
+
+
+def generate_dataset(output_path, num_images=1000, labels="sparse", num_classes=10,
+                     nested_dirs=0, seed=0):
+    """
+    Write a YOLO dataset (images/, labels/, classes.txt) to output_path.
+
+    nested_dirs > 0 spreads images over that many sub-folders of images/;
+    their labels are written beside them, where the backend looks for the
+    labels of images outside images/ itself (image_ids.label_location).
+    Returns a summary dict.
+    """
+    from backend.image_ids import label_location
+
+    if labels not in LABEL_PROFILES:
+        raise ValueError(f"Unknown label profile: {labels}")
+
+    rng = random.Random(seed)
+    label_fraction, min_boxes, max_boxes = LABEL_PROFILES[labels]
+    blobs = _encoded_images()
+
+    images_dir = os.path.join(output_path, "images")
+    labels_dir = os.path.join(output_path, "labels")
+    os.makedirs(images_dir, exist_ok=True)
+    os.makedirs(labels_dir, exist_ok=True)
+
+    subdirs = [images_dir]
+    if nested_dirs > 0:
+        subdirs = [os.path.join(images_dir, f"part_{i:04d}") for i in range(nested_dirs)]
+        for subdir in subdirs:
+            os.makedirs(subdir, exist_ok=True)
+
+    with open(os.path.join(output_path, "classes.txt"), "w", encoding="utf-8") as f:
+        for i in range(num_classes):
+            f.write(f"class_{i}\n")
+
+    total_boxes = 0
+    labelled = 0
+    for i in range(num_images):
+        image_path = os.path.join(subdirs[i % len(subdirs)], f"img_{i:07d}.jpg")
+        with open(image_path, "wb") as f:
+            f.write(blobs[i % len(blobs)])
+
+        if rng.random() < label_fraction:
+            lines = _label_lines(rng, num_classes, min_boxes, max_boxes)
+            with open(label_location(image_path)[1], "w") as f:
+                f.writelines(lines)
+            total_boxes += len(lines)
+            labelled += 1
+
+    return {
+        "path": output_path,
+        "images": num_images,
+        "labelled_images": labelled,
+        "boxes": total_boxes,
+        "classes": num_classes,
+        "labels": labels,
+        "nested_dirs": nested_dirs,
+    }
@@ -63,6 +63,19 @@ const API_URL = 'http://localhost:8000';
  */
 const api = axios.create({ baseURL: API_URL, timeout: 10000 });
 
+/**
+ * Expand a compact listing (paths relative to base_dir) back to absolute paths
+ * @param {Object} data - Listing response
+ * @param {string} key - Key of the path list
+ * @returns {Array<string>} Absolute paths
+ */
+const expandListing = (data, key) => {
+    const paths = data[key] || [];
+    if (!data.compact) return paths;
+    const prefix = data.base_dir + data.sep;
+    return paths.map(p => prefix + p);
+};
+
 /**
  * Response interceptor for error handling and automatic retry
  * Handles network errors and connection issues gracefully
@@ -344,9 +357,9 @@ function App() {
         try {
             // Load images - request all images by setting a very large page_size
             const imagesRes = await api.post('/load_dataset', { path: path }, { 
-                params: { page: 0, page_size: 999999 } 
+                params: { page: 0, page_size: 999999, compact: true } 
             });
-            const imageList = imagesRes.data.images || [];
+            const imageList = expandListing(imagesRes.data, 'images');
             setImages(imageList);
             
             // Load classes
@@ -355,8 +368,8 @@ function App() {
             setClasses(classList);
             
             // Load annotated images
-            const annotatedRes = await api.post('/get_annotated_images', { dataset_path: path });
-            const annotatedList = annotatedRes.data.annotated_images || [];
+            const annotatedRes = await api.post('/get_annotated_images', { dataset_path: path, compact: true });
+            const annotatedList = expandListing(annotatedRes.data, 'annotated_images');
             setAnnotatedImages(new Set(annotatedList));
             
             // Set first image as current if available
@@ -0,0 +1,68 @@
+// Enforce the backend import-time budget.
+// Runs `python -X importtime -c "import backend.main"` and fails if the
+// backend takes longer than the budget to import, or if a lazy subsystem
+// (PIL, yaml, exporter, Vision LLM) is imported eagerly at startup.
+const { spawnSync } = require('child_process');
+const path = require('path');
+
+const BUDGET_MS = parseInt(process.env.IMPORT_BUDGET_MS || '1000', 10);
+const RUNS = parseInt(process.env.IMPORT_BUDGET_RUNS || '3', 10);
+const LAZY_MODULES = ['PIL.Image', 'yaml', 'numpy', 'backend.exporter', 'requests'];
+
+const pythonCmd = process.env.PYTHON || (process.platform === 'win32' ? 'python' : 'python3');
+const appDir = path.join(__dirname, '..');
+
+function measure() {
+    const result = spawnSync(pythonCmd, ['-X', 'importtime', '-c', 'import backend.main'], {
+        cwd: appDir,
+        encoding: 'utf-8',
+        timeout: 30000
+    });
+    if (result.error || result.status !== 0) {
+        console.error('❌ Could not import backend.main');
+        console.error(result.error ? result.error.message : result.stderr);
+        process.exit(1);
+    }
+
+    // Lines look like: "import time:   self [us] | cumulative | imported package"
+    const modules = {};
+    for (const line of result.stderr.split('\n')) {
+        const match = line.match(/^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|\s+(.+)$/);
+        if (match) {
+            modules[match[3].trim()] = parseInt(match[2], 10) / 1000;
+        }
+    }
+    return modules;
+}
+
+const timings = [];
+let eager = [];
+for (let i = 0; i < RUNS; i++) {
+    const modules = measure();
+    if (modules['backend.main'] === undefined) {
+        console.error('❌ backend.main not found in import-time output');
+        process.exit(1);
+    }
+    timings.push(modules['backend.main']);
+    eager = LAZY_MODULES.filter(name => modules[name] !== undefined);
+}
+
+// Best of N runs filters out noise from a cold disk cache
+const best = Math.min(...timings);
+console.log(`backend.main import time: ${best.toFixed(1)} ms (best of ${RUNS}, budget ${BUDGET_MS} ms)`);
+
+let failed = false;
+if (eager.length > 0) {
+    console.error(`❌ Lazy subsystems imported at startup: ${eager.join(', ')}`);
+    failed = true;
+}
+if (best > BUDGET_MS) {
+    console.error(`❌ Import-time budget exceeded by ${(best - BUDGET_MS).toFixed(1)} ms`);
+    failed = true;
+}
+
+if (failed) {
+    process.exit(1);
+}
+console.log('✓ Backend startup is within budget');
+process.exit(0);